@@ -1,261 +1,241 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, Response, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, MissingPerson, FoundPerson, SightingReport, PasswordResetToken
+from models import db, User, MissingPerson, FoundPerson, SightingReport
+from search import ensure_search_index, search_cases, highlight_markup, row_key
+from pagination import fetch_page, page_size
+from migrations import run_migrations, pending_migrations
+from database import init_database, read_only, RoutingSession
+from user_cache import init_user_cache, load_user_snapshot
+from assets import init_assets, build_assets
+from page_cache import init_page_cache, cached_page, fragment, page_cache
+from compression import init_compression
+from serverless import init_template_cache, compile_templates, prepare_once
+from instrumentation import init_instrumentation, metrics_response, timed, METRICS
+from events import ensure_change_log, get_broker, init_change_log_purge, purge_change_log, stream as event_stream, Subscription
+from sightings import submit_sightings, review_queue, queue_key, set_status, SIGHTING_STATUSES, MAX_BATCH
+from geo import (ensure_geo_index, gazetteer, geocode_missing, within_radius, within_box, filter_sightings,
+                 sighting_clusters, parse_box, parse_point, Gazetteer, MAP_STATUSES, MAX_CLUSTER_ZOOM, MAX_RADIUS_KM)
 from datetime import datetime
 import os
 from werkzeug.utils import secure_filename
-from PIL import Image
-import uuid
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from images import open_upload, upload_basename, save_upload, is_original, photo_path, filename_digest, schedule_renditions, rendition_url, rendition_urls, srcset, get_executor
+from name_match import init_name_matching, matches_for_case, matches_for_found, DEFAULT_MIN_SCORE
+from facets import ensure_facets, facet_counts, region_names, case_totals, RECENT_DAYS, MAX_RECENT_DAYS
+from export import EXPORT_FORMATS, ensure_change_tracking, parse_since, export_chunks, export_etag, export_watermark, next_since
+from mailer import SMTPConnection, render_email, duration_text, enqueue_email, deliver_now, send_now, start_mail_worker, drain
+from reset_tokens import issue_reset_token, resolve_reset_token, purge_reset_tokens, start_purge_worker
 import secrets
+import json
+import time
+import click
 from datetime import timedelta
+from functools import wraps
+from markupsafe import Markup
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'loket-secret-key-2024'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///loket.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///loket.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Cold-start profile for serverless hosts (see serverless.py); on by default on Vercel
+SERVERLESS = os.environ.get('SERVERLESS', '1' if os.environ.get('VERCEL') else '0') == '1'
+app.config['SERVERLESS'] = SERVERLESS
+# Compiled templates kept here across processes ('' = compile in memory only)
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', '/tmp/loket-templates' if SERVERLESS else '')
+# Check the schema and seed data on the first request instead of relying on `python app.py`
+app.config['ENSURE_SCHEMA'] = os.environ.get('ENSURE_SCHEMA', '1' if SERVERLESS else '0') == '1'
+# SQLite tuning, see database.py: 'wal' for concurrent workers, 'default' for stock SQLite
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'wal')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_READ_ROUTING'] = os.environ.get('DB_READ_ROUTING', '0') == '1'
+# Server-Timing header and /metrics; SLOW_REQUEST_MS > 0 also logs slow requests with their SQL
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '1') == '1'
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 0))
+# Bearer token a scraper must send for /metrics (admins may just log in); '' = /metrics off
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Logged-in users cached per worker (see user_cache.py): entries kept and seconds each stays fresh
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1000))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+# Rendered home/browse pages and card fragments, see page_cache.py
+app.config['PAGE_CACHE'] = os.environ.get('PAGE_CACHE', '1') == '1'
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 500))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+app.config['PAGE_CACHE_VERSION_SECONDS'] = float(os.environ.get('PAGE_CACHE_VERSION_SECONDS', 1.0))
 
 # File upload configuration
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# Uploads as received, EXIF and GPS included; kept out of the static tree and never served
+app.config['ORIGINALS_FOLDER'] = os.environ.get(
+    'ORIGINALS_FOLDER', '/tmp/loket-originals' if SERVERLESS else os.path.join(app.instance_path, 'originals'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 0 if SERVERLESS else 2))  # 0 = process inline
+# Photos with more pixels are refused before decoding (see images.py)
+app.config['MAX_UPLOAD_PIXELS'] = int(os.environ.get('MAX_UPLOAD_PIXELS', 50_000_000))
+# How uploads are handed to clients: '' (Flask streams the file), 'x-sendfile'
+# (Apache/lighttpd) or 'x-accel' (nginx, internal location below)
+app.config['UPLOAD_SENDFILE'] = os.environ.get('UPLOAD_SENDFILE', '')
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads/')
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SENDFILE'] == 'x-sendfile'
+UPLOAD_MAX_AGE = 365 * 24 * 60 * 60  # upload names never change content
+# gzip/brotli for HTML and JSON responses of at least COMPRESSION_MIN_SIZE bytes (see compression.py)
+app.config['COMPRESSION'] = os.environ.get('COMPRESSION', '1') == '1'
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+# Rebuild minified, fingerprinted CSS/JS at startup when the sources changed (see assets.py)
+app.config['ASSET_BUILD'] = os.environ.get('ASSET_BUILD', '0' if SERVERLESS else '1') == '1'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# Place-name file used to geocode new reports (CSV or GeoNames dump, see geo.py); '' = off
+app.config['GAZETTEER'] = os.environ.get('GAZETTEER', '')
+MAX_MAP_POINTS = 2000
+# How often each worker checks the change log for /api/stream subscribers
+app.config['EVENT_POLL_SECONDS'] = float(os.environ.get('EVENT_POLL_SECONDS', 1.0))
+# Seconds between purges of old change-log rows; 0 = only `flask purge-events`
+app.config['EVENT_PURGE_SECONDS'] = int(os.environ.get('EVENT_PURGE_SECONDS', 0 if SERVERLESS else 600))
+# How often each worker looks for new cases/found persons to match names against
+app.config['NAME_MATCH_TTL'] = int(os.environ.get('NAME_MATCH_TTL', 60))
+# Tips from the same contact about the same case this close together are collapsed
+app.config['SIGHTING_DEDUP_MINUTES'] = int(os.environ.get('SIGHTING_DEDUP_MINUTES', 30))
 
 # Gmail Configuration for Loket
 EMAIL_CONFIG = {
-    'SMTP_SERVER': 'smtp.gmail.com',
-    'SMTP_PORT': 587,
-    'SENDER_EMAIL': 'myssing.help@gmail.com',  # Your dedicated Gmail
-    'SENDER_PASSWORD': 'foql qinw zomt frvm',  # You'll generate this from Gmail
+    'SMTP_SERVER': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+    'SMTP_PORT': int(os.environ.get('SMTP_PORT', 587)),
+    'SMTP_USE_TLS': os.environ.get('SMTP_USE_TLS', '1') == '1',
+    'SENDER_EMAIL': os.environ.get('SENDER_EMAIL', 'myssing.help@gmail.com'),  # Your dedicated Gmail
+    'SENDER_PASSWORD': os.environ.get('SENDER_PASSWORD', 'foql qinw zomt frvm'),  # You'll generate this from Gmail
     'SENDER_NAME': 'Mysing Missing Persons'
 }
+# Who delivers the outbox: 'thread' (a background thread in each web worker),
+# 'inline' (the request that queues a message sends it; serverless, where threads
+# are frozen after the response) or 'external' (only the `flask mail-worker` command)
+app.config['MAIL_WORKER'] = os.environ.get('MAIL_WORKER', 'inline' if SERVERLESS else 'thread')
+# Reset links: 'signed' (stateless, nothing stored) or 'table' (password_reset_token rows)
+app.config['RESET_TOKEN_MODE'] = os.environ.get('RESET_TOKEN_MODE', 'signed')
+app.config['RESET_TOKEN_MAX_AGE'] = int(os.environ.get('RESET_TOKEN_MAX_AGE', 3600))
+# Seconds between purges of expired/used token rows; 0 = only `flask purge-reset-tokens`
+app.config['RESET_TOKEN_PURGE_SECONDS'] = int(os.environ.get('RESET_TOKEN_PURGE_SECONDS', 0 if SERVERLESS else 3600))
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('static/images', exist_ok=True)
+# Ensure upload directory exists (a serverless bundle is read-only)
+try:
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['ORIGINALS_FOLDER'], exist_ok=True)
+    os.makedirs('static/images', exist_ok=True)
+except OSError as e:
+    print(f"Upload directory unavailable: {e}")
 
 # Initialize extensions
-db.init_app(app)
+init_database(app, db)
+init_instrumentation(app)
+init_user_cache(app, RoutingSession)
+init_page_cache(app, RoutingSession)
+init_name_matching(app, RoutingSession)
+if app.config['EVENT_PURGE_SECONDS']:
+    init_change_log_purge(app)
+METRICS.append(page_cache)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# Versioned CSS/JS, served precompressed from /assets/
+init_assets(app)
+init_compression(app)
+if app.config['TEMPLATE_CACHE_DIR']:
+    init_template_cache(app, app.config['TEMPLATE_CACHE_DIR'])
+
+# Photo rendition helpers for templates
+app.jinja_env.globals['rendition_url'] = rendition_url
+app.jinja_env.filters['srcset'] = srcset
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Name and role come from a per-worker cache; the User row loads on first other use
+    return load_user_snapshot(user_id)
+
+def admin_required(view):
+    """Only let admins through; everyone else gets a 403"""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.role != 'admin':
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def process_image(file, person_id):
-    """Process and save the uploaded image"""
+    """Validate and save the uploaded image as-is, outside the static tree.
+
+    Only the header is parsed here; resizing and re-encoding happen in the
+    background image workers (see ``images.schedule_renditions``).
+    """
     if file and allowed_file(file.filename):
-        # Generate unique filename
+        image_format = open_upload(file.stream, ALLOWED_EXTENSIONS | {'jpeg'}, app.config['MAX_UPLOAD_PIXELS'])
+        if not image_format:
+            print(f"Rejected upload {file.filename!r}: not a supported image or too large")
+            return None
+        
+        # Content-addressed filename: the digest of the bytes is part of the name
         file_ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"missing_person_{person_id}_{uuid.uuid4().hex[:8]}.{file_ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        # Open and process image
         try:
-            image = Image.open(file.stream)
-            
-            # Convert to RGB if necessary
-            if image.mode in ('RGBA', 'P'):
-                image = image.convert('RGB')
-            
-            # Resize image to reasonable dimensions (max 800x800)
-            image.thumbnail((800, 800), Image.Resampling.LANCZOS)
-            
-            # Save processed image
-            image.save(filepath, 'JPEG', quality=85, optimize=True)
-            
-            return filename
+            return save_upload(file.stream, app.config['ORIGINALS_FOLDER'], upload_basename(person_id), file_ext)
         except Exception as e:
-            print(f"Error processing image: {e}")
+            print(f"Error saving image: {e}")
             return None
     return None
 
 def send_password_reset_email(recipient_email, reset_url, user_name):
     """
-    Send password reset email using Gmail SMTP
+    Queue the password reset email for the delivery worker (or send it now when MAIL_WORKER is inline)
     """
     try:
-        # Create message
-        message = MIMEMultipart()
-        message['From'] = f"{EMAIL_CONFIG['SENDER_NAME']} <{EMAIL_CONFIG['SENDER_EMAIL']}>"
-        message['To'] = recipient_email
-        message['Subject'] = "Reset Your Mysing Password"
-        
-        # Beautiful email template (keep the same HTML content)
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>
-                body {{ 
-                    font-family: 'Inter', Arial, sans-serif; 
-                    line-height: 1.6; 
-                    color: #333; 
-                    margin: 0; 
-                    padding: 0; 
-                    background: #f5f5f5;
-                }}
-                .container {{ 
-                    max-width: 600px; 
-                    margin: 0 auto; 
-                    background: white;
-                    border-radius: 10px;
-                    overflow: hidden;
-                    box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                }}
-                .header {{ 
-                    background: #0077B6; 
-                    color: white; 
-                    padding: 30px 20px; 
-                    text-align: center; 
-                }}
-                .header h1 {{
-                    margin: 0;
-                    font-size: 28px;
-                    font-weight: 700;
-                }}
-                .header p {{
-                    margin: 5px 0 0 0;
-                    opacity: 0.9;
-                }}
-                .content {{ 
-                    padding: 30px; 
-                }}
-                .button {{ 
-                    display: inline-block; 
-                    background: #0077B6; 
-                    color: white; 
-                    padding: 14px 28px; 
-                    text-decoration: none; 
-                    border-radius: 8px; 
-                    margin: 20px 0; 
-                    font-weight: 600;
-                    font-size: 16px;
-                    transition: all 0.3s ease;
-                }}
-                .button:hover {{
-                    background: #005a8c;
-                    transform: translateY(-2px);
-                    box-shadow: 0 4px 12px rgba(0, 119, 182, 0.3);
-                }}
-                .footer {{ 
-                    text-align: center; 
-                    margin-top: 30px; 
-                    padding-top: 20px;
-                    border-top: 1px solid #e0e0e0;
-                    color: #666; 
-                    font-size: 14px;
-                }}
-                .security-note {{
-                    background: #E6F2F9;
-                    padding: 15px;
-                    border-radius: 8px;
-                    margin: 20px 0;
-                    border-left: 4px solid #0077B6;
-                }}
-                .logo {{
-                    font-size: 24px;
-                    font-weight: 700;
-                    color: #0077B6;
-                    margin-bottom: 10px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <div style="font-size: 48px; margin-bottom: 10px;">🔍</div>
-                    <h1>mysing</h1>
-                    <p>Missing Persons Identification & Recovery</p>
-                </div>
-                <div class="content">
-                    <h2 style="color: #0077B6; margin-top: 0;">Password Reset Request</h2>
-                    
-                    <p>Hello <strong>{user_name}</strong>,</p>
-                    
-                    <p>We received a request to reset your password for your Loket account. Click the button below to create a new secure password:</p>
-                    
-                    <div style="text-align: center;">
-                        <a href="{reset_url}" class="button">Reset Your Password</a>
-                    </div>
-                    
-                    <div class="security-note">
-                        <strong>⚠️ Important Security Note:</strong>
-                        <p>This password reset link will expire in <strong>1 hour</strong> for your security. If you didn't request this reset, please ignore this email - your account remains safe.</p>
-                    </div>
-                    
-                    <p>If the button doesn't work, copy and paste this link into your browser:</p>
-                    <p style="word-break: break-all; background: #f5f5f5; padding: 10px; border-radius: 5px; font-size: 14px;">
-                        {reset_url}
-                    </p>
-                    
-                    <div class="footer">
-                        <div class="logo">Mysing</div>
-                        <p>Bringing hope to families • Reuniting loved ones</p>
-                        <p>If you need help, reply to this email or contact support</p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text version for email clients that don't support HTML
-        text = f"""
-        LOKET - Password Reset Request
-        
-        Hello {user_name},
+        text, html = render_email('password_reset', user_name=user_name, reset_url=reset_url,
+                                  expires_in=duration_text(app.config['RESET_TOKEN_MAX_AGE']))
+        inline = app.config['MAIL_WORKER'] == 'inline'
+        email = enqueue_email(recipient_email, "Reset Your Mysing Password", text, html, claimed=inline)
         
-        We received a request to reset your password for your Loket account.
+        if inline:
+            # A failed send stays in the outbox for `flask mail-worker`
+            if deliver_now(email, EMAIL_CONFIG):
+                print(f"✅ Password reset email sent to {recipient_email}")
+            return True
+        if app.config['MAIL_WORKER'] == 'thread':
+            start_mail_worker(app, EMAIL_CONFIG)
         
-        Reset your password here: {reset_url}
-        
-        This link expires in 1 hour for security reasons.
-        
-        If you didn't request this reset, please ignore this email.
-        
-        Thank you for helping us reunite families,
-        
-        The mysing Team
-        Bringing hope to families • Reuniting loved ones
-        """
-        
-        # Add both HTML and plain text versions
-        message.attach(MIMEText(text, 'plain'))
-        message.attach(MIMEText(html, 'html'))
-        
-        # Create SMTP session
-        server = smtplib.SMTP(EMAIL_CONFIG['SMTP_SERVER'], EMAIL_CONFIG['SMTP_PORT'])
-        server.starttls()  # Enable security
-        server.login(EMAIL_CONFIG['SENDER_EMAIL'], EMAIL_CONFIG['SENDER_PASSWORD'])
-        
-        # Send email
-        server.send_message(message)
-        server.quit()
-        
-        print(f"✅ Password reset email sent to {recipient_email}")
+        print(f"📬 Password reset email queued for {recipient_email}")
         return True
         
     except Exception as e:
-        print(f"❌ Error sending email to {recipient_email}: {e}")
+        print(f"❌ Error queueing email to {recipient_email}: {e}")
         return False
 
 # Create tables and sample data
+def ensure_schema():
+    """Create missing tables, apply migrations and set up every trigger-maintained index.
+
+    Returns the migrations applied. Needs an app context.
+    """
+    db.create_all()
+    ran = run_migrations()
+    ensure_search_index()
+    ensure_geo_index()
+    ensure_change_log()
+    ensure_change_tracking()
+    ensure_facets()
+    page_cache.ensure_triggers()
+    return ran
+
 def init_db():
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables, indexes and triggers
+        ensure_schema()
         
         # Check if we need to add sample data
         if not User.query.first():
@@ -297,14 +277,23 @@ def init_db():
             db.session.commit()
             print("Sample data created!")
 
+if app.config['ENSURE_SCHEMA']:
+    prepare_once(app, init_db)
+
 # Routes
 @app.route('/')
+@read_only
+@cached_page
 def index():
-    missing_persons = MissingPerson.query.filter_by(is_found=False).order_by(MissingPerson.date_reported.desc()).limit(6).all()
-    found_persons = FoundPerson.query.order_by(FoundPerson.date_added.desc()).limit(3).all()
-    return render_template('index.html', 
-                         missing_persons=missing_persons,
-                         found_persons=found_persons)
+    def render_sections():
+        missing_persons = MissingPerson.query.filter_by(is_found=False).order_by(MissingPerson.date_reported.desc()).limit(6).all()
+        found_persons = FoundPerson.query.order_by(FoundPerson.date_added.desc()).limit(3).all()
+        return Markup(render_template('index_sections.html',
+                                      missing_persons=missing_persons,
+                                      found_persons=found_persons,
+                                      totals=case_totals()))
+    
+    return render_template('index.html', sections=fragment(('index',), render_sections))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -363,8 +352,10 @@ def forgot_password():
         
         if user:
             # Generate reset token
-            token = PasswordResetToken.generate_token(user.id)
-            reset_url = url_for('reset_password', token=token.token, _external=True)
+            token = issue_reset_token(user, app.config['RESET_TOKEN_MODE'], app.config['RESET_TOKEN_MAX_AGE'])
+            reset_url = url_for('reset_password', token=token, _external=True)
+            if app.config['RESET_TOKEN_PURGE_SECONDS']:
+                start_purge_worker(app, app.config['RESET_TOKEN_PURGE_SECONDS'])
             
             # Send email
             if send_password_reset_email(user.email, reset_url, user.name):
@@ -381,9 +372,9 @@ def forgot_password():
 
 @app.route('/reset-password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    reset_token = PasswordResetToken.query.filter_by(token=token).first()
+    user, reset_token = resolve_reset_token(token, app.config['RESET_TOKEN_MAX_AGE'])
     
-    if not reset_token or not reset_token.is_valid():
+    if user is None:
         flash('Invalid or expired reset link. Please request a new one.', 'error')
         return redirect(url_for('forgot_password'))
     
@@ -399,12 +390,12 @@ def reset_password(token):
             flash('Password must be at least 6 characters long.', 'error')
             return render_template('reset_password.html', token=token)
         
-        # Update user password
-        user = reset_token.user
+        # Update user password; the new hash also retires a signed token
         user.set_password(password)
         
-        # Mark token as used
-        reset_token.used = True
+        # Mark a stored token as used
+        if reset_token is not None:
+            reset_token.used = True
         
         db.session.commit()
         
@@ -414,27 +405,48 @@ def reset_password(token):
     return render_template('reset_password.html', token=token)
 
 @app.route('/browse')
+@read_only
+@cached_page
 def browse():
     region = request.args.get('region', '')
     query = request.args.get('q', '')
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit'))
     
-    missing_persons = MissingPerson.query.filter_by(is_found=False)
+    def render_cards():
+        try:
+            results = search_cases(query, region, cursor)
+        except ValueError:
+            # Stale or mangled cursor: start again from the first page
+            results = search_cases(query, region)
+        
+        rows, next_cursor = fetch_page(results, limit, row_key)
+        if not rows:
+            return Markup(''), None
+        snippets = {row.id: highlight_markup(row.snippet) for row in rows if row.snippet}
+        return Markup(render_template('browse_cards.html', missing_persons=rows, snippets=snippets)), next_cursor
     
-    if region:
-        missing_persons = missing_persons.filter_by(region=region)
+    # Cards show a call button to logged-in visitors only
+    cards, next_cursor = fragment(('browse_cards', query, region, cursor, limit, current_user.is_authenticated),
+                                  render_cards)
     
-    if query:
-        missing_persons = missing_persons.filter(
-            (MissingPerson.name.ilike(f'%{query}%')) | 
-            (MissingPerson.description.ilike(f'%{query}%'))
-        )
+    # "Load more" requests only need the next batch of cards
+    if request.args.get('fragment'):
+        response = app.make_response(str(cards))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
-    missing_persons = missing_persons.order_by(MissingPerson.date_reported.desc()).all()
-    regions = db.session.query(MissingPerson.region).distinct().all()
-    regions = [r[0] for r in regions if r[0]]
+    # Counts come from the summary tables unless searching; every region stays
+    # in the filter, with 0 when none of its cases match
+    facets = fragment(('facets', query, region), lambda: facet_counts(query, region))
+    region_counts = {entry['value']: entry['count'] for entry in facets['region']}
+    regions = [(name, region_counts.get(name, 0)) for name in fragment(('regions',), region_names)]
     
     return render_template('browse.html', 
-                         missing_persons=missing_persons,
+                         cards=cards,
+                         next_cursor=next_cursor,
+                         facets=facets,
                          regions=regions,
                          selected_region=region,
                          search_query=query)
@@ -457,57 +469,96 @@ def report_missing():
             contact_email=request.form.get('contact_email'),
             reported_by=current_user.id
         )
+        if app.config['GAZETTEER']:
+            point = gazetteer(app.config['GAZETTEER']).lookup(missing_person.last_seen)
+            if point:
+                missing_person.last_seen_lat, missing_person.last_seen_lon = point
         
         db.session.add(missing_person)
-        db.session.flush()  # This assigns an ID without committing
+        db.session.commit()
         
-        # Handle file upload
+        # Handle file upload outside the insert transaction; the case shows the
+        # default avatar until the background workers have produced the renditions
         file = request.files.get('photo')
         if file and file.filename:
-            filename = process_image(file, missing_person.id)
+            with timed('image'):
+                filename = process_image(file, missing_person.id)
             if filename:
                 missing_person.photo_filename = filename
-        
-        db.session.commit()
+                db.session.commit()
+                try:
+                    schedule_renditions(app, missing_person.id, filename)
+                except Exception as e:
+                    # The case is saved; `flask render-photos` picks the photo up later
+                    print(f"Error scheduling renditions for case {missing_person.id}: {e}")
         
         flash('Missing person report submitted successfully!', 'success')
-        return redirect(url_for('index'))
+        # The case page checks the new photo against existing cases
+        return redirect(url_for('case_details', person_id=missing_person.id))
     
     return render_template('report.html')
 
 @app.route('/profile')
 @login_required
+@read_only
 def profile():
     user_reports = MissingPerson.query.filter_by(reported_by=current_user.id).order_by(MissingPerson.date_reported.desc()).all()
     return render_template('profile.html', user_reports=user_reports)
 
 @app.route('/case-details/<int:person_id>')
+@read_only
 def case_details(person_id):
-    missing_person = MissingPerson.query.get_or_404(person_id)
+    # Load the reporter in the same query; the page always shows their name
+    missing_person = MissingPerson.query.options(joinedload(MissingPerson.reporter)) \
+        .filter_by(id=person_id).first_or_404()
     return render_template('case_details.html', person=missing_person)
 
 # Serve uploaded files
 @app.route('/static/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if is_original(filename):
+        abort(404)  # originals keep their EXIF data and are never public
+    
+    # Content-addressed names carry their own strong ETag; legacy names fall
+    # back to Werkzeug's mtime/size based one
+    etag = filename_digest(filename) or True
+    
+    if app.config['UPLOAD_SENDFILE'] == 'x-accel':
+        # nginx serves the bytes (and handles Range/304) from an internal location
+        if not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))):
+            abort(404)
+        # e.g. location /_protected_uploads/ { internal; alias /srv/loket/static/uploads/; }
+        response = app.response_class()
+        response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'] + secure_filename(filename)
+        del response.headers['Content-Type']  # let nginx pick it from the file
+    else:
+        # conditional=True answers If-None-Match/If-Modified-Since with 304
+        # and serves byte ranges
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       conditional=True, etag=etag, max_age=UPLOAD_MAX_AGE)
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 # Test email setup route
 @app.route('/test-email-setup')
 def test_email_setup():
     """Test the email configuration"""
     try:
-        # Test connection
-        server = smtplib.SMTP(EMAIL_CONFIG['SMTP_SERVER'], EMAIL_CONFIG['SMTP_PORT'])
-        server.starttls()
-        server.login(EMAIL_CONFIG['SENDER_EMAIL'], EMAIL_CONFIG['SENDER_PASSWORD'])
-        server.quit()
-        
-        # Test email sending
-        test_success = send_password_reset_email(
-            'test@example.com', 
-            'https://example.com/reset?token=test', 
-            'Test User'
-        )
+        # Test connection, then send one sample email over it; the outbox is
+        # left to the delivery worker
+        connection = SMTPConnection(EMAIL_CONFIG)
+        connection.connect()
+        try:
+            text, html = render_email('password_reset', user_name='Test User',
+                                      reset_url='https://example.com/reset?token=test',
+                                      expires_in=duration_text(app.config['RESET_TOKEN_MAX_AGE']))
+            test_success = send_now(connection, EMAIL_CONFIG, 'test@example.com',
+                                    "Reset Your Mysing Password", text, html)
+        finally:
+            connection.close()
         
         if test_success:
             return """
@@ -535,41 +586,647 @@ def test_email_setup():
         """
 
 # API endpoints for AJAX
+def serialize_case(person):
+    """Convert a ``search_cases`` row to the JSON-serializable format used by the API"""
+    return {
+        'id': person.id,
+        'name': person.name,
+        'age': person.age,
+        'gender': person.gender,
+        'last_seen': person.last_seen,
+        'last_seen_date': person.last_seen_date.strftime('%Y-%m-%d'),
+        'region': person.region,
+        'description': person.description,
+        'photo_url': person.photo_url,
+        'photo_renditions': rendition_urls(person.photo_renditions),
+        'reporter_name': person.reporter_name,
+        'snippet': highlight_markup(person.snippet)
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this worker process (routes, timings, SQL): scrapers and admins only"""
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    sent = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    is_admin = current_user.is_authenticated and current_user.role == 'admin'
+    if not (is_admin or secrets.compare_digest(sent.encode(), token.encode())):
+        abort(403)
+    return metrics_response()
+
 @app.route('/api/search')
+@read_only
 def api_search():
     query = request.args.get('q', '')
     region = request.args.get('region', '')
     
-    missing_persons = MissingPerson.query.filter_by(is_found=False)
+    try:
+        results = search_cases(query, region, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    if query:
-        missing_persons = missing_persons.filter(
-            (MissingPerson.name.ilike(f'%{query}%')) | 
-            (MissingPerson.description.ilike(f'%{query}%'))
-        )
+    # Opt-in NDJSON streaming: one case per line, written as rows are read
+    if request.args.get('format') == 'ndjson':
+        limit = request.args.get('limit', type=int)
+        if limit:
+            results = results.limit(limit)
+        
+        def generate():
+            for row in results.yield_per(100):
+                yield json.dumps(serialize_case(row)) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    rows, next_cursor = fetch_page(results, page_size(request.args.get('limit'), default=50), row_key)
+    
+    response = {
+        'results': [serialize_case(row) for row in rows],
+        'next_cursor': next_cursor
+    }
+    # Opt-in facet counts for the same query and region
+    if request.args.get('facets'):
+        try:
+            response['facets'] = facet_counts(query, region, facet_days())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify(response)
+
+def facet_days():
+    """Windows of the "reported in the last N days" facet from ``?days=7,30``"""
+    value = request.args.get('days')
+    if not value:
+        return RECENT_DAYS
+    try:
+        days = sorted({int(part) for part in value.split(',') if part.strip()})
+    except ValueError:
+        raise ValueError('days must be a comma-separated list of whole numbers')
+    if not days or not all(1 <= n <= MAX_RECENT_DAYS for n in days):
+        raise ValueError(f'days must be between 1 and {MAX_RECENT_DAYS}')
+    return days
+
+@app.route('/api/facets')
+@read_only
+def api_facets():
+    """Case counts by region, gender, age band and recency for a search"""
+    try:
+        days = facet_days()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(facet_counts(request.args.get('q', ''), request.args.get('region', ''), days))
+
+@app.route('/api/export')
+@read_only
+def api_export():
+    """All open cases (or every case changed after ?since=) as streamed CSV or JSONL"""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Unchanged since the client's copy: one cached version lookup, no scan
+    etag = export_etag(file_format, since)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    watermark = export_watermark()
+    response = Response(stream_with_context(export_chunks(file_format, since)),
+                        mimetype=EXPORT_FORMATS[file_format])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Content-Disposition'] = f'attachment; filename="cases.{file_format}"'
+    if watermark:
+        # Whole seconds for Last-Modified; the next ?since= overlaps for late commits
+        response.last_modified = watermark.replace(microsecond=0) + timedelta(seconds=1)
+        response.headers['X-Export-Watermark'] = next_since(watermark)
+        if (not request.if_none_match and request.if_modified_since
+                and response.last_modified <= request.if_modified_since):
+            response = Response(status=304, headers={'ETag': response.headers['ETag'],
+                                                     'Last-Modified': response.headers['Last-Modified']})
+    return response
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: new cases, cases found/reopened and (for logged-in users) new sightings"""
+    region = request.args.get('region') or None
+    case_id = request.args.get('case_id', type=int)
+    kinds = {'case', 'found', 'reopened'}
+    if current_user.is_authenticated:
+        kinds.add('sighting')
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    
+    subscription = Subscription(region=region, case_id=case_id, kinds=kinds)
+    response = Response(event_stream(get_broker(app), subscription, last_event_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: pass events through unbuffered
+    return response
+
+def serialize_photo_matches(matches):
+    return [{
+        'id': person.id,
+        'name': person.name,
+        'age': person.age,
+        'region': person.region,
+        'photo_url': person.photo_url,
+        'url': url_for('case_details', person_id=person.id),
+        'distance': distance
+    } for person, distance in matches]
+
+@app.route('/api/photo-matches/<int:person_id>')
+@read_only
+def api_photo_matches(person_id):
+    """Open cases whose photo looks like this case's photo"""
+    from photo_hash import find_similar, DEFAULT_MAX_DISTANCE
+    person = MissingPerson.query.get_or_404(person_id)
+    max_distance = request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int)
     
-    if region:
-        missing_persons = missing_persons.filter_by(region=region)
-    
-    results = missing_persons.order_by(MissingPerson.date_reported.desc()).all()
-    
-    # Convert to JSON-serializable format
-    results_data = []
-    for person in results:
-        results_data.append({
-            'id': person.id,
-            'name': person.name,
-            'age': person.age,
-            'gender': person.gender,
-            'last_seen': person.last_seen,
-            'last_seen_date': person.last_seen_date.strftime('%Y-%m-%d'),
-            'region': person.region,
-            'description': person.description,
-            'photo_url': person.photo_url,
-            'reporter_name': person.reporter.name
-        })
-    
-    return jsonify(results_data)
+    if person.photo_hash is None:
+        # Still being processed by the image workers, or no photo at all
+        status = 'pending' if person.photo_filename and not person.photo_renditions else 'no-photo'
+        return jsonify({'status': status, 'matches': []})
+    
+    matches = find_similar(person.photo_hash, max_distance, exclude=person.id)
+    return jsonify({'status': 'ready', 'matches': serialize_photo_matches(matches)})
+
+@app.route('/api/found-persons/<int:found_id>/photo-matches')
+@read_only
+def api_found_photo_matches(found_id):
+    """Open cases whose photo looks like a found person's photo"""
+    from photo_hash import find_similar, DEFAULT_MAX_DISTANCE
+    found_person = FoundPerson.query.get_or_404(found_id)
+    max_distance = request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int)
+    if found_person.photo_hash is None:
+        return jsonify({'status': 'no-photo', 'matches': []})
+    
+    matches = find_similar(found_person.photo_hash, max_distance)
+    return jsonify({'status': 'ready', 'matches': serialize_photo_matches(matches)})
+
+@app.route('/api/photo-matches', methods=['POST'])
+@login_required
+def api_photo_matches_upload():
+    """Check an uploaded photo against every open case"""
+    from photo_hash import find_similar, hash_file, DEFAULT_MAX_DISTANCE
+    file = request.files.get('photo')
+    if not file or not open_upload(file.stream, ALLOWED_EXTENSIONS | {'jpeg'}, app.config['MAX_UPLOAD_PIXELS']):
+        megapixels = app.config['MAX_UPLOAD_PIXELS'] // 1_000_000
+        return jsonify({'error': f'Upload a JPG, PNG, GIF or WEBP image of at most {megapixels} megapixels '
+                                 f'as "photo"'}), 400
+    
+    with timed('image'):
+        photo_hash = hash_file(file.stream)
+    max_distance = request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int)
+    matches = find_similar(photo_hash, max_distance)
+    return jsonify({'status': 'ready', 'matches': serialize_photo_matches(matches)})
+
+def name_match_options():
+    """``limit`` and ``min_score`` from the query string"""
+    min_score = request.args.get('min_score', DEFAULT_MIN_SCORE, type=float)
+    if not 0 <= min_score <= 1:
+        raise ValueError('min_score must be between 0 and 1')
+    return page_size(request.args.get('limit'), default=20), min_score
+
+@app.route('/api/found-persons/<int:found_id>/name-matches')
+@read_only
+def api_found_name_matches(found_id):
+    """Open cases whose name, age and dates fit a found person, best first"""
+    found_person = FoundPerson.query.get_or_404(found_id)
+    try:
+        limit, min_score = name_match_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    matches = matches_for_found(found_person, limit, min_score)
+    return jsonify({'matches': [{
+        'id': person.id,
+        'name': person.name,
+        'age': person.age,
+        'region': person.region,
+        'last_seen_date': person.last_seen_date.strftime('%Y-%m-%d'),
+        'photo_url': person.photo_url,
+        'url': url_for('case_details', person_id=person.id),
+        'score': score,
+        'scores': parts
+    } for person, score, parts in matches]})
+
+@app.route('/api/cases/<int:person_id>/name-matches')
+@read_only
+def api_case_name_matches(person_id):
+    """Found persons whose name, age and dates fit this case, best first"""
+    person = MissingPerson.query.get_or_404(person_id)
+    try:
+        limit, min_score = name_match_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    matches = matches_for_case(person, limit, min_score)
+    return jsonify({'matches': [{
+        'id': found_person.id,
+        'name': found_person.name,
+        'age': found_person.age,
+        'found_date': found_person.found_date.strftime('%Y-%m-%d'),
+        'photo_url': found_person.photo_url,
+        'score': score,
+        'scores': parts
+    } for found_person, score, parts in matches]})
+
+def serialize_sighting(sighting, distance=None):
+    data = {
+        'id': sighting.id,
+        'missing_person_id': sighting.missing_person_id,
+        'location': sighting.location,
+        'latitude': sighting.latitude,
+        'longitude': sighting.longitude,
+        'sighting_date': sighting.sighting_date.isoformat(),
+        'status': sighting.status
+    }
+    if distance is not None:
+        data['distance_km'] = round(distance, 3)
+    return data
+
+def sighting_statuses():
+    """``status`` filter from the query string (comma-separated), or the map default"""
+    statuses = [s for s in request.args.get('status', '').split(',') if s]
+    return statuses or MAP_STATUSES
+
+@app.route('/api/cases/nearby')
+@read_only
+def api_cases_nearby():
+    """Open cases last seen within radius_km of lat/lon, nearest first"""
+    try:
+        lat, lon, radius_km = parse_point(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    cases = MissingPerson.query.filter(MissingPerson.is_found == False)
+    nearby = within_radius(cases, MissingPerson, lat, lon, radius_km,
+                           limit=page_size(request.args.get('limit'), default=50))
+    return jsonify({'results': [{
+        'id': person.id,
+        'name': person.name,
+        'age': person.age,
+        'region': person.region,
+        'last_seen': person.last_seen,
+        'latitude': person.last_seen_lat,
+        'longitude': person.last_seen_lon,
+        'photo_url': person.photo_url,
+        'url': url_for('case_details', person_id=person.id),
+        'distance_km': round(distance, 3)
+    } for person, distance in nearby]})
+
+@app.route('/api/cases/<int:person_id>/sightings/nearby')
+@login_required
+@read_only
+def api_case_sightings_nearby(person_id):
+    """This case's sightings within radius_km of where the person was last seen"""
+    person = MissingPerson.query.get_or_404(person_id)
+    if person.last_seen_lat is None or person.last_seen_lon is None:
+        return jsonify({'status': 'not-geocoded', 'sightings': []})
+    
+    radius_km = request.args.get('radius_km', 5.0, type=float)
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        return jsonify({'error': f'radius_km must be above 0 and at most {MAX_RADIUS_KM}'}), 400
+    
+    sightings = filter_sightings(SightingReport.query, person.id, sighting_statuses())
+    nearby = within_radius(sightings, SightingReport, person.last_seen_lat, person.last_seen_lon, radius_km,
+                           limit=page_size(request.args.get('limit'), default=100))
+    return jsonify({'status': 'ready',
+                    'sightings': [serialize_sighting(s, distance) for s, distance in nearby]})
+
+@app.route('/api/sightings/nearby')
+@login_required
+@read_only
+def api_sightings_nearby():
+    """Sightings within radius_km of lat/lon, nearest first (optionally for one case_id)"""
+    try:
+        lat, lon, radius_km = parse_point(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sightings = filter_sightings(SightingReport.query, request.args.get('case_id', type=int),
+                                 sighting_statuses())
+    nearby = within_radius(sightings, SightingReport, lat, lon, radius_km,
+                           limit=page_size(request.args.get('limit'), default=100))
+    return jsonify({'sightings': [serialize_sighting(s, distance) for s, distance in nearby]})
+
+@app.route('/api/sightings/map')
+@login_required
+@read_only
+def api_sightings_map():
+    """Sightings inside a south/west/north/east box; clustered when zoom is given"""
+    try:
+        box = parse_box(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    case_id = request.args.get('case_id', type=int)
+    statuses = sighting_statuses()
+    
+    zoom = request.args.get('zoom', type=int)
+    if zoom is not None:
+        zoom = max(0, min(zoom, MAX_CLUSTER_ZOOM))
+        clusters = sighting_clusters(*box, zoom, case_id, statuses)
+        return jsonify({'zoom': zoom, 'clusters': [{
+            'latitude': cluster.latitude,
+            'longitude': cluster.longitude,
+            'count': cluster.count,
+            'sighting_id': cluster.sighting_id
+        } for cluster in clusters]})
+    
+    sightings = within_box(filter_sightings(SightingReport.query, case_id, statuses),
+                           SightingReport, *box)
+    rows = sightings.order_by(SightingReport.id).limit(MAX_MAP_POINTS + 1).all()
+    return jsonify({'sightings': [serialize_sighting(s) for s in rows[:MAX_MAP_POINTS]],
+                    'truncated': len(rows) > MAX_MAP_POINTS})
+
+def serialize_queued_sighting(sighting):
+    data = serialize_sighting(sighting)
+    data.update({
+        'details': sighting.details,
+        'reporter_name': sighting.reporter_name,
+        'reporter_contact': sighting.reporter_contact,
+        'date_reported': sighting.date_reported.isoformat(),
+        'duplicates': sighting.duplicates or 0
+    })
+    return data
+
+@app.route('/api/sightings', methods=['POST'])
+def api_submit_sightings():
+    """Accept one tip (a JSON object) or a batch (a list, or {"sightings": [...]})"""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and isinstance(payload.get('sightings'), list):
+        payload = payload['sightings']
+    records = payload if isinstance(payload, list) else [payload] if isinstance(payload, dict) else None
+    if not records:
+        return jsonify({'error': 'Send a sighting as a JSON object or a list of them'}), 400
+    if len(records) > MAX_BATCH:
+        return jsonify({'error': f'At most {MAX_BATCH} sightings per request'}), 413
+    
+    places = gazetteer(app.config['GAZETTEER']) if app.config['GAZETTEER'] else None
+    result = submit_sightings(records,
+                              reporter_id=current_user.id if current_user.is_authenticated else None,
+                              window=timedelta(minutes=app.config['SIGHTING_DEDUP_MINUTES']),
+                              places=places)
+    if not result['accepted'] and not result['duplicates']:
+        return jsonify(result), 400
+    return jsonify(result), 201 if result['accepted'] else 200
+
+@app.route('/api/admin/sightings')
+@admin_required
+@read_only
+def api_review_queue():
+    """Sightings in one status (default pending), newest first, optionally for one case_id"""
+    status = request.args.get('status', 'pending')
+    if status not in SIGHTING_STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(SIGHTING_STATUSES)}"}), 400
+    try:
+        queue = review_queue(status, request.args.get('case_id', type=int), request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows, next_cursor = fetch_page(queue, page_size(request.args.get('limit'), default=50), queue_key)
+    return jsonify({
+        'results': [serialize_queued_sighting(sighting) for sighting in rows],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/admin/sightings/status', methods=['POST'])
+@admin_required
+def api_review_update():
+    """Move many sightings to one status: {"ids": [...], "status": "reviewed"}"""
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+        return jsonify({'error': 'ids must be a non-empty list of sighting ids'}), 400
+    if len(ids) > MAX_BATCH:
+        return jsonify({'error': f'At most {MAX_BATCH} sightings per request'}), 413
+    try:
+        updated = set_status(ids, payload.get('status'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'updated': updated})
+
+@app.cli.command('photo-hashes')
+def photo_hashes_command():
+    """Compute perceptual hashes for photos uploaded before hashing existed."""
+    from photo_hash import hash_file, photo_index, to_signed
+    upload_dir = app.config['UPLOAD_FOLDER']
+    pending = []
+    for person in MissingPerson.query.filter(MissingPerson.photo_filename.isnot(None),
+                                             MissingPerson.photo_hash.is_(None)):
+        pending.append((person, photo_path(app.config, person.photo_filename)))
+    for found_person in FoundPerson.query.filter(FoundPerson.photo_url.like('/static/uploads/%'),
+                                                 FoundPerson.photo_hash.is_(None)):
+        filename = found_person.photo_url.rsplit('/', 1)[1]
+        pending.append((found_person, os.path.join(upload_dir, filename)))
+    
+    paths = [path for _, path in pending]
+    workers = app.config['IMAGE_WORKERS']
+    hashes = get_executor(workers).map(hash_file, paths, chunksize=32) if workers else map(hash_file, paths)
+    
+    hashed = 0
+    for (record, _), photo_hash in zip(pending, hashes):
+        if photo_hash is not None:
+            record.photo_hash = to_signed(photo_hash)
+            hashed += 1
+            if hashed % 500 == 0:
+                db.session.commit()
+    db.session.commit()
+    photo_index.invalidate()
+    print(f"✅ Hashed {hashed} of {len(pending)} photo(s)")
+
+@app.cli.command('mail-worker')
+@click.option('--once', is_flag=True, help='Deliver what is due now and exit.')
+@click.option('--interval', default=5, help='Seconds between polls of the outbox.')
+def mail_worker_command(once, interval):
+    """Deliver queued email over one persistent SMTP connection."""
+    connection = SMTPConnection(EMAIL_CONFIG)
+    try:
+        while True:
+            sent, failed = drain(app, EMAIL_CONFIG, connection)
+            if sent or failed:
+                print(f"📤 Sent {sent}, failed {failed}")
+            if once:
+                break
+            time.sleep(interval)
+    finally:
+        connection.close()
+
+@app.cli.command('purge-reset-tokens')
+def purge_reset_tokens_command():
+    """Delete expired and used password reset tokens."""
+    print(f"🧹 Purged {purge_reset_tokens()} reset token(s)")
+
+@app.cli.command('purge-events')
+def purge_events_command():
+    """Delete /api/stream change-log rows past their retention."""
+    print(f"🧹 Purged {purge_change_log()} change event(s)")
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create missing tables and apply pending migrations in place."""
+    ran = ensure_schema()
+    print(f"✅ Database up to date ({len(ran)} migration(s) applied)")
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List migrations that have not been applied yet."""
+    pending = pending_migrations()
+    for name in pending:
+        print(f"  pending: {name}")
+    print(f"{len(pending)} pending migration(s)")
+
+@app.cli.command('search-index')
+def search_index_command():
+    """Create the full-text search index and rebuild it from missing_person."""
+    if ensure_search_index(rebuild=True):
+        print("✅ Search index rebuilt")
+    else:
+        print("⚠️  FTS5 not available, searches will use ILIKE")
+
+@app.cli.command('facet-index')
+def facet_index_command():
+    """Create the case summary tables and recount them from missing_person."""
+    if ensure_facets(rebuild=True):
+        print("✅ Facet counts rebuilt")
+    else:
+        print("⚠️  Summary tables not available, facets will count cases directly")
+
+@app.cli.command('compile-templates')
+@click.option('--dir', 'directory', help='Cache directory (default: TEMPLATE_CACHE_DIR).')
+def compile_templates_command(directory):
+    """Compile every template into the bytecode cache, e.g. at build time."""
+    directory = directory or app.config['TEMPLATE_CACHE_DIR']
+    if not directory:
+        raise click.ClickException('Set TEMPLATE_CACHE_DIR or pass --dir')
+    init_template_cache(app, directory)
+    print(f"✅ Compiled {compile_templates(app)} template(s) into {directory}")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify and fingerprint CSS/JS and write their .gz/.br variants."""
+    manifest = build_assets(app.static_folder)
+    print(f"✅ Built {len(manifest)} asset(s)")
+
+@app.cli.command('geo-index')
+def geo_index_command():
+    """Create the R-tree indexes and rebuild them from the coordinate columns."""
+    if ensure_geo_index(rebuild=True):
+        print("✅ Geo index rebuilt")
+    else:
+        print("⚠️  R-tree not available, map queries will filter coordinates directly")
+
+@app.cli.command('geocode')
+@click.argument('gazetteer_path', type=click.Path(exists=True, dir_okay=False), required=False)
+def geocode_command(gazetteer_path):
+    """Fill in coordinates of cases and sightings from a local gazetteer file."""
+    path = gazetteer_path or app.config['GAZETTEER']
+    if not path:
+        raise click.ClickException("Pass a gazetteer file or set GAZETTEER")
+    places = Gazetteer.load(path)
+    print(f"Loaded {len(places):,} place names")
+    for table_name, (geocoded, unmatched) in geocode_missing(places).items():
+        print(f"✅ {table_name}: geocoded {geocoded:,}, no match for {unmatched:,}")
+
+@app.cli.command('render-photos')
+def render_photos_command():
+    """Produce photo renditions for cases uploaded before the image pipeline."""
+    pending = MissingPerson.query.filter(MissingPerson.photo_filename.isnot(None),
+                                         MissingPerson.photo_renditions.is_(None)).all()
+    for person in pending:
+        if os.path.exists(photo_path(app.config, person.photo_filename)):
+            schedule_renditions(app, person.id, person.photo_filename)
+    print(f"✅ Scheduled renditions for {len(pending)} photo(s)")
+
+@app.cli.command('move-originals')
+def move_originals_command():
+    """Move uploaded originals out of the static tree into ORIGINALS_FOLDER."""
+    moved = 0
+    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
+        if is_original(filename):
+            os.replace(os.path.join(app.config['UPLOAD_FOLDER'], filename),
+                       os.path.join(app.config['ORIGINALS_FOLDER'], filename))
+            moved += 1
+    print(f"✅ Moved {moved} original(s) to {app.config['ORIGINALS_FOLDER']}")
+
+@app.cli.command('import-cases')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format (default: from the file extension).')
+@click.option('--photos-dir', type=click.Path(exists=True, file_okay=False),
+              help='Directory the photo column is relative to (default: next to the file).')
+@click.option('--reporter', help='Email of the user recorded as reporter (default: the first admin).')
+@click.option('--batch-size', default=1000, help='Rows per INSERT and commit.')
+@click.option('--workers', type=int, help='Photo processes (default: IMAGE_WORKERS, 0 = inline).')
+@click.option('--rejects', type=click.Path(dir_okay=False), help='Append rejected rows to this JSONL file.')
+@click.option('--restart', is_flag=True, help='Ignore progress saved by an earlier run on this file.')
+def import_cases_command(path, file_format, photos_dir, reporter, batch_size, workers, rejects, restart):
+    """Bulk-import cases (and photos) from a CSV or JSONL file; resumable."""
+    from bulk_import import CaseImporter
+    if reporter:
+        user = User.query.filter_by(email=reporter).first()
+    else:
+        user = User.query.filter_by(role='admin').order_by(User.id).first()
+    if user is None:
+        raise click.ClickException(f"No user {reporter!r} to record as reporter" if reporter
+                                   else "No admin user to record as reporter; pass --reporter")
+    
+    importer = CaseImporter(app.config['UPLOAD_FOLDER'], app.config['ORIGINALS_FOLDER'], user.id,
+                            ALLOWED_EXTENSIONS | {'jpeg'}, photos_dir=photos_dir, batch_size=batch_size,
+                            workers=app.config['IMAGE_WORKERS'] if workers is None else workers,
+                            rejects_path=rejects, max_pixels=app.config['MAX_UPLOAD_PIXELS'])
+    try:
+        importer.run(path, file_format, restart=restart)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+@app.cli.command('export-cases')
+@click.option('--format', 'file_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--since', help='Only cases changed after this ISO timestamp (e.g. the last run\'s watermark).')
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='Write to this file instead of stdout; gzipped when it ends in .gz.')
+def export_cases_command(file_format, since, output):
+    """Stream open (or changed) cases as CSV or JSONL."""
+    import gzip
+    import sys
+    try:
+        since = parse_since(since)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    watermark = export_watermark()
+    if output is None:
+        out = sys.stdout
+    elif output.endswith('.gz'):
+        out = gzip.open(output, 'wt', encoding='utf-8', newline='')
+    else:
+        out = open(output, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in export_chunks(file_format, since):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if watermark:
+        click.echo(f"Next delta: --since {next_since(watermark)}", err=True)
+
+@app.cli.command('seed-synthetic')
+@click.argument('size')
+@click.option('--seed', default=42, help='Random seed; the same seed gives the same data.')
+def seed_synthetic_command(size, seed):
+    """Fill the database with SIZE synthetic cases (10k, 100k, 1m or a number)."""
+    from synthetic_data import SIZES, generate as generate_synthetic
+    count = SIZES.get(size.lower()) or (int(size) if size.isdigit() else None)
+    if not count:
+        raise click.ClickException(f"Unknown size {size!r}; use {', '.join(SIZES)} or a number")
+    started = time.perf_counter()
+    counts = generate_synthetic(count, app.config['UPLOAD_FOLDER'], app.config['ORIGINALS_FOLDER'], seed=seed)
+    print(f"✅ Generated {counts['cases']:,} cases, {counts['users']:,} users, "
+          f"{counts['sightings']:,} sightings and {counts['found']:,} found persons "
+          f"in {time.perf_counter() - started:.0f}s")
 
 if __name__ == '__main__':
     init_db()  # Initialize database and sample data
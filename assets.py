@@ -0,0 +1,216 @@
+"""
+Fingerprinted, precompressed static assets.
+
+``build_assets`` minifies the stylesheet and script, writes each one as
+``static/build/<name>.<hash>.<ext>`` next to ``.gz`` and ``.br`` variants
+(``.br`` needs the optional ``Brotli`` package) and records the mapping in
+``static/build/manifest.json``. Because the hash changes with the content,
+``/assets/...`` responses are cached by browsers for a year as immutable,
+and the server picks the smallest encoding the client accepts without
+compressing anything per request.
+
+Templates call ``asset_url('css/style.css')``; when no build is available
+(e.g. a read-only filesystem without a prebuilt manifest) it falls back to
+the plain ``/static/`` URL.
+
+    flask build-assets
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import abort, request, send_from_directory, url_for
+
+# Files under static/ that go through the pipeline
+ASSETS = ['css/style.css', 'js/script.js']
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# Preferred first; only offered when the variant exists on disk
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/|(\s+)''', re.S)
+
+
+def minify_css(source):
+    """Drop comments and needless whitespace; quoted strings are left alone."""
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return ' ' if match.group(2) else ''
+
+    css = _CSS_TOKENS.sub(replace, source)
+    parts = re.split(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''', css)
+    for i in range(0, len(parts), 2):
+        # No space needed around these; a space *before* ":" can be a
+        # descendant combinator (".card :hover"), so only the one after goes
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', parts[i])
+        part = re.sub(r':\s+', ':', part)
+        parts[i] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(source):
+    """Conservative: strip indentation, blank lines and whole-line ``//`` comments.
+
+    Files with template literals keep their indentation, since it may be
+    part of a string.
+    """
+    keep_indent = '`' in source
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+        lines.append(line.rstrip() if keep_indent else stripped)
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def write_atomic(path, content):
+    """Write ``content`` to ``path`` so no reader ever sees a partial file.
+
+    Every web worker may build at startup; each writes to its own temporary
+    file in the same directory and renames it into place.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)  # mkstemp's 0600 would hide it from a front-end server
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_variants(path, content):
+    """Write ``content`` and its precompressed variants next to it.
+
+    The plain file goes last: once it exists, so do its variants.
+    """
+    write_atomic(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(path + '.br', brotli.compress(content, quality=11))
+    write_atomic(path, content)
+
+
+def build_assets(static_dir):
+    """Minify and fingerprint every asset; returns the manifest."""
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+    for name in ASSETS:
+        stem, ext = os.path.splitext(name)
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            source = f.read()
+        content = MINIFIERS.get(ext, lambda text: text)(source).encode('utf-8')
+        built = f"{os.path.basename(stem)}.{fingerprint(content)}{ext}"
+        if not os.path.exists(os.path.join(out_dir, built)):
+            write_variants(os.path.join(out_dir, built), content)
+        manifest[name] = built
+        print(f"  {name} -> {BUILD_DIR}/{built} ({len(source.encode('utf-8')):,} -> {len(content):,} bytes)")
+
+    # Drop builds no longer referenced
+    current = set(manifest.values())
+    for filename in os.listdir(out_dir):
+        base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+        # Temporary files belong to builds still being written by other workers
+        if filename != MANIFEST and not filename.startswith('.tmp-') and base not in current:
+            try:
+                os.remove(os.path.join(out_dir, filename))
+            except FileNotFoundError:
+                pass  # another worker removed it first
+
+    write_atomic(os.path.join(out_dir, MANIFEST),
+                 json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def manifest_stale(static_dir, manifest):
+    """Whether any source changed since the manifest was written."""
+    if set(manifest) != set(ASSETS):
+        return True
+    try:
+        built_at = os.path.getmtime(os.path.join(static_dir, BUILD_DIR, MANIFEST))
+        return any(os.path.getmtime(os.path.join(static_dir, name)) > built_at for name in ASSETS)
+    except OSError:
+        return True
+
+
+class Assets:
+    """Asset URLs and serving for one app."""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.build_dir = os.path.join(static_dir, BUILD_DIR)
+        self.manifest = {}
+
+    def load(self, build=True):
+        """Use the existing build, rebuilding it first when sources changed."""
+        manifest = load_manifest(self.static_dir)
+        if build and manifest_stale(self.static_dir, manifest):
+            try:
+                manifest = build_assets(self.static_dir)
+            except OSError as e:
+                print(f"Could not build assets, serving them unversioned: {e}")
+        self.manifest = manifest
+
+    def url(self, name):
+        built = self.manifest.get(name)
+        if built is None:
+            return url_for('static', filename=name)
+        return url_for('asset', filename=built)
+
+    def response(self, filename):
+        """The best precompressed variant of a built asset the client accepts."""
+        if filename not in self.manifest.values():
+            abort(404)
+        accepted = request.accept_encodings
+        chosen, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if accepted[name] and os.path.exists(os.path.join(self.build_dir, filename + suffix)):
+                chosen, encoding = filename + suffix, name
+                break
+
+        response = send_from_directory(self.build_dir, chosen, conditional=True, max_age=ASSET_MAX_AGE,
+                                       mimetype='text/css' if filename.endswith('.css') else 'text/javascript')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def init_assets(app):
+    """Load (and if needed build) the assets and register ``asset_url``."""
+    assets = Assets(app.static_folder)
+    assets.load(build=app.config.get('ASSET_BUILD', True))
+    app.jinja_env.globals['asset_url'] = assets.url
+    app.add_url_rule('/assets/<path:filename>', 'asset', assets.response)
+    return assets
@@ -0,0 +1,697 @@
+"""
+HTTP load benchmark for the main pages.
+
+    python benchmark.py --size 10k
+    python benchmark.py --size 100k --mode server --workers 4 --concurrency 8
+
+The first run for a size builds a synthetic dataset (see synthetic_data.py)
+in benchmarks/data/; every run works on a fresh copy of it, so writes made
+by one run never skew the next. Each scenario (home page, browse, search,
+case details, name matches, facet counts, an export delta, login, filing a
+report) is driven for --seconds:
+
+* ``client`` mode calls the app in-process through the Flask test client,
+  one request at a time: application cost only, no network or server.
+* ``server`` mode starts a real multi-worker server (gunicorn when it is
+  installed, otherwise Werkzeug's forking server) and drives it from
+  --concurrency client threads.
+
+``startup`` mode starts --runs fresh interpreters in the serverless profile
+(see serverless.py) and times each cold start end to end, the import of
+app.py and the first request, with an empty and with a precompiled template
+cache; one extra run under ``python -X importtime`` lists the slowest
+imports of app.py.
+
+``compression`` mode renders each page once and reports, per codec and
+level, the compressed size and the CPU time per response, i.e. what
+compression.py trades for the bytes it saves (``python benchmark.py --mode
+compression``; printed only, not stored).
+
+``photos`` mode renders synthetic camera JPEGs of several sizes, each in a
+fresh process, and reports the peak memory and time of producing every
+rendition with the reduced decode in images.py against a full-size decode
+(``python benchmark.py --mode photos``; printed only, not stored).
+
+``tokens`` mode drives the forgot-password form and opening a reset link
+through the test client with each ``RESET_TOKEN_MODE`` (see
+reset_tokens.py): stored tokens against signed ones.
+
+Throughput and p50/p95/p99 latency are printed and appended to
+benchmarks/results.jsonl tagged with the current git commit. A scenario
+whose p95 grew by more than --threshold percent since the last run on a
+different commit is flagged as a regression.
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results.jsonl')
+
+SEARCH_TERMS = ['wanjiru', 'blue jacket', 'ochieng', 'school uniform', 'scar', 'market', 'kev']
+REGIONS = ['Nairobi', 'Rift Valley', 'Coast', 'Western']
+
+
+class Context:
+    """What scenarios need to know about the dataset."""
+
+    def __init__(self, db_path):
+        with sqlite3.connect(db_path) as conn:
+            self.max_case_id = conn.execute('SELECT max(id) FROM missing_person').fetchone()[0]
+            self.max_found_id = conn.execute('SELECT max(id) FROM found_person').fetchone()[0] or 1
+            self.user_emails = [row[0] for row in conn.execute(
+                "SELECT email FROM user WHERE email LIKE '%@synthetic.loket.org' LIMIT 200")]
+            # Changes of the last day of data: a typical nightly delta
+            latest = conn.execute('SELECT max(date_reported) FROM missing_person').fetchone()[0]
+        self.export_since = (datetime.fromisoformat(latest) - timedelta(days=1)).isoformat()
+        self.rng = random.Random(1)
+
+
+def scenario_requests(ctx):
+    """name -> function returning (method, path, form, needs_login)."""
+    rng = ctx.rng
+    return {
+        'index': lambda: ('GET', '/', None, False),
+        'browse': lambda: ('GET', '/browse', None, False),
+        'browse_region': lambda: ('GET', f'/browse?{urlencode({"region": rng.choice(REGIONS)})}', None, False),
+        'api_search': lambda: ('GET', f'/api/search?{urlencode({"q": rng.choice(SEARCH_TERMS)})}', None, False),
+        'case_details': lambda: ('GET', f'/case-details/{rng.randint(1, ctx.max_case_id)}', None, False),
+        'name_matches': lambda: ('GET', f'/api/found-persons/{rng.randint(1, ctx.max_found_id)}/name-matches',
+                                 None, False),
+        'facets': lambda: ('GET', f'/api/facets?{urlencode({"region": rng.choice(REGIONS)})}', None, False),
+        'export_delta': lambda: ('GET', f'/api/export?{urlencode({"format": "jsonl", "since": ctx.export_since})}',
+                                 None, False),
+        'login': lambda: ('POST', '/login', {'email': rng.choice(ctx.user_emails),
+                                             'password': 'password123'}, False),
+        'report_missing': lambda: ('POST', '/report-missing', {
+            'name': 'Benchmark Case', 'age': '34', 'gender': 'Female', 'last_seen': 'Bus stage',
+            'last_seen_date': '2024-05-01', 'region': rng.choice(REGIONS),
+            'description': 'Wearing a blue jacket and white sneakers.',
+            'contact_name': 'Family', 'contact_phone': '0700000000',
+            'contact_email': 'family@example.com',
+        }, True),
+    }
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+# --- datasets ---------------------------------------------------------------
+
+def dataset_path(size):
+    return os.path.join(DATA_DIR, f'loket-{size}.db')
+
+
+def ensure_dataset(size):
+    """Build the synthetic database for ``size`` if it does not exist yet."""
+    path = dataset_path(size)
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    print(f"Generating {size} dataset (once) ...")
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}.tmp', FLASK_APP='app.py',
+               IMAGE_WORKERS='0', MAIL_WORKER='external')
+    here = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, '-c', 'from app import init_db; init_db()'], env=env, cwd=here, check=True)
+    subprocess.run([sys.executable, '-m', 'flask', 'seed-synthetic', size], env=env, cwd=here, check=True)
+    with sqlite3.connect(f'{path}.tmp') as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA journal_mode = DELETE')  # one self-contained file to copy
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def working_copy(size):
+    work_dir = tempfile.mkdtemp(prefix='loket-bench-')
+    path = os.path.join(work_dir, 'loket.db')
+    shutil.copyfile(ensure_dataset(size), path)
+    # Datasets outlive schema changes; bring the copy up to this commit's schema
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', FLASK_APP='app.py',
+               IMAGE_WORKERS='0', MAIL_WORKER='external')
+    subprocess.run([sys.executable, '-m', 'flask', 'db-upgrade'], env=env, stdout=subprocess.DEVNULL,
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return path
+
+
+# --- client mode ------------------------------------------------------------
+
+def run_client(args, db_path):
+    """Drive every scenario through the Flask test client, in this process."""
+    os.environ.update(DATABASE_URL=f'sqlite:///{db_path}', IMAGE_WORKERS='0', MAIL_WORKER='external')
+    from app import app
+
+    ctx = Context(db_path)
+    anonymous = app.test_client()
+    logged_in = app.test_client()
+    logged_in.post('/login', data={'email': ctx.user_emails[0], 'password': 'password123'})
+
+    results = {}
+    for name, make_request in scenario_requests(ctx).items():
+        if args.scenario and name not in args.scenario:
+            continue
+        latencies, errors = [], 0
+        for _ in range(3):  # warm-up: first-request work, caches
+            method, path, form, needs_login = make_request()
+            (logged_in if needs_login else anonymous).open(path, method=method, data=form, buffered=True)
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.seconds:
+            method, path, form, needs_login = make_request()
+            t0 = time.perf_counter()
+            response = (logged_in if needs_login else anonymous).open(path, method=method, data=form, buffered=True)
+            latencies.append(time.perf_counter() - t0)
+            errors += response.status_code >= 400
+        results[name] = summarize(latencies, errors, time.perf_counter() - started)
+        print_result(name, results[name])
+    return results
+
+
+# --- tokens mode ------------------------------------------------------------
+
+def run_tokens(args, db_path):
+    """Forgot-password and reset-link throughput with stored and with signed tokens."""
+    os.environ.update(DATABASE_URL=f'sqlite:///{db_path}', IMAGE_WORKERS='0', MAIL_WORKER='external',
+                      RESET_TOKEN_PURGE_SECONDS='0')
+    from app import app
+    from models import User
+    from reset_tokens import issue_reset_token
+
+    ctx = Context(db_path)
+    client = app.test_client()
+
+    def issue_all(mode):
+        with app.app_context():
+            users = User.query.filter(User.email.in_(ctx.user_emails)).all()
+            return [issue_reset_token(user, mode) for user in users]
+
+    results = {}
+    for mode in ('table', 'signed'):
+        app.config['RESET_TOKEN_MODE'] = mode
+        tokens = []
+        # (request, status of success): the form redirects, a valid link shows the reset form
+        scenarios = {
+            # A fresh client each time, or unread flash messages pile up in the session cookie
+            f'forgot_{mode}': (lambda: app.test_client().post(
+                '/forgot-password', data={'email': ctx.rng.choice(ctx.user_emails)}), 302),
+            f'reset_{mode}': (lambda: client.get(f'/reset-password/{ctx.rng.choice(tokens)}'), 200),
+        }
+        for name, (make_request, expected) in scenarios.items():
+            if args.scenario and name not in args.scenario:
+                continue
+            tokens[:] = issue_all(mode)  # after the forgot run, which replaced stored tokens
+            for _ in range(3):
+                make_request()
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < args.seconds:
+                t0 = time.perf_counter()
+                response = make_request()
+                latencies.append(time.perf_counter() - t0)
+                errors += response.status_code != expected
+            results[name] = summarize(latencies, errors, time.perf_counter() - started)
+            print_result(name, results[name])
+    return results
+
+
+# --- compression mode -------------------------------------------------------
+
+COMPRESSION_SETTINGS = [('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 6), ('br', 11)]
+
+
+def compressor(codec, level):
+    if codec == 'gzip':
+        return lambda body: gzip.compress(body, compresslevel=level, mtime=0)
+    import brotli
+    return lambda body: brotli.compress(body, quality=level)
+
+
+def cpu_per_call(function, body, budget=0.2):
+    """CPU seconds per call of ``function(body)``, averaged over ``budget`` seconds."""
+    calls, started = 0, time.process_time()
+    while True:
+        function(body)
+        calls += 1
+        elapsed = time.process_time() - started
+        if elapsed >= budget:
+            return elapsed / calls
+
+
+def run_compression(args, db_path):
+    """Compressed size and CPU cost of each page for every codec/level."""
+    os.environ.update(DATABASE_URL=f'sqlite:///{db_path}', IMAGE_WORKERS='0', MAIL_WORKER='external')
+    from app import app
+    from compression import brotli
+
+    settings = [(codec, level) for codec, level in COMPRESSION_SETTINGS if codec == 'gzip' or brotli]
+    if not brotli:
+        print("  (Brotli not installed, gzip only)")
+    ctx = Context(db_path)
+    client = app.test_client()
+    print(f"  {'scenario':<15} {'raw':>9}  " + ' '.join(f"{f'{codec}-{level}':>16}" for codec, level in settings))
+    for name, make_request in scenario_requests(ctx).items():
+        method, path, _, needs_login = make_request()
+        if method != 'GET' or needs_login or (args.scenario and name not in args.scenario):
+            continue
+        body = client.get(path).get_data()  # no Accept-Encoding: the raw body
+        cells = []
+        for codec, level in settings:
+            function = compressor(codec, level)
+            size = len(function(body))
+            cells.append(f"{size / len(body):>5.0%} {cpu_per_call(function, body) * 1000:>6.2f}ms")
+        print(f"  {name:<15} {len(body):>9,}  " + ' '.join(f"{cell:>16}" for cell in cells))
+    print("  (size as % of raw, CPU time per response)")
+
+
+# --- photos mode ------------------------------------------------------------
+
+PHOTO_MEGAPIXELS = [2, 8, 12, 24, 48]
+PHOTO_RUNS = 3
+
+PHOTO_PROBE = '''
+import json, resource, sys, tempfile, time
+from PIL import Image, ImageOps
+import images, photo_hash
+
+def peak_kb():
+    # VmHWM starts afresh with this program; ru_maxrss also counts the parent before exec
+    try:
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def full_decode(image, size):
+    # What render_photo did before: full-size decode and upright copy, then shrink
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return image
+
+path, mode = sys.argv[1], sys.argv[2]
+decode = full_decode if mode == 'full' else images.decode_photo
+decode_seconds = []
+
+def timed_decode(image, size):
+    started = time.perf_counter()
+    image = decode(image, size)
+    decode_seconds.append(time.perf_counter() - started)
+    return image
+
+images.decode_photo = timed_decode
+images.available_formats()
+with tempfile.TemporaryDirectory() as out:
+    baseline = peak_kb()
+    started = time.perf_counter()
+    images.render_photo(path, out, 'bench', max_pixels=10 ** 9)
+    elapsed = time.perf_counter() - started
+peak = peak_kb() - baseline
+print(json.dumps({'seconds': elapsed, 'decode_seconds': decode_seconds[0], 'peak_kb': peak}))
+'''
+
+
+def camera_photo(path, megapixels):
+    """A 4:3 JPEG shot sideways (EXIF orientation 6), compressing like a real photo."""
+    from PIL import Image
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Smooth shapes plus fine grain: file sizes close to a phone camera's
+    bands = [Image.effect_noise((width // 64, height // 64), 90).resize((width, height), Image.Resampling.BICUBIC)
+             for _ in range(3)]
+    grain = Image.effect_noise((width, height), 12)
+    image = Image.merge('RGB', [Image.blend(band, grain, 0.3) for band in bands])
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    image.save(path, 'JPEG', quality=90, exif=exif)
+    return os.path.getsize(path)
+
+
+def render_cost(path, mode):
+    """Median decode and total seconds, and largest peak RSS growth, of rendering ``path``."""
+    decode_seconds, seconds, peaks = [], [], []
+    for _ in range(PHOTO_RUNS):
+        result = subprocess.run([sys.executable, '-c', PHOTO_PROBE, path, mode], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        decode_seconds.append(probe['decode_seconds'])
+        seconds.append(probe['seconds'])
+        peaks.append(probe['peak_kb'])
+    return percentile(decode_seconds, 0.5), percentile(seconds, 0.5), max(peaks) / 1024
+
+
+def run_photos(args):
+    """Peak memory and latency of rendering uploads of each size."""
+    work_dir = tempfile.mkdtemp(prefix='loket-photos-')
+    try:
+        print(f"  {'photo':<8} {'file':>8}   {'full decode':>27}   {'reduced decode':>27}")
+        print(f"  {'':<8} {'':>8}   {'peak':>9}{'decode':>9}{'total':>9}   {'peak':>9}{'decode':>9}{'total':>9}")
+        for megapixels in PHOTO_MEGAPIXELS:
+            path = os.path.join(work_dir, f'{megapixels}mp.jpg')
+            size = camera_photo(path, megapixels)
+            cells = []
+            for mode in ('full', 'reduced'):
+                decode_seconds, seconds, peak_mb = render_cost(path, mode)
+                cells.append(f"{peak_mb:>6.0f} MB{decode_seconds * 1000:>6.0f} ms{seconds * 1000:>6.0f} ms")
+            print(f"  {f'{megapixels} MP':<8} {size / 2 ** 20:>5.1f} MB   {cells[0]}   {cells[1]}")
+        print(f"  (peak RSS growth, decode time and time to write every rendition; median of {PHOTO_RUNS} "
+              "fresh processes)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# --- startup mode -----------------------------------------------------------
+
+STARTUP_PROBE = '''
+import json, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+status = app.test_client().get('/').status_code
+print(json.dumps({'import': imported - started, 'first_request': time.perf_counter() - imported,
+                  'status': status}))
+'''
+
+
+def cold_start(env, importtime=False):
+    """Run the probe in a fresh interpreter: (wall seconds, probe timings or None, stderr)."""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', STARTUP_PROBE]
+    started = time.perf_counter()
+    result = subprocess.run(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    try:
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        timings = None
+    if timings is None or timings['status'] >= 400:
+        timings = None
+    return wall, timings, result.stderr
+
+
+def slowest_imports(stderr, limit=10):
+    """Modules app.py imports directly, by cumulative ``-X importtime`` microseconds."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        # ' app' is the probe's import; one level of indent deeper is what app.py imports
+        if name.startswith('   ') and not name.startswith('    ') and cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def run_startup(args, db_path):
+    """Time cold starts of the serverless profile."""
+    work_dir = os.path.dirname(db_path)
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', SERVERLESS='1',
+               IMAGE_WORKERS='0', MAIL_WORKER='external')
+    samples = {name: [] for name in ('cold_start', 'import_app', 'first_request', 'first_cached')}
+    errors = 0
+    precompiled = os.path.join(work_dir, 'templates-precompiled')
+    subprocess.run([sys.executable, '-m', 'flask', 'compile-templates', '--dir', precompiled],
+                   env=dict(env, FLASK_APP='app.py'), cwd=os.path.dirname(os.path.abspath(__file__)),
+                   check=True, capture_output=True)
+    for run in range(args.runs):
+        # A fresh instance: nothing compiled yet
+        wall, timings, _ = cold_start(dict(env, TEMPLATE_CACHE_DIR=os.path.join(work_dir, f'templates-{run}')))
+        errors += timings is None
+        if timings:
+            samples['cold_start'].append(wall)
+            samples['import_app'].append(timings['import'])
+            samples['first_request'].append(timings['first_request'])
+        # Templates compiled at build time
+        _, timings, _ = cold_start(dict(env, TEMPLATE_CACHE_DIR=precompiled))
+        errors += timings is None
+        if timings:
+            samples['first_cached'].append(timings['first_request'])
+
+    results = {}
+    for name, values in samples.items():
+        results[name] = summarize(values, errors, sum(values) or 1)
+        print_result(name, results[name])
+
+    _, _, stderr = cold_start(dict(env, TEMPLATE_CACHE_DIR=precompiled), importtime=True)
+    print("\n  Slowest imports of app.py (cumulative):")
+    for microseconds, name in slowest_imports(stderr):
+        print(f"  {microseconds / 1000:>9.1f} ms  {name}")
+    return results
+
+
+# --- server mode ------------------------------------------------------------
+
+def serve(args):
+    """Run the app under a multi-worker server (benchmark.py --serve)."""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        from werkzeug.serving import run_simple
+        from app import app
+        # Werkzeug forks a child per connection; render the main pages once
+        # first so every child inherits compiled templates and warm caches
+        client = app.test_client()
+        for path in ('/', '/browse', '/api/search?q=market', '/case-details/1', '/login'):
+            client.get(path)
+        run_simple('127.0.0.1', args.port, app, processes=args.workers, threaded=False)
+    else:
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-w', str(args.workers),
+                                   '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning', 'app:app'])
+
+
+def start_server(args, db_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', IMAGE_WORKERS='0', MAIL_WORKER='external')
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                               '--port', str(args.port), '--workers', str(args.workers)],
+                              env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=5)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('Benchmark server did not start')
+
+
+def http_request(port, method, path, form=None, cookie=None):
+    """One request on its own connection.
+
+    Neither gunicorn's sync workers nor Werkzeug's forking server keep
+    connections alive, so the client does not try to either.
+    """
+    headers = {'Connection': 'close'}
+    if cookie:
+        headers['Cookie'] = cookie
+    body = None
+    if form is not None:
+        body = urlencode(form)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response
+    finally:
+        conn.close()
+
+
+def login_cookie(port, email):
+    response = http_request(port, 'POST', '/login', {'email': email, 'password': 'password123'})
+    cookie = SimpleCookie(response.getheader('Set-Cookie'))
+    return '; '.join(f'{key}={morsel.value}' for key, morsel in cookie.items())
+
+
+def run_server(args, db_path):
+    """Drive every scenario against a real server from concurrent clients."""
+    ctx = Context(db_path)
+    server = start_server(args, db_path)
+    try:
+        cookie = login_cookie(args.port, ctx.user_emails[0])
+        results = {}
+        for name, make_request in scenario_requests(ctx).items():
+            if args.scenario and name not in args.scenario:
+                continue
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.seconds
+
+            def worker():
+                mine, failed = [], 0
+                while time.perf_counter() < deadline:
+                    with lock:
+                        method, path, form, needs_login = make_request()
+                    t0 = time.perf_counter()
+                    try:
+                        status = http_request(args.port, method, path, form,
+                                              cookie if needs_login else None).status
+                    except (http.client.HTTPException, OSError):
+                        status = 599
+                    mine.append(time.perf_counter() - t0)
+                    failed += status >= 400
+                with lock:
+                    latencies.extend(mine)
+                    errors[0] += failed
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, errors[0], time.perf_counter() - started)
+            print_result(name, results[name])
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# --- results ----------------------------------------------------------------
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True).stdout.strip())
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_result(name, result):
+    print(f"  {name:<15} {result['rps']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+          f"{result['p99_ms']:>9} {result['requests']:>8} {result['errors']:>7}")
+
+
+def previous_results(setup, commit):
+    """Latest stored result per scenario for this setup from another commit."""
+    previous = {}
+    if not os.path.exists(RESULTS_FILE):
+        return previous
+    with open(RESULTS_FILE) as results:
+        for line in results:
+            entry = json.loads(line)
+            if entry['commit'] != commit and all(entry.get(k) == v for k, v in setup.items()):
+                previous[entry['scenario']] = entry
+    return previous
+
+
+def store_results(setup, commit, results):
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    timestamp = datetime.utcnow().isoformat(timespec='seconds')
+    with open(RESULTS_FILE, 'a') as out:
+        for name, result in results.items():
+            out.write(json.dumps({'commit': commit, 'timestamp': timestamp, **setup,
+                                  'scenario': name, **result}) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='10k', help='Dataset size: 10k, 100k, 1m or a number.')
+    parser.add_argument('--mode', choices=['client', 'server', 'startup', 'compression', 'photos', 'tokens'], default='client')
+    parser.add_argument('--seconds', type=float, default=5, help='Duration of each scenario.')
+    parser.add_argument('--workers', type=int, default=4, help='Server worker processes (server mode).')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent connections (server mode).')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--runs', type=int, default=10, help='Cold starts to time (startup mode).')
+    parser.add_argument('--scenario', action='append', help='Only run this scenario (repeatable).')
+    parser.add_argument('--threshold', type=float, default=20, help='p95 regression threshold, percent.')
+    parser.add_argument('--no-store', action='store_true', help='Do not append to benchmarks/results.jsonl.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    if args.mode == 'compression':
+        db_path = working_copy(args.size)
+        print(f"Compression cost, size={args.size}:")
+        try:
+            run_compression(args, db_path)
+        finally:
+            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+        return 0
+
+    if args.mode == 'photos':
+        print("Photo decode cost:")
+        run_photos(args)
+        return 0
+
+    setup = {'mode': args.mode, 'size': args.size}
+    if args.mode == 'server':
+        setup.update(workers=args.workers, concurrency=args.concurrency)
+    commit = git_revision()
+    db_path = working_copy(args.size)
+
+    if args.mode == 'startup':
+        setup['runs'] = args.runs
+        print(f"Benchmark {commit}: {', '.join(f'{k}={v}' for k, v in setup.items())}")
+    else:
+        print(f"Benchmark {commit}: {', '.join(f'{k}={v}' for k, v in setup.items())}, {args.seconds:g}s per scenario")
+    print(f"  {'scenario':<15} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'requests':>8} {'errors':>7}")
+    runners = {'client': run_client, 'server': run_server, 'startup': run_startup, 'tokens': run_tokens}
+    try:
+        results = runners[args.mode](args, db_path)
+    finally:
+        shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+    regressions = []
+    previous = previous_results(setup, commit)
+    if previous:
+        latest = max(previous.values(), key=lambda entry: entry['timestamp'])
+        print(f"\nCompared with {latest['commit']} ({latest['timestamp']}):")
+    for name, result in results.items():
+        before = previous.get(name)
+        if not before or not before['p95_ms']:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        flag = '❌' if change > args.threshold else '✅'
+        print(f"  {flag} {name:<15} p95 {before['p95_ms']} -> {result['p95_ms']} ms ({change:+.0f}%), "
+              f"{before['rps']} -> {result['rps']} req/s")
+        if change > args.threshold:
+            regressions.append(name)
+
+    if not args.no_store:
+        store_results(setup, commit, results)
+        print(f"\nResults appended to {os.path.relpath(RESULTS_FILE)}")
+    if regressions:
+        print(f"❌ p95 regressed by more than {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
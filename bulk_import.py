@@ -0,0 +1,308 @@
+"""
+Bulk import of cases, with photos, from partner CSV or JSONL dumps.
+
+    flask import-cases partner_dump.csv --photos-dir partner_dump/photos
+
+The input is streamed; at most one batch of rows is held in memory. Each
+batch of valid rows goes into the database with executemany-style bulk
+INSERTs (no ORM objects, no per-row flush), and the job's progress (input
+rows consumed, photos not yet recorded) is committed in the same
+transaction. A run that
+dies part-way can therefore simply be started again with the same command:
+it skips the rows already committed and re-queues their outstanding photos,
+without duplicating any case.
+
+Columns are the ``MissingPerson`` field names (``name``, ``age``,
+``gender``, ``last_seen``, ``last_seen_date``, ``region``, ``description``,
+``contact_name``, ``contact_phone``, ``contact_email``), plus optional
+``date_reported`` and ``photo`` (a path relative to ``--photos-dir``).
+Photos are processed in a process pool by the same code as uploads from
+the report form.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import date, datetime
+
+from sqlalchemy import insert, update
+
+from images import submit_job, import_photo, DEFAULT_MAX_PIXELS
+from models import db, ImportJob, MissingPerson
+from photo_hash import to_signed
+
+REQUIRED_FIELDS = ['name', 'age', 'gender', 'last_seen', 'last_seen_date', 'region',
+                   'description', 'contact_name', 'contact_phone', 'contact_email']
+
+MAX_LENGTHS = {column.name: column.type.length for column in MissingPerson.__table__.columns
+               if getattr(column.type, 'length', None)}
+
+# Rejected rows printed before only counting the rest
+SHOW_REJECTED = 20
+
+
+def detect_format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(path, file_format):
+    """Yield ``(record, error)`` for every input row, streaming the file."""
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        if file_format == 'csv':
+            for record in csv.DictReader(source):
+                yield record, None
+            return
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield None, "expected a JSON object"
+                continue
+            yield record, None
+
+
+def validate_case(record, photos_dir, allowed_formats):
+    """Check one input record.
+
+    Returns ``(values, photo_path, error)``; values is a dict of
+    ``MissingPerson`` columns ready to insert, error a message or None.
+    """
+    values = {}
+    for field in REQUIRED_FIELDS + ['date_reported', 'photo']:
+        value = record.get(field)
+        values[field] = str(value).strip() if value is not None else ''
+
+    missing = [field for field in REQUIRED_FIELDS if not values[field]]
+    if missing:
+        return None, None, f"missing {', '.join(missing)}"
+
+    for field, length in MAX_LENGTHS.items():
+        if len(values.get(field, '')) > length:
+            return None, None, f"{field} longer than {length} characters"
+
+    try:
+        values['age'] = int(values['age'])
+    except ValueError:
+        return None, None, f"age {values['age']!r} is not a number"
+    if not 0 <= values['age'] <= 120:
+        return None, None, f"age {values['age']} out of range"
+
+    try:
+        values['last_seen_date'] = date.fromisoformat(values['last_seen_date'])
+    except ValueError:
+        return None, None, f"last_seen_date {values['last_seen_date']!r} is not YYYY-MM-DD"
+
+    if values['date_reported']:
+        try:
+            values['date_reported'] = datetime.fromisoformat(values['date_reported'])
+        except ValueError:
+            return None, None, f"date_reported {values['date_reported']!r} is not an ISO date/time"
+    else:
+        del values['date_reported']  # column default: now
+
+    photo = values.pop('photo')
+    photo_path = None
+    if photo:
+        photo_path = os.path.join(photos_dir, photo)
+        if photo.rsplit('.', 1)[-1].lower() not in allowed_formats:
+            return None, None, f"photo {photo!r} is not a JPG, PNG, GIF or WEBP file"
+        if not os.path.isfile(photo_path):
+            return None, None, f"photo {photo!r} not found"
+
+    return values, photo_path, None
+
+
+class CaseImporter:
+    """Streams one input file into ``missing_person`` in batches."""
+
+    def __init__(self, upload_dir, originals_dir, reporter_id, allowed_formats, photos_dir=None,
+                 batch_size=1000, workers=0, rejects_path=None, max_pixels=DEFAULT_MAX_PIXELS):
+        self.upload_dir = upload_dir
+        self.originals_dir = originals_dir
+        self.reporter_id = reporter_id
+        self.allowed_formats = allowed_formats
+        self.photos_dir = photos_dir
+        self.batch_size = batch_size
+        self.workers = workers
+        self.rejects_path = rejects_path
+        self.max_pixels = max_pixels
+        self._in_flight = {}  # future -> (person_id, path)
+        self._finished = []  # (person_id, path, result) not yet written
+        self._shown_rejects = 0
+        self._rejects = []  # rejected rows of the current batch
+
+    def start_job(self, path, restart=False):
+        """The unfinished job for this exact file, or a new one."""
+        source = os.path.abspath(path)
+        stat = os.stat(path)
+        fingerprint = f"{stat.st_size}:{int(stat.st_mtime)}"
+        job = ImportJob.query.filter_by(source=source, fingerprint=fingerprint) \
+            .order_by(ImportJob.id.desc()).first()
+
+        if job is not None and not restart:
+            if job.status == 'done':
+                raise ValueError(f"{path} was already imported (job {job.id}); "
+                                 f"use --restart to import it again")
+            print(f"↩️  Resuming import job {job.id} after row {job.rows_done:,}")
+            return job
+
+        job = ImportJob(source=source, fingerprint=fingerprint, pending_photos=[])
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def run(self, path, file_format=None, restart=False):
+        """Import ``path``. Returns the finished ``ImportJob``."""
+        job = self.start_job(path, restart)
+        if self.photos_dir is None:
+            self.photos_dir = os.path.dirname(os.path.abspath(path))
+        for person_id, photo_path in job.pending_photos or []:
+            self.submit_photo(job, person_id, photo_path)
+
+        started = time.perf_counter()
+        skip = job.rows_done
+        batch, photos, consumed, rejected = [], [], 0, 0
+
+        for number, (record, error) in enumerate(read_rows(path, file_format or detect_format(path)), start=1):
+            if number <= skip:
+                continue
+            values = photo_path = None
+            if error is None:
+                values, photo_path, error = validate_case(record, self.photos_dir, self.allowed_formats)
+            consumed += 1
+            if error:
+                rejected += 1
+                self.reject(number, record, error)
+            else:
+                values['reported_by'] = self.reporter_id
+                batch.append(values)
+                photos.append(photo_path)
+
+            if consumed >= self.batch_size:
+                self.flush(job, batch, photos, consumed, rejected)
+                self.report_progress(job, skip, started)
+                batch, photos, consumed, rejected = [], [], 0, 0
+
+        if consumed:
+            self.flush(job, batch, photos, consumed, rejected)
+        self.record_photos(job, wait_all=True)
+
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        self.report_progress(job, skip, started, final=True)
+        return job
+
+    def flush(self, job, batch, photos, consumed, rejected):
+        """Insert one batch and record the job's progress atomically."""
+        plain = [values for values, path in zip(batch, photos) if not path]
+        with_photo = [(values, path) for values, path in zip(batch, photos) if path]
+        if plain:
+            # Multi-row VALUES inserts, a few hundred rows per statement
+            db.session.execute(insert(MissingPerson), plain)
+        pending = []
+        if with_photo:
+            # These need their ids back in order, which SQLite can only give
+            # one row per statement; photo processing dwarfs that anyway
+            ids = db.session.scalars(
+                insert(MissingPerson).returning(MissingPerson.id, sort_by_parameter_order=True),
+                [values for values, _ in with_photo]
+            ).all()
+            pending = [[person_id, path] for person_id, (_, path) in zip(ids, with_photo)]
+
+        job.rows_done += consumed
+        job.inserted += len(batch)
+        job.rejected += rejected
+        job.pending_photos = (job.pending_photos or []) + pending
+        db.session.commit()
+
+        # Written only once the batch is committed, so a resumed run does
+        # not list the same rows twice
+        if self._rejects:
+            with open(self.rejects_path, 'a', encoding='utf-8') as rejects:
+                rejects.write('\n'.join(self._rejects) + '\n')
+            self._rejects = []
+
+        for person_id, path in pending:
+            self.submit_photo(job, person_id, path)
+        self.record_photos(job)
+
+    def submit_photo(self, job, person_id, path):
+        if not self.workers:
+            self._finished.append((person_id, path, self.process_photo(person_id, path)))
+            return
+        # Keep the backlog (and the job's pending list) bounded
+        while len(self._in_flight) >= self.batch_size:
+            wait(self._in_flight, return_when=FIRST_COMPLETED)
+            self.record_photos(job)
+        future = submit_job(self.workers, import_photo, path, self.upload_dir, self.originals_dir,
+                            person_id, self.allowed_formats, self.max_pixels)
+        self._in_flight[future] = (person_id, path)
+
+    def process_photo(self, person_id, path):
+        try:
+            return import_photo(path, self.upload_dir, self.originals_dir, person_id, self.allowed_formats,
+                                self.max_pixels)
+        except Exception as e:
+            print(f"Error processing image {path}: {e}")
+            return None
+
+    def record_photos(self, job, wait_all=False):
+        """Write finished photos to their cases in one bulk UPDATE."""
+        if wait_all and self._in_flight:
+            wait(self._in_flight)
+        for future in [future for future in self._in_flight if future.done()]:
+            person_id, path = self._in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error processing image {path}: {e}")
+                result = None
+            self._finished.append((person_id, path, result))
+        if not self._finished:
+            return
+
+        updates = []
+        for person_id, path, result in self._finished:
+            if result is None:
+                print(f"⚠️  Skipped photo {path} for case {person_id}: not a usable image")
+                continue
+            filename, renditions, photo_hash = result
+            updates.append({
+                'id': person_id,
+                'photo_filename': renditions['detail']['jpeg'],
+                'photo_renditions': renditions,
+                'photo_hash': to_signed(photo_hash),
+            })
+        if updates:
+            db.session.execute(update(MissingPerson), updates)
+
+        done = {(person_id, path) for person_id, path, _ in self._finished}
+        job.pending_photos = [item for item in job.pending_photos or [] if tuple(item) not in done]
+        job.photos_done += len(updates)
+        db.session.commit()
+        self._finished = []
+
+    def reject(self, number, record, error):
+        if self._shown_rejects < SHOW_REJECTED:
+            print(f"  ⚠️  Row {number} rejected: {error}")
+        elif self._shown_rejects == SHOW_REJECTED:
+            print("  ⚠️  More rows rejected; see the summary")
+        self._shown_rejects += 1
+        if self.rejects_path:
+            self._rejects.append(json.dumps({'row': number, 'error': error, 'record': record}, default=str))
+
+    @staticmethod
+    def report_progress(job, skipped, started, final=False):
+        elapsed = time.perf_counter() - started
+        rows = job.rows_done - skipped
+        rate = rows / elapsed if elapsed else 0
+        prefix = '✅ Imported' if final else '  '
+        print(f"{prefix} {job.rows_done:,} rows: {job.inserted:,} cases, {job.rejected:,} rejected, "
+              f"{job.photos_done:,} photos ({rate:,.0f} rows/s)")
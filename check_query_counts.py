@@ -0,0 +1,124 @@
+"""
+Query-count guard for the main pages.
+
+Seeds a throwaway database with many cases, reporters and sightings, then
+requests each page as a logged-in user and counts the SQL statements it
+runs. A page that issues more statements than its budget (usually an N+1
+lazy load creeping back into a template or serializer) fails the check,
+so this can run in CI:
+
+    python check_query_counts.py
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before it is imported
+_db_dir = tempfile.mkdtemp(prefix='loket-querycount-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'loket.db')}"
+# Measure the queries themselves, not the page cache in front of them
+os.environ['PAGE_CACHE'] = '0'
+
+from sqlalchemy import event
+
+from app import app, init_db
+from models import db, User, MissingPerson, SightingReport
+
+# Maximum statements per request. Counts must not grow with the number of
+# rows on the page, so every budget is a small constant. The logged-in user
+# comes from the user cache and costs nothing once warm.
+QUERY_BUDGETS = {
+    '/': 3,  # latest cases, latest found persons, totals
+    '/browse': 3,  # cards, facet counts, region list
+    '/api/search': 1,
+    '/api/search?q=tall': 1,
+    '/profile': 2,
+    '/case-details/{case_id}': 2,
+}
+
+SEED_CASES = 40
+
+
+@contextmanager
+def count_queries(with_parameters=False):
+    """Collect every SQL statement executed on the app's engine."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters) if with_parameters else statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed():
+    """Spread cases over several reporters and give each a few sightings."""
+    with app.app_context():
+        reporters = []
+        for i in range(5):
+            user = User(name=f'Reporter {i}', email=f'reporter{i}@example.com', phone='0700000000')
+            user.set_password('password')
+            db.session.add(user)
+            reporters.append(user)
+        db.session.flush()
+
+        now = datetime.utcnow()
+        for i in range(SEED_CASES):
+            person = MissingPerson(
+                name=f'Case {i}', age=20 + i % 50, gender='Female' if i % 2 else 'Male',
+                last_seen='Eldoret', last_seen_date=now.date(), region='Rift Valley',
+                description=f'Tall, last seen in a green coat ({i})',
+                contact_name='Contact', contact_phone='0700000000', contact_email='c@example.com',
+                reported_by=1 if i % 3 == 0 else reporters[i % 5].id,
+                date_reported=now - timedelta(minutes=i)
+            )
+            db.session.add(person)
+            db.session.flush()
+            for j in range(3):
+                db.session.add(SightingReport(
+                    missing_person_id=person.id, location='Eldoret town',
+                    sighting_date=now, reporter_name='Witness', reporter_contact='0711000000'
+                ))
+        db.session.commit()
+        return MissingPerson.query.order_by(MissingPerson.id.desc()).first().id
+
+
+def main():
+    init_db()
+    case_id = seed()
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@loket.org', 'password': 'admin123'})
+
+    # Requests run outside any outer app context so each one gets a fresh
+    # session, exactly like production; otherwise the identity map would
+    # hide lazy loads.
+    failures = []
+    for pattern, budget in QUERY_BUDGETS.items():
+        url = pattern.format(case_id=case_id)
+        client.get(url)  # warm-up: one-off work such as index checks
+        with count_queries() as statements:
+            response = client.get(url)
+        status = '✅' if len(statements) <= budget else '❌'
+        print(f"{status} {url}: {len(statements)} queries (budget {budget}), HTTP {response.status_code}")
+        if response.status_code != 200 or len(statements) > budget:
+            failures.append(url)
+            for statement in statements:
+                print(f"      {' '.join(statement.split())[:160]}")
+
+    if failures:
+        print(f"\n{len(failures)} page(s) over their query budget")
+        return 1
+    print("\nAll pages within their query budgets")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Query-plan check for the main pages.
+
+Requests each page against a seeded scratch database (the same one
+check_query_counts.py builds), records every SELECT the route runs and
+asks SQLite for its ``EXPLAIN QUERY PLAN``. Any step that scans a whole
+table instead of searching an index is reported, as is sorting through a
+temporary B-tree, and the check fails if a full scan is found:
+
+    python check_query_plans.py
+"""
+import sys
+
+from check_query_counts import app, db, init_db, seed, count_queries
+
+ROUTES = [
+    '/',
+    '/browse',
+    '/browse?region=Rift Valley',
+    '/api/search',
+    '/api/search?region=Rift Valley',
+    '/api/search?q=tall',
+    '/api/search?cursor={cursor}',
+    '/api/facets',
+    '/api/facets?q=tall&region=Rift Valley',
+    '/api/export',
+    '/api/export?since=2024-01-01',
+    '/profile',
+    '/case-details/{case_id}',
+    '/api/sightings/map?south=-5&west=33&north=5&east=42&zoom=6',
+    '/api/sightings/nearby?lat=-1.28&lon=36.82&radius_km=5',
+    '/api/admin/sightings',
+    '/api/admin/sightings?case_id={case_id}',
+]
+
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def is_full_scan(step):
+    """A plan step that reads every row of a real table without an index."""
+    return step.startswith('SCAN ') and ' USING ' not in step and 'VIRTUAL TABLE' not in step
+
+
+def capture(client, url):
+    """SELECT statements (with parameters) a request executes."""
+    with count_queries(with_parameters=True) as statements:
+        client.get(url)
+    return [(sql, params) for sql, params in statements if sql.lstrip().upper().startswith('SELECT')]
+
+
+def explain(statement, parameters):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def main():
+    init_db()
+    case_id = seed()
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@loket.org', 'password': 'admin123'})
+    cursor = client.get('/api/search?limit=5').get_json()['next_cursor']
+
+    scans = 0
+    seen = set()
+    for pattern in ROUTES:
+        url = pattern.format(case_id=case_id, cursor=cursor)
+        client.get(url)  # warm-up: one-off work such as index checks
+        print(url)
+        new_statements = [(statement, parameters) for statement, parameters in capture(client, url)
+                          if statement not in seen]
+        if not new_statements:
+            print("  (only statements already checked above)")
+        for statement, parameters in new_statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(statement, parameters)
+            problems = [step for step in plan if is_full_scan(step) or TEMP_SORT in step]
+            is_scan = any(is_full_scan(step) for step in problems)
+            scans += is_scan
+            status = '❌' if is_scan else ('⚠️ ' if problems else '✅')
+            print(f"  {status} {' '.join(statement.split())[:110]}")
+            for step in plan:
+                print(f"       {step}")
+
+    if scans:
+        print(f"\n{scans} query plan(s) with a full table scan")
+        return 1
+    print("\nNo full table scans")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Upload guard for the report form's photo pipeline.
+
+Files a missing person report with each kind of photo a phone or browser
+may send, on a throwaway database with photos rendered inline, and checks
+that every one ends up with its renditions and that no original (which
+still has its EXIF data) is left where it could be served. A format that
+is silently dropped (the report saved with no photo) fails the check:
+
+    python check_uploads.py
+"""
+import io
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch database and upload folder before it is imported
+_work_dir = tempfile.mkdtemp(prefix='loket-uploads-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_work_dir, 'loket.db')}"
+os.environ['IMAGE_WORKERS'] = '0'
+os.environ['MAIL_WORKER'] = 'external'
+
+from PIL import Image
+
+from app import app, init_db
+from images import is_original
+from models import MissingPerson
+
+app.config['UPLOAD_FOLDER'] = os.path.join(_work_dir, 'uploads')
+app.config['ORIGINALS_FOLDER'] = os.path.join(_work_dir, 'originals')
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['ORIGINALS_FOLDER'], exist_ok=True)
+
+
+def photo(image_format, **options):
+    """A small test photo encoded as ``image_format``."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (120, 90, 60)).save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def mpo_photo():
+    """Two-frame MPO, as written by phones with more than one camera."""
+    return photo('MPO', save_all=True, append_images=[Image.new('RGB', (640, 480), (60, 90, 120))])
+
+
+# (label, filename sent by the browser, file contents)
+UPLOADS = [
+    ('jpeg', 'photo.jpg', photo('JPEG')),
+    ('mpo', 'IMG_0001.jpg', mpo_photo()),
+    ('png', 'photo.png', photo('PNG')),
+    ('webp', 'photo.webp', photo('WEBP')),
+]
+
+
+def report_form(filename, data):
+    return {
+        'name': 'Upload Check', 'age': '30', 'gender': 'Female', 'last_seen': 'Eldoret',
+        'last_seen_date': '2024-01-01', 'region': 'Rift Valley', 'description': 'Upload check',
+        'contact_name': 'Contact', 'contact_phone': '0700000000', 'contact_email': 'c@example.com',
+        'photo': (io.BytesIO(data), filename),
+    }
+
+
+def main():
+    init_db()
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@loket.org', 'password': 'admin123'})
+
+    failures = []
+    for label, filename, data in UPLOADS:
+        response = client.post('/report-missing', data=report_form(filename, data),
+                               content_type='multipart/form-data')
+        with app.app_context():
+            person = MissingPerson.query.order_by(MissingPerson.id.desc()).first()
+            renditions = person.photo_renditions if person else None
+        ok = response.status_code == 302 and bool(renditions)
+        print(f"{'✅' if ok else '❌'} {label}: HTTP {response.status_code}, "
+              f"{'renditions ' + ', '.join(sorted(renditions)) if renditions else 'no photo'}")
+        if not ok:
+            failures.append(label)
+
+    # Originals keep their EXIF data (GPS included): never in the static tree, never served
+    public = [name for name in os.listdir(app.config['UPLOAD_FOLDER']) if is_original(name)]
+    originals = [name for name in os.listdir(app.config['ORIGINALS_FOLDER']) if is_original(name)]
+    served = client.get(f"/static/uploads/{originals[0]}").status_code if originals else None
+    ok = not public and len(originals) == len(UPLOADS) and served == 404
+    print(f"{'✅' if ok else '❌'} originals: {len(originals)} kept private, {len(public)} in the static tree, "
+          f"HTTP {served} for an original's URL")
+    if not ok:
+        failures.append('originals')
+
+    if failures:
+        print(f"\n{len(failures)} upload check(s) failed: {', '.join(failures)}")
+        return 1
+    print("\nAll uploads processed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
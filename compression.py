@@ -0,0 +1,199 @@
+"""
+Response compression for dynamic pages and JSON.
+
+``CompressionMiddleware`` wraps the WSGI app and compresses responses with
+brotli (when the optional ``Brotli`` package is installed) or gzip,
+whichever the client prefers. A response is left alone when:
+
+* its type is not in ``COMPRESSIBLE_TYPES`` (images are already compressed,
+  ``text/event-stream`` must reach the browser event by event);
+* it already has a ``Content-Encoding`` (e.g. precompressed ``/assets/``);
+* its ``Content-Length`` is under ``min_size``, where headers and framing
+  would eat the saving;
+* it is a HEAD request, a 204/206/304 or marked ``Cache-Control: no-transform``.
+
+Bodies without a ``Content-Length`` (generator responses such as the NDJSON
+search) are compressed chunk by chunk with a sync flush after each one, so
+every chunk reaches the client as soon as the app yields it.
+
+The levels are tuned for per-request work, not for the best ratio; static
+files are compressed at maximum level ahead of time (see assets.py).
+"""
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'text/xml',
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+}
+
+DEFAULT_MIN_SIZE = 500
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+_ETAG_SUFFIX = re.compile(r'-(br|gzip)"')
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits=31: gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, flush=False):
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def accepted_encodings(header):
+    """Codings from an Accept-Encoding header with a non-zero q value."""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return {coding for coding, quality in accepted.items() if quality > 0}
+
+
+class CompressionMiddleware:
+    """WSGI middleware that compresses eligible responses."""
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, gzip_level=DEFAULT_GZIP_LEVEL,
+                 brotli_quality=DEFAULT_BROTLI_QUALITY, types=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.types = set(types)
+
+    def choose_encoder(self, environ):
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        if brotli is not None and 'br' in accepted:
+            return BrotliEncoder(self.brotli_quality)
+        if 'gzip' in accepted or '*' in accepted:
+            return GzipEncoder(self.gzip_level)
+        return None
+
+    def eligible(self, environ, status, headers):
+        code = int(status.split(' ', 1)[0])
+        if environ.get('REQUEST_METHOD') == 'HEAD' or code in (204, 206, 304) or code < 200:
+            return False
+        content_type = headers.get('content-type', '').split(';', 1)[0].strip().lower()
+        if content_type not in self.types or 'content-encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('cache-control', ''):
+            return False
+        length = headers.get('content-length')
+        return length is None or not length.isdigit() or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        # Tags we sent were suffixed per encoding; the app only knows the bare tag
+        revalidated = None
+        if 'HTTP_IF_NONE_MATCH' in environ:
+            match = _ETAG_SUFFIX.search(environ['HTTP_IF_NONE_MATCH'])
+            if match:
+                revalidated = match.group(1)
+                environ['HTTP_IF_NONE_MATCH'] = _ETAG_SUFFIX.sub('"', environ['HTTP_IF_NONE_MATCH'])
+
+        encoder = None
+
+        def compressing_start_response(status, headers, exc_info=None):
+            nonlocal encoder
+            if revalidated and status.startswith('304'):
+                # Confirm the tag the client holds, i.e. the compressed one
+                headers = [(name, suffix_etag(value, revalidated) if name.lower() == 'etag' else value)
+                           for name, value in headers]
+            lookup = {name.lower(): value for name, value in headers}
+            content_type = lookup.get('content-type', '').split(';', 1)[0].strip().lower()
+            if content_type in self.types:
+                headers = vary_on_encoding(headers)
+            if self.eligible(environ, status, lookup):
+                encoder = self.choose_encoder(environ)
+            if encoder is not None:
+                headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                headers = [(name, suffix_etag(value, encoder.name) if name.lower() == 'etag' else value)
+                           for name, value in headers]
+                headers.append(('Content-Encoding', encoder.name))
+            write = start_response(status, headers, exc_info)
+            if encoder is None:
+                return write
+            return lambda data: write(encoder.compress(data, flush=True))
+
+        body = self.app(environ, compressing_start_response)
+        if encoder is None:
+            return body
+        return compress_body(body, encoder)
+
+
+def compress_body(body, encoder):
+    """Compress an iterable body, flushing after every chunk the app yields."""
+    try:
+        for chunk in body:
+            if chunk:
+                data = encoder.compress(chunk, flush=True)
+                if data:
+                    yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def vary_on_encoding(headers):
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == 'vary':
+            if 'accept-encoding' not in value.lower():
+                headers = list(headers)
+                headers[i] = (name, f'{value}, Accept-Encoding')
+            return headers
+    return list(headers) + [('Vary', 'Accept-Encoding')]
+
+
+def suffix_etag(etag, encoding):
+    """A compressed body is a different representation, so it needs its own tag."""
+    if etag.endswith('"'):
+        return etag[:-1] + ETAG_SUFFIXES[encoding] + '"'
+    return etag
+
+
+def init_compression(app):
+    """Wrap ``app.wsgi_app`` according to ``app.config``."""
+    if not app.config.get('COMPRESSION', True):
+        return
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE),
+        gzip_level=app.config.get('COMPRESSION_GZIP_LEVEL', DEFAULT_GZIP_LEVEL),
+        brotli_quality=app.config.get('COMPRESSION_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY),
+    )
@@ -0,0 +1,152 @@
+"""
+SQLite engine profile for running several web workers on one database file.
+
+With SQLite's defaults (rollback journal, ``synchronous=FULL``) a writer
+holds an exclusive lock while it commits, so every reader in every other
+worker stalls behind it and busy workers see "database is locked". The
+``wal`` profile switches the file to write-ahead logging, where readers
+work from a snapshot and never wait for writers; writers still take turns,
+but queue on ``busy_timeout`` instead of failing.
+
+``init_database(app, db)`` replaces ``db.init_app(app)``. It reads:
+
+* ``SQLITE_PROFILE``   -- ``wal`` (default) or ``default`` for SQLite's own settings
+* ``DB_POOL_SIZE``     -- connections kept open per worker process
+* ``DB_READ_ROUTING``  -- send queries from ``@read_only`` views through a
+  separate read-only engine, so they never share a connection (or its
+  pending write transaction) with request handlers that write
+"""
+import os
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+READ_BIND = 'read'
+
+SQLITE_PROFILES = {
+    # Whatever SQLite and the driver do out of the box
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        # Never corrupts; a power cut can only roll back the last few commits
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # ms a writer waits for the write lock
+        'cache_size': -32000,  # KiB of page cache per connection
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+
+def engine_options(pool_size):
+    """Pool settings for one worker: a few long-lived connections.
+
+    Opening a SQLite connection is cheap, but every new one re-runs the
+    pragmas and starts with a cold page cache, so they are kept around.
+    """
+    return {
+        'pool_size': pool_size,
+        'max_overflow': pool_size,
+        'pool_timeout': 10,
+        # The driver's own lock wait; the busy_timeout pragma takes over in WAL mode
+        'connect_args': {'timeout': 5},
+    }
+
+
+def apply_pragmas(pragmas, read_only=False):
+    """Connect-event listener that configures each new DBAPI connection."""
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+    return on_connect
+
+
+class RoutingSession(Session):
+    """Session that sends reads from ``@read_only`` views to the read engine.
+
+    Flushes always use the primary engine, so a view that writes after all
+    still works, it just does not get the benefit.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reads_routed():
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reads_routed():
+    return has_app_context() and g.get('read_only_view', False)
+
+
+def read_only(view):
+    """Mark a view as only reading from the database."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only_view = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def after_commit(session_class, collect, apply):
+    """Act on a transaction's writes once it commits, and never if it rolls back.
+
+    After every flush ``collect(session, pending)`` gets what earlier flushes
+    of the transaction gathered (None at first) and returns the new value,
+    kept in ``session.info``. After the commit ``apply(pending)`` runs if
+    anything was gathered; a rollback drops it.
+    """
+    key = object()
+
+    def on_flush(session, flush_context):
+        pending = collect(session, session.info.get(key))
+        if pending:
+            session.info[key] = pending
+
+    def on_commit(session):
+        pending = session.info.pop(key, None)
+        if pending:
+            apply(pending)
+
+    def on_rollback(session):
+        session.info.pop(key, None)
+
+    event.listen(session_class, 'after_flush', on_flush)
+    event.listen(session_class, 'after_commit', on_commit)
+    event.listen(session_class, 'after_rollback', on_rollback)
+
+
+def init_database(app, db):
+    """Configure the engine(s) for ``app`` and attach ``db`` to it."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    profile = app.config.get('SQLITE_PROFILE', 'wal')
+    pragmas = SQLITE_PROFILES[profile]
+
+    if is_sqlite(uri) and ':memory:' not in uri:
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config.get('DB_POOL_SIZE', 5)))
+        if app.config.get('DB_READ_ROUTING'):
+            app.config.setdefault('SQLALCHEMY_BINDS', {})[READ_BIND] = uri
+
+    db.init_app(app)
+
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', apply_pragmas(pragmas, read_only=key == READ_BIND))
+
+    # Pooled connections must not cross a fork (e.g. gunicorn --preload)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: [engine.dispose(close=False)
+                                                    for engine in engines.values()])
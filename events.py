@@ -0,0 +1,365 @@
+"""
+Live updates for ``/api/stream`` (Server-Sent Events).
+
+Triggers on ``missing_person`` and ``sighting_report`` append a row to the
+``change_event`` table for every new case, every case marked found (or
+reopened) and every new sighting, however it was written: the report form,
+the sighting API, bulk imports. Each web worker runs one ``Broker`` thread
+that polls that table through a channel while anyone is connected and
+fans the events out to its subscribers' queues, so a worker with hundreds
+of open streams still runs one query per poll, not one per browser.
+
+Rows older than ``RETENTION`` are deleted by the same thread every
+``EVENT_PURGE_SECONDS``, whether or not anyone is streaming (the broker is
+started with the first request of each worker), or by ``flask
+purge-events`` from cron.
+
+A channel is anything with ``latest_id()`` and ``fetch(after_id, limit)``;
+``ChangeLogChannel`` is the SQLite one. Another transport (e.g. a pub/sub
+server) only needs those two methods.
+
+Each open stream holds a connection and a thread, so serve this app with a
+threaded or async worker class when streams are in use.
+"""
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from models import db, ChangeEvent, MissingPerson, SightingReport
+
+# Browsers reconnect after this many milliseconds when a stream drops
+RETRY_MS = 3000
+# Comment line sent when nothing happened, so proxies keep the stream open
+HEARTBEAT_SECONDS = 15
+# Undelivered events kept per subscriber before it is dropped (it reconnects
+# with Last-Event-ID and catches up from the change log)
+QUEUE_SIZE = 500
+FETCH_LIMIT = 500
+# Change-log rows older than this are deleted by the broker
+RETENTION = timedelta(days=1)
+DEFAULT_PURGE_SECONDS = 600
+
+CHANGE_LOG_SCHEMA = [
+    """
+    CREATE TRIGGER IF NOT EXISTS change_event_case_ai AFTER INSERT ON missing_person BEGIN
+        INSERT INTO change_event (kind, case_id, row_id, region, created_at)
+        VALUES ('case', new.id, new.id, new.region, CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_event_case_found AFTER UPDATE OF is_found ON missing_person
+    WHEN new.is_found IS NOT old.is_found BEGIN
+        INSERT INTO change_event (kind, case_id, row_id, region, created_at)
+        VALUES (CASE WHEN new.is_found THEN 'found' ELSE 'reopened' END,
+                new.id, new.id, new.region, CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_event_sighting_ai AFTER INSERT ON sighting_report BEGIN
+        INSERT INTO change_event (kind, case_id, row_id, region, created_at)
+        VALUES ('sighting', new.missing_person_id, new.id,
+                (SELECT region FROM missing_person WHERE id = new.missing_person_id), CURRENT_TIMESTAMP);
+    END
+    """,
+]
+
+_change_log_ready = {}
+
+
+def ensure_change_log():
+    """Create the change_event table and its triggers. Returns True when usable."""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _change_log_ready[engine.url] = False
+        return False
+    try:
+        ChangeEvent.__table__.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            for statement in CHANGE_LOG_SCHEMA:
+                conn.execute(text(statement))
+    except OperationalError as e:
+        print(f"Change log unavailable, /api/stream will only send heartbeats: {e}")
+        _change_log_ready[engine.url] = False
+        return False
+    _change_log_ready[engine.url] = True
+    return True
+
+
+def change_log_available():
+    ready = _change_log_ready.get(db.engine.url)
+    if ready is None:
+        ready = ensure_change_log()
+    return ready
+
+
+def case_payload(person):
+    return {
+        'id': person.id,
+        'name': person.name,
+        'age': person.age,
+        'gender': person.gender,
+        'region': person.region,
+        'last_seen': person.last_seen,
+        'last_seen_date': person.last_seen_date.strftime('%Y-%m-%d'),
+        'photo_url': person.photo_url,
+        'url': f'/case-details/{person.id}',
+        'is_found': bool(person.is_found),
+    }
+
+
+def sighting_payload(sighting):
+    return {
+        'id': sighting.id,
+        'missing_person_id': sighting.missing_person_id,
+        'location': sighting.location,
+        'latitude': sighting.latitude,
+        'longitude': sighting.longitude,
+        'sighting_date': sighting.sighting_date.isoformat(),
+    }
+
+
+class Event:
+    __slots__ = ('id', 'kind', 'case_id', 'region', 'data')
+
+    def __init__(self, id, kind, case_id, region, data):
+        self.id = id
+        self.kind = kind
+        self.case_id = case_id
+        self.region = region
+        self.data = data
+
+    def encode(self):
+        """The event as an SSE message."""
+        return f"id: {self.id}\nevent: {self.kind}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class ChangeLogChannel:
+    """Reads events from the ``change_event`` table.
+
+    ``fetch`` costs at most three queries per call however many events and
+    subscribers there are: the log rows, then the cases and the sightings
+    they refer to.
+    """
+
+    def latest_id(self):
+        if not change_log_available():
+            return 0
+        return db.session.query(db.func.max(ChangeEvent.id)).scalar() or 0
+
+    def fetch(self, after_id, limit=FETCH_LIMIT):
+        """Events after ``after_id`` and the id to continue from next time.
+
+        At most ``limit`` log rows are read; the id returned equals
+        ``after_id`` only once there is nothing left to read.
+        """
+        if not change_log_available():
+            return [], after_id
+        rows = ChangeEvent.query.filter(ChangeEvent.id > after_id) \
+            .order_by(ChangeEvent.id).limit(limit).all()
+        case_ids = {row.case_id for row in rows if row.kind != 'sighting'}
+        sighting_ids = {row.row_id for row in rows if row.kind == 'sighting'}
+        cases = {person.id: person for person in
+                 MissingPerson.query.filter(MissingPerson.id.in_(list(case_ids)))} if case_ids else {}
+        sightings = {sighting.id: sighting for sighting in
+                     SightingReport.query.filter(SightingReport.id.in_(list(sighting_ids)))} if sighting_ids else {}
+
+        events = []
+        for row in rows:
+            if row.kind == 'sighting':
+                record, payload = sightings.get(row.row_id), sighting_payload
+            else:
+                record, payload = cases.get(row.case_id), case_payload
+            if record is None:
+                continue  # deleted since
+            events.append(Event(row.id, row.kind, row.case_id, row.region, payload(record)))
+        return events, rows[-1].id if rows else after_id
+
+    def purge(self, older_than):
+        """Delete log rows written before ``older_than``. Returns how many."""
+        if not change_log_available():
+            return 0
+        purged = ChangeEvent.query.filter(ChangeEvent.created_at < older_than).delete(synchronize_session=False)
+        db.session.commit()
+        return purged
+
+
+CHANNELS = {'changelog': ChangeLogChannel}
+
+
+class Subscription:
+    """One open stream: its filters and the queue the broker fills."""
+
+    def __init__(self, region=None, case_id=None, kinds=None):
+        self.region = region
+        self.case_id = case_id
+        self.kinds = kinds
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = False
+
+    def matches(self, event):
+        return ((self.kinds is None or event.kind in self.kinds)
+                and (self.region is None or event.region == self.region)
+                and (self.case_id is None or event.case_id == self.case_id))
+
+    def offer(self, event):
+        if self.dropped or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Too slow to keep up; the client reconnects and replays
+            self.dropped = True
+
+
+class Broker(threading.Thread):
+    """Polls the channel for this process and fans events out to subscribers."""
+
+    def __init__(self, app, channel, poll_interval=1.0, purge_interval=DEFAULT_PURGE_SECONDS):
+        super().__init__(name='event-broker', daemon=True)
+        self.app = app
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_id = None
+        self._purged_at = time.monotonic()  # first purge one interval in, not at every worker start
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscribers.add(subscription)
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def poll(self):
+        """Fetch every new event and hand it to each matching subscriber."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            self._last_id = None  # idle: skip whatever happens until someone connects
+            return
+        with self.app.app_context():
+            try:
+                if self._last_id is None:
+                    self._last_id = self.channel.latest_id()
+                    return
+                # A burst may be more than one fetch; read until caught up
+                while True:
+                    events, last_id = self.channel.fetch(self._last_id)
+                    if last_id == self._last_id:
+                        break
+                    self._last_id = last_id
+                    for event in events:
+                        for subscription in subscribers:
+                            subscription.offer(event)
+            finally:
+                db.session.remove()
+
+    def purge_if_due(self):
+        """Delete change-log rows past ``RETENTION`` every ``purge_interval`` seconds."""
+        if not self.purge_interval:
+            return
+        if time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.monotonic()
+        with self.app.app_context():
+            try:
+                self.channel.purge(datetime.utcnow() - RETENTION)
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+                self.purge_if_due()
+            except Exception as e:
+                print(f"❌ Event broker error: {e}")
+            if not self._subscribers:
+                self._wake.wait(self.purge_interval or None)
+            else:
+                self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker(app):
+    """This process's broker thread, started on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            channel = CHANNELS[app.config.get('EVENT_CHANNEL', 'changelog')]()
+            _broker = Broker(app, channel, app.config.get('EVENT_POLL_SECONDS', 1.0),
+                             app.config.get('EVENT_PURGE_SECONDS', DEFAULT_PURGE_SECONDS))
+            _broker.start()
+    return _broker
+
+
+def init_change_log_purge(app):
+    """Start this process's broker with its first request, so it purges the log even with no streams."""
+    @app.before_request
+    def start_broker():
+        if _broker is None:
+            get_broker(app)
+
+
+def purge_change_log(channel=None):
+    """Delete change-log rows past ``RETENTION`` now. Returns how many."""
+    return (channel or ChangeLogChannel()).purge(datetime.utcnow() - RETENTION)
+
+
+def replay(app, channel, subscription, last_event_id):
+    """Events after ``last_event_id`` that the subscriber missed while disconnected.
+
+    Reads the log a batch at a time until it is caught up, so a long
+    absence is replayed in full without holding it all in memory.
+    """
+    while True:
+        with app.app_context():
+            try:
+                events, next_id = channel.fetch(last_event_id)
+            finally:
+                db.session.remove()
+        if next_id == last_event_id:
+            return
+        last_event_id = next_id
+        for event in events:
+            if subscription.matches(event):
+                yield event
+
+
+def stream(broker, subscription, last_event_id=None):
+    """Generate the SSE body for one subscriber until it disconnects."""
+    broker.subscribe(subscription)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        sent = 0
+        if last_event_id is not None:
+            for event in replay(broker.app, broker.channel, subscription, last_event_id):
+                yield event.encode()
+                sent = event.id
+        while True:
+            try:
+                event = subscription.queue.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if subscription.dropped:
+                return  # the browser reconnects with Last-Event-ID and catches up
+            if event.id > sent:
+                yield event.encode()
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,155 @@
+"""
+Streaming export of cases for partner agencies and nightly jobs.
+
+``/api/export`` and ``flask export-cases`` write every open case, or with
+``since`` every case changed after that moment (including cases closed
+since, so a mirror can drop them), as CSV or JSON Lines. Rows come from a
+single SELECT of plain columns read ``EXPORT_BATCH`` rows at a time and
+written out batch by batch, so memory stays flat however many cases there
+are, and the whole export is one consistent snapshot.
+
+``missing_person.updated_at`` records the last write to each row. The ORM
+sets it; a trigger sets it for writes that bypass the ORM (bulk imports,
+geocoding). The ORM stamps the row at flush time, before the writer has
+SQLite's write lock, so a row can be committed after a newer stamp is
+already visible. Each response therefore carries, in
+``X-Export-Watermark``, the newest ``updated_at`` it covers minus
+``WATERMARK_OVERLAP``; pass that back as ``since`` to get the next delta.
+Consecutive deltas overlap by that much, so a client applies rows by
+``id`` (the later ``updated_at`` wins) and sees every change.
+
+Exports are conditional: the ETag is derived from the case data version
+kept by page_cache.py, so re-fetching an unchanged export costs a single
+indexed lookup and returns 304. Compression is left to compression.py
+(or to ``--output file.gz`` for the command).
+"""
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, MissingPerson
+from page_cache import page_cache
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+EXPORT_BATCH = 1000
+# Longest a write may take from stamping updated_at to committing: well past
+# the 5 s busy_timeout a writer waits for the lock (database.py)
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+EXPORT_COLUMNS = ['id', 'name', 'age', 'gender', 'last_seen', 'last_seen_date', 'last_seen_lat',
+                  'last_seen_lon', 'region', 'description', 'photo_url', 'date_reported', 'updated_at',
+                  'is_found']
+
+# Same text format SQLAlchemy stores DateTime values in, so they compare as text
+TOUCH_SCHEMA = [
+    """
+    CREATE TRIGGER IF NOT EXISTS missing_person_touch AFTER UPDATE ON missing_person
+    WHEN new.updated_at IS old.updated_at BEGIN
+        UPDATE missing_person SET updated_at = strftime('%Y-%m-%d %H:%M:%f000', 'now') WHERE id = new.id;
+    END
+    """,
+]
+
+_tracking_ready = {}
+
+
+def ensure_change_tracking():
+    """Create the trigger that keeps ``updated_at`` current. Returns True when usable."""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _tracking_ready[engine.url] = False  # the ORM's onupdate still covers most writes
+        return False
+    try:
+        with engine.begin() as conn:
+            for statement in TOUCH_SCHEMA:
+                conn.execute(text(statement))
+    except OperationalError as e:
+        print(f"Change tracking unavailable, deltas only see ORM writes: {e}")
+        _tracking_ready[engine.url] = False
+        return False
+    _tracking_ready[engine.url] = True
+    return True
+
+
+def change_tracking_available():
+    ready = _tracking_ready.get(db.engine.url)
+    if ready is None:
+        ready = ensure_change_tracking()
+    return ready
+
+
+def parse_since(value):
+    """``since`` as a naive UTC datetime (ISO 8601 date or time), or None."""
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('since must be an ISO 8601 date or timestamp, e.g. 2024-05-01T12:00:00Z')
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def export_query(since=None):
+    columns = [MissingPerson.photo_url.label('photo_url') if name == 'photo_url' else getattr(MissingPerson, name)
+               for name in EXPORT_COLUMNS]
+    query = select(*columns)
+    # Both orders follow an index, so rows stream without a sort first
+    if since is None:
+        return query.where(MissingPerson.is_found == False) \
+            .order_by(MissingPerson.date_reported, MissingPerson.id)
+    return query.where(MissingPerson.updated_at > since) \
+        .order_by(MissingPerson.updated_at, MissingPerson.id)
+
+
+def export_watermark():
+    """Newest ``updated_at`` of any case."""
+    return db.session.query(func.max(MissingPerson.updated_at)).scalar()
+
+
+def next_since(watermark):
+    """The ``since`` for the next delta: ``watermark`` less the overlap for late commits."""
+    return (watermark - WATERMARK_OVERLAP).isoformat(timespec='microseconds')
+
+
+def export_etag(file_format, since):
+    """Changes whenever a case does (or the parameters differ)."""
+    version = page_cache.version()
+    if version is None:
+        version = (export_watermark(), db.session.query(func.count(MissingPerson.id)).scalar())
+    key = f"{version}:{file_format}:{since.isoformat() if since else ''}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='microseconds')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_chunks(file_format, since=None, batch_size=EXPORT_BATCH):
+    """Generate the export as text, one chunk per batch of rows."""
+    change_tracking_available()
+    result = db.session.execute(export_query(since).execution_options(yield_per=batch_size))
+    if file_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for batch in result.partitions():
+            writer.writerows([plain(value) for value in row] for row in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for batch in result.partitions():
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, map(plain, row)))) + '\n' for row in batch)
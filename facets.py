@@ -0,0 +1,240 @@
+"""
+Faceted counts and case statistics without scanning ``missing_person``.
+
+Two summary tables hold the counts, and triggers on ``missing_person`` move
+them on every insert, delete and change of status, region, gender, age or
+report date. ``report_missing``, marking a case found, bulk imports and raw
+SQL therefore all keep them exact with no application code:
+
+* ``case_stat`` -- cases per (is_found, region, gender, age band), a few
+  hundred rows at most;
+* ``case_daily_stat`` -- cases per (report day, is_found, region), for
+  "reported in the last N days".
+
+Counts for the whole listing or one region are read from these tables in
+one statement, so they cost O(facet values) however many cases there are.
+With a search term they come from a single GROUP BY pass over the matching
+cases. As usual for facets, the region counts ignore the selected region,
+so every region shows how many cases choosing it would give.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal, null, text, union_all
+from sqlalchemy.exc import OperationalError
+
+from models import db, MissingPerson, CaseStat, CaseDailyStat
+from search import filter_matching
+
+# (label, first age above the band); the last band has no upper bound
+AGE_BANDS = [('0-12', 13), ('13-17', 18), ('18-29', 30), ('30-44', 45), ('45-64', 65), ('65+', None)]
+
+# Windows of the "reported in the last N days" facet
+RECENT_DAYS = (7, 30, 90)
+MAX_RECENT_DAYS = 366
+
+
+def age_band_sql(age):
+    """SQL CASE giving the age band label of ``age`` (a column reference)."""
+    whens = ' '.join(f"WHEN {age} < {upper} THEN '{label}'" for label, upper in AGE_BANDS if upper)
+    return f"CASE {whens} ELSE '{AGE_BANDS[-1][0]}' END"
+
+
+def age_band(age):
+    """The same banding as ``age_band_sql``, as an SQLAlchemy expression."""
+    return db.case(*[(age < upper, label) for label, upper in AGE_BANDS if upper], else_=AGE_BANDS[-1][0])
+
+
+def _count(row, sign):
+    """Statements adding ``sign`` to the counts of ``row`` (``new`` or ``old``)."""
+    return f"""
+        INSERT INTO case_stat (is_found, region, gender, age_band, count)
+        VALUES (coalesce({row}.is_found, 0), {row}.region, {row}.gender, {age_band_sql(f'{row}.age')}, {sign})
+        ON CONFLICT (is_found, region, gender, age_band) DO UPDATE SET count = count + excluded.count;
+        INSERT INTO case_daily_stat (day, is_found, region, count)
+        VALUES (coalesce(date({row}.date_reported), ''), coalesce({row}.is_found, 0), {row}.region, {sign})
+        ON CONFLICT (day, is_found, region) DO UPDATE SET count = count + excluded.count;"""
+
+
+FACET_SCHEMA = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS case_stat_ai AFTER INSERT ON missing_person BEGIN
+        {_count('new', 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS case_stat_ad AFTER DELETE ON missing_person BEGIN
+        {_count('old', -1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS case_stat_au
+    AFTER UPDATE OF is_found, region, gender, age, date_reported ON missing_person
+    WHEN old.is_found IS NOT new.is_found OR old.region IS NOT new.region OR old.gender IS NOT new.gender
+        OR old.age IS NOT new.age OR old.date_reported IS NOT new.date_reported BEGIN
+        {_count('old', -1)}
+        {_count('new', 1)}
+    END
+    """,
+]
+
+REBUILD_SCHEMA = [
+    'DELETE FROM case_stat',
+    f"""
+    INSERT INTO case_stat (is_found, region, gender, age_band, count)
+    SELECT coalesce(is_found, 0), region, gender, {age_band_sql('age')}, count(*)
+    FROM missing_person GROUP BY 1, 2, 3, 4
+    """,
+    'DELETE FROM case_daily_stat',
+    """
+    INSERT INTO case_daily_stat (day, is_found, region, count)
+    SELECT coalesce(date(date_reported), ''), coalesce(is_found, 0), region, count(*)
+    FROM missing_person GROUP BY 1, 2, 3
+    """,
+]
+
+_facets_ready = {}
+
+
+def ensure_facets(rebuild=False):
+    """Create the summary tables and their triggers; fill them if they are new.
+
+    Returns True when facet counts can be read from the summary tables.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _facets_ready[engine.url] = False
+        return False
+
+    try:
+        CaseStat.__table__.create(engine, checkfirst=True)
+        CaseDailyStat.__table__.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            existed = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'case_stat_ai'")
+            ).first() is not None
+            # Triggers first: writes made meanwhile are counted, then recounted below
+            for statement in FACET_SCHEMA:
+                conn.execute(text(statement))
+            if rebuild or not existed:
+                for statement in REBUILD_SCHEMA:
+                    conn.execute(text(statement))
+    except OperationalError as e:
+        print(f"Facet summary unavailable, counting cases directly: {e}")
+        _facets_ready[engine.url] = False
+        return False
+
+    _facets_ready[engine.url] = True
+    return True
+
+
+def facets_available():
+    ready = _facets_ready.get(db.engine.url)
+    if ready is None:
+        ready = ensure_facets()
+    return ready
+
+
+def window_starts(days):
+    """First report day (UTC) counted in each "last N days" window."""
+    today = datetime.utcnow().date()
+    return {n: today - timedelta(days=n - 1) for n in days}
+
+
+def summary_rows(starts):
+    """(region, gender, age_band, day, count) of open cases from the summary tables, in one statement."""
+    stats = db.session.query(CaseStat.region, CaseStat.gender, CaseStat.age_band,
+                             null().label('day'), CaseStat.count) \
+        .filter(CaseStat.is_found == False, CaseStat.count > 0)
+    daily = db.session.query(CaseDailyStat.region, null(), null(), CaseDailyStat.day, CaseDailyStat.count) \
+        .filter(CaseDailyStat.is_found == False, CaseDailyStat.count > 0,
+                CaseDailyStat.day >= min(starts.values()).isoformat())
+    return db.session.execute(union_all(stats.statement, daily.statement)).all()
+
+
+def matching_rows(query, starts):
+    """The same rows counted directly from the cases matching ``query``.
+
+    One GROUP BY pass; each case lands in the shortest window it falls in,
+    or none.
+    """
+    windows = sorted(starts.items())
+    day = db.case(*[(MissingPerson.date_reported >= datetime.combine(start, datetime.min.time()),
+                     literal(start.isoformat())) for _, start in windows], else_=None).label('day')
+    band = age_band(MissingPerson.age).label('age_band')
+    results = db.session.query(MissingPerson.region, MissingPerson.gender, band, day, func.count()) \
+        .filter(MissingPerson.is_found == False)
+    results = filter_matching(results, query)
+    rows = results.group_by(MissingPerson.region, MissingPerson.gender, band, day).all()
+    # Split each row in two, the way the summary tables keep them apart
+    return [(region, gender, age, None, count) for region, gender, age, _, count in rows] + \
+           [(region, None, None, start, count) for region, _, _, start, count in rows if start]
+
+
+def facet_counts(query='', region='', days=RECENT_DAYS):
+    """Counts of open cases by region, gender, age band and report recency.
+
+    Returns ``{'total': n, 'region': [{'value', 'count'}, ...], 'gender':
+    [...], 'age': [...], 'reported_within_days': [{'days', 'count'}, ...]}``
+    for the cases matching ``query`` in ``region``.
+    """
+    starts = window_starts(days)
+    if query or not facets_available():
+        rows = matching_rows(query, starts)
+    else:
+        rows = summary_rows(starts)
+
+    regions, genders, bands, per_day = Counter(), Counter(), Counter(), Counter()
+    for row_region, gender, band, day, count in rows:
+        if day is None:
+            regions[row_region] += count
+        if region and row_region != region:
+            continue
+        if day is None:
+            genders[gender] += count
+            bands[band] += count
+        else:
+            per_day[day] += count
+
+    return {
+        'total': sum(genders.values()),
+        'region': [{'value': value, 'count': count} for value, count in regions.most_common() if value],
+        'gender': [{'value': value, 'count': count} for value, count in genders.most_common()],
+        'age': [{'value': label, 'count': bands[label]} for label, _ in AGE_BANDS if bands[label]],
+        'reported_within_days': [
+            {'days': n, 'count': sum(count for day, count in per_day.items() if str(day) >= start.isoformat())}
+            for n, start in sorted(starts.items())
+        ],
+    }
+
+
+def region_names():
+    """Every region with a case, open or found: the options of the region filter."""
+    if facets_available():
+        # Both statuses named, so the lookup walks the primary key, not the table
+        regions = db.session.query(CaseStat.region).distinct() \
+            .filter(CaseStat.is_found.in_([False, True]), CaseStat.count > 0)
+    else:
+        regions = db.session.query(MissingPerson.region).distinct()
+    return sorted(region for (region,) in regions if region)
+
+
+def case_totals():
+    """Home page figures: open and found cases, and cases reported this week."""
+    week_start = window_starts([7])[7]
+    if facets_available():
+        parts = [
+            db.session.query(literal('active'), func.sum(CaseStat.count)).filter(CaseStat.is_found == False),
+            db.session.query(literal('found'), func.sum(CaseStat.count)).filter(CaseStat.is_found == True),
+            db.session.query(literal('recent'), func.sum(CaseDailyStat.count))
+            .filter(CaseDailyStat.day >= week_start.isoformat()),
+        ]
+    else:
+        parts = [
+            db.session.query(literal('active'), func.count()).filter(MissingPerson.is_found == False),
+            db.session.query(literal('found'), func.count()).filter(MissingPerson.is_found == True),
+            db.session.query(literal('recent'), func.count())
+            .filter(MissingPerson.date_reported >= datetime.combine(week_start, datetime.min.time())),
+        ]
+    rows = db.session.execute(union_all(*[part.statement for part in parts])).all()
+    return {key: count or 0 for key, count in rows}
@@ -0,0 +1,403 @@
+"""
+Geospatial index for sightings and last-seen locations.
+
+Sightings and cases may carry coordinates (``SightingReport.latitude`` /
+``longitude`` and ``MissingPerson.last_seen_lat`` / ``last_seen_lon``).
+Each table has an SQLite R-tree shadow table (``sighting_geo``,
+``missing_person_geo``) kept up to date by triggers, the same way the FTS5
+index is maintained in search.py, so bulk INSERTs and later edits need no
+extra code. A bounding box is answered from the R-tree and then checked
+against the real columns (R-tree coordinates are stored as 32-bit floats
+and rounded outwards). When the ``rtree`` module is missing the same
+queries filter the coordinate columns directly.
+
+Radius queries compute great-circle distances in SQL and let SQLite sort
+and LIMIT the rows, so only the rows returned are loaded. SQLite builds
+without the math functions (``sin``, ``asin``, ...) order by a flat-earth
+approximation instead and load at most ``CANDIDATES_PER_RESULT`` rows per
+result for the exact check.
+
+Coordinates come from an offline gazetteer (see ``Gazetteer``); nothing is
+sent to an external geocoding service. Boxes that cross the antimeridian
+are not supported.
+"""
+import csv
+import math
+import re
+
+from sqlalchemy import Integer, cast, column, func, literal_column, table, text, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, MissingPerson, SightingReport
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Largest radius accepted by the radius queries
+MAX_RADIUS_KM = 500
+# Rows loaded per result wanted when distances cannot be computed in SQL
+CANDIDATES_PER_RESULT = 4
+
+# Clusters are square grid cells; a 256px map tile is split into this many
+# cells across at every zoom level
+CLUSTER_CELLS_PER_TILE = 4
+MAX_CLUSTER_ZOOM = 20
+
+# Sightings shown on maps unless a status filter is given
+MAP_STATUSES = ('pending', 'reviewed', 'contacted')
+
+# table -> (R-tree table, latitude column, longitude column)
+GEO_TABLES = {
+    'sighting_report': ('sighting_geo', 'latitude', 'longitude'),
+    'missing_person': ('missing_person_geo', 'last_seen_lat', 'last_seen_lon'),
+}
+
+_geo_ready = {}
+_math_ready = {}
+
+
+def geo_schema(source, geo_table, lat, lon):
+    """R-tree table and the triggers that mirror ``source`` into it."""
+    located = f'new.{lat} IS NOT NULL AND new.{lon} IS NOT NULL'
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {geo_table} USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {geo_table}_ai AFTER INSERT ON {source}
+        WHEN {located} BEGIN
+            INSERT INTO {geo_table} VALUES (new.id, new.{lat}, new.{lat}, new.{lon}, new.{lon});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {geo_table}_ad AFTER DELETE ON {source} BEGIN
+            DELETE FROM {geo_table} WHERE id = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {geo_table}_au AFTER UPDATE OF {lat}, {lon} ON {source} BEGIN
+            DELETE FROM {geo_table} WHERE id = old.id;
+            INSERT INTO {geo_table}
+            SELECT new.id, new.{lat}, new.{lat}, new.{lon}, new.{lon} WHERE {located};
+        END
+        """,
+    ]
+
+
+def rebuild_statements(source, geo_table, lat, lon):
+    return [
+        f'DELETE FROM {geo_table}',
+        f'INSERT INTO {geo_table} SELECT id, {lat}, {lat}, {lon}, {lon} FROM {source} '
+        f'WHERE {lat} IS NOT NULL AND {lon} IS NOT NULL',
+    ]
+
+
+def ensure_geo_index(rebuild=False):
+    """Create the R-tree tables and their triggers; backfill new ones.
+
+    Returns True when the index is usable.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _geo_ready[engine.url] = False
+        return False
+
+    try:
+        with engine.begin() as conn:
+            for source, (geo_table, lat, lon) in GEO_TABLES.items():
+                existed = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {'name': geo_table}
+                ).first() is not None
+                for statement in geo_schema(source, geo_table, lat, lon):
+                    conn.execute(text(statement))
+                if rebuild or not existed:
+                    for statement in rebuild_statements(source, geo_table, lat, lon):
+                        conn.execute(text(statement))
+    except OperationalError as e:
+        print(f"R-tree index unavailable, filtering coordinates directly: {e}")
+        _geo_ready[engine.url] = False
+        return False
+
+    _geo_ready[engine.url] = True
+    return True
+
+
+def geo_available():
+    """Whether queries can use the R-tree index (checked once per engine)."""
+    ready = _geo_ready.get(db.engine.url)
+    if ready is None:
+        ready = ensure_geo_index()
+    return ready
+
+
+def sql_math_available():
+    """Whether SQLite has its math functions (SQLITE_ENABLE_MATH_FUNCTIONS), checked once per engine."""
+    engine = db.engine
+    ready = _math_ready.get(engine.url)
+    if ready is None:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT asin(sqrt(sin(radians(1)) * cos(radians(1))))'))
+            ready = True
+        except OperationalError:
+            ready = False
+        _math_ready[engine.url] = ready
+    return ready
+
+
+def coordinates(model):
+    """The latitude and longitude columns of ``model``."""
+    _, lat, lon = GEO_TABLES[model.__tablename__]
+    return getattr(model, lat), getattr(model, lon)
+
+
+def geo_table(model):
+    name = GEO_TABLES[model.__tablename__][0]
+    return table(name, column('id'), column('min_lat'), column('max_lat'), column('min_lon'), column('max_lon'))
+
+
+def within_box(query, model, south, west, north, east):
+    """Restrict ``query`` (over ``model``) to rows located inside the box."""
+    lat, lon = coordinates(model)
+    if geo_available():
+        geo = geo_table(model)
+        query = query.join(geo, geo.c.id == model.id) \
+            .filter(geo.c.min_lat <= north, geo.c.max_lat >= south,
+                    geo.c.min_lon <= east, geo.c.max_lon >= west)
+    return query.filter(lat.between(south, north), lon.between(west, east))
+
+
+def bounding_box(lat, lon, radius_km):
+    """``(south, west, north, east)`` of a box enclosing the circle."""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return max(-90.0, lat - dlat), max(-180.0, lon - dlon), min(90.0, lat + dlat), min(180.0, lon + dlon)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_sql(lat_column, lon_column, lat, lon):
+    """``haversine_km`` from a fixed point as an SQL expression (needs the math functions)."""
+    half_dlat = func.sin(func.radians(lat_column - lat) / 2)
+    half_dlon = func.sin(func.radians(lon_column - lon) / 2)
+    a = half_dlat * half_dlat + math.cos(math.radians(lat)) * func.cos(func.radians(lat_column)) * half_dlon * half_dlon
+    return 2 * EARTH_RADIUS_KM * func.asin(func.min(1.0, func.sqrt(a)))
+
+
+def within_radius(query, model, lat, lon, radius_km, limit=100):
+    """Rows of ``query`` within ``radius_km`` of a point, nearest first.
+
+    The box around the circle is fetched through the index, and SQLite
+    orders those candidates by distance and returns the first ``limit``.
+    Returns ``[(row, km), ...]``.
+    """
+    lat_column, lon_column = coordinates(model)
+    query = within_box(query, model, *bounding_box(lat, lon, radius_km))
+    if sql_math_available():
+        distance = haversine_sql(lat_column, lon_column, lat, lon)
+        rows = query.add_columns(distance.label('_distance')).filter(distance <= radius_km) \
+            .order_by(literal_column('_distance')).limit(limit).all()
+        return [(row[0], row._distance) for row in rows]
+
+    # Flat-earth distance orders the box well enough to pick candidates;
+    # the exact distance of those decides
+    dlat = lat_column - lat
+    dlon = (lon_column - lon) * math.cos(math.radians(lat))
+    rows = query.add_columns(lat_column.label('_lat'), lon_column.label('_lon')) \
+        .order_by(dlat * dlat + dlon * dlon).limit(limit * CANDIDATES_PER_RESULT).all()
+    nearby = []
+    for row in rows:
+        distance = haversine_km(lat, lon, row._lat, row._lon)
+        if distance <= radius_km:
+            nearby.append((row[0], distance))
+    nearby.sort(key=lambda item: item[1])
+    return nearby[:limit]
+
+
+def cluster_size(zoom):
+    """Width in degrees of a cluster cell at map zoom level ``zoom``."""
+    return 360.0 / (2 ** zoom * CLUSTER_CELLS_PER_TILE)
+
+
+def parse_box(args):
+    """``(south, west, north, east)`` from request args; raises ValueError."""
+    try:
+        south, west, north, east = (float(args[name]) for name in ('south', 'west', 'north', 'east'))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Give the box as numeric south, west, north and east')
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        raise ValueError('Box must have -90 <= south <= north <= 90 and -180 <= west <= east <= 180')
+    return south, west, north, east
+
+
+def parse_point(args, default_radius=5.0):
+    """``(lat, lon, radius_km)`` from request args; raises ValueError."""
+    try:
+        lat, lon = float(args['lat']), float(args['lon'])
+        radius_km = float(args.get('radius_km', default_radius))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Give numeric lat, lon and (optionally) radius_km')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('lat must be within [-90, 90] and lon within [-180, 180]')
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise ValueError(f'radius_km must be above 0 and at most {MAX_RADIUS_KM}')
+    return lat, lon, radius_km
+
+
+def sighting_clusters(south, west, north, east, zoom, case_id=None, statuses=MAP_STATUSES):
+    """Sightings inside the box grouped into grid cells, in one query.
+
+    Each cluster has its count, the mean position of its sightings (where a
+    map would draw the marker) and one sighting id, which is the sighting
+    itself when the cluster has a single member.
+    """
+    cell = cluster_size(zoom)
+    lat, lon = coordinates(SightingReport)
+    row_cell = cast((lat + 90) / cell, Integer).label('row')
+    column_cell = cast((lon + 180) / cell, Integer).label('col')
+    query = db.session.query(row_cell, column_cell, func.count().label('count'),
+                             func.avg(lat).label('latitude'), func.avg(lon).label('longitude'),
+                             func.min(SightingReport.id).label('sighting_id'))
+    query = within_box(query, SightingReport, south, west, north, east)
+    query = filter_sightings(query, case_id, statuses)
+    return query.group_by(row_cell, column_cell).all()
+
+
+def filter_sightings(query, case_id=None, statuses=MAP_STATUSES):
+    if case_id is not None:
+        query = query.filter(SightingReport.missing_person_id == case_id)
+    if statuses:
+        condition = SightingReport.status.in_(statuses)
+        if geo_available():
+            # Most sightings pass a status filter; without this hint SQLite
+            # drives the query from the status index instead of the R-tree
+            condition = func.likelihood(condition, literal_column('0.9'))
+        query = query.filter(condition)
+    return query
+
+
+def normalize_place(name):
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+class Gazetteer:
+    """Offline place-name lookup.
+
+    Reads either a CSV file with ``name``, ``latitude`` and ``longitude``
+    columns (``lat``/``lon`` also work; other columns are ignored) or a
+    GeoNames dump (tab-separated ``.txt``), where alternate names are indexed
+    too and the most populous place wins when names collide.
+    """
+
+    def __init__(self, places=None):
+        self.places = places or {}
+
+    @classmethod
+    def load(cls, path):
+        if path.endswith('.txt') or path.endswith('.tsv'):
+            return cls(cls._read_geonames(path))
+        return cls(cls._read_csv(path))
+
+    @staticmethod
+    def _read_csv(path):
+        places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                row = {key.strip().lower(): value for key, value in row.items() if key}
+                try:
+                    point = (float(row.get('latitude') or row['lat']),
+                             float(row.get('longitude') or row['lon']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                places.setdefault(normalize_place(row.get('name')), point)
+        places.pop('', None)
+        return places
+
+    @staticmethod
+    def _read_geonames(path):
+        places = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 15:
+                    continue
+                try:
+                    point = (float(fields[4]), float(fields[5]))
+                    population = int(fields[14] or 0)
+                except ValueError:
+                    continue
+                for name in {fields[1], fields[2], *fields[3].split(',')}:
+                    key = normalize_place(name)
+                    if key and (key not in places or places[key][1] < population):
+                        places[key] = (point, population)
+        return {key: point for key, (point, _) in places.items()}
+
+    def lookup(self, location):
+        """``(lat, lon)`` for a free-text location, or None.
+
+        The whole string is tried first, then each comma-separated part
+        from the most specific ("Bus Stage, Nakuru" -> "bus stage", "nakuru").
+        """
+        candidates = [location] + (location or '').split(',')
+        for candidate in candidates:
+            point = self.places.get(normalize_place(candidate))
+            if point:
+                return point
+        return None
+
+    def __len__(self):
+        return len(self.places)
+
+
+_gazetteers = {}
+
+
+def gazetteer(path):
+    """The gazetteer at ``path``, loaded once per worker."""
+    if path not in _gazetteers:
+        _gazetteers[path] = Gazetteer.load(path)
+    return _gazetteers[path]
+
+
+def geocode_missing(places, batch_size=1000):
+    """Fill in coordinates for cases and sightings that have none yet.
+
+    Rows are read in id order in batches and written back with one bulk
+    UPDATE per batch. Returns ``{table: (geocoded, unmatched)}``.
+    """
+    results = {}
+    for model, text_column in ((MissingPerson, MissingPerson.last_seen), (SightingReport, SightingReport.location)):
+        lat, lon = coordinates(model)
+        geocoded = unmatched = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, text_column) \
+                .filter(model.id > last_id, lat.is_(None)) \
+                .order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, location in rows:
+                point = places.lookup(location)
+                if point:
+                    updates.append({'id': row_id, lat.key: point[0], lon.key: point[1]})
+                else:
+                    unmatched += 1
+            if updates:
+                db.session.execute(update(model), updates)
+                db.session.commit()
+                geocoded += len(updates)
+        results[model.__tablename__] = (geocoded, unmatched)
+    return results
@@ -0,0 +1,355 @@
+"""
+Photo pipeline for missing person reports.
+
+Uploads are validated and written to disk as-is inside the request, to
+``ORIGINALS_FOLDER``: outside the static tree, since an original still has
+its EXIF data (GPS position included) and is never served. The
+expensive part (decoding, resizing and encoding every rendition) runs in a
+local process pool; when it finishes, the renditions are recorded on the
+``MissingPerson`` row so templates can emit ``srcset`` and listing pages
+get a small card image instead of the full-size photo. Renditions are
+re-encoded from pixels only, so they carry no metadata; they are the only
+photo files in ``UPLOAD_FOLDER``.
+
+Every file is content-addressed: its name carries a digest of its bytes
+(``missing_person_5_card.3f2a9c0d1e2b4a5f.webp``), so a URL always refers
+to the same content and can be cached forever.
+
+Large photos are kept out of memory at every step:
+
+* Werkzeug already spools each uploaded file past 500 KB to a temporary
+  file (in ``TMPDIR``) while the form is parsed, and ``save_upload`` copies
+  it to disk in chunks;
+* ``open_upload`` reads only the header and rejects images with more than
+  ``MAX_UPLOAD_PIXELS`` pixels (decompression bombs) before anything is
+  decoded;
+* ``decode_photo`` lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while it
+  decodes (draft mode), so a 24-megapixel phone photo arrives at about the
+  size of the largest rendition, and applies the EXIF orientation only
+  after shrinking, so no full-size copy is ever made.
+
+Pillow, NumPy (via photo_hash) and the process pool are imported by the
+functions that use them, so importing this module for the template helpers
+(``rendition_url``, ``srcset``) costs nothing at startup.
+"""
+import hashlib
+import io
+import os
+import re
+import time
+
+from models import db, MissingPerson
+from instrumentation import IMAGE_SECONDS
+
+# Longest edge, in pixels, of each rendition
+RENDITION_SIZES = {
+    'card': 320,
+    'detail': 800,
+    'full': 1600,
+}
+
+# Encoders tried for every rendition; AVIF is only written when the
+# installed Pillow has an AVIF plugin.
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', 'avif', {'quality': 60}),
+}
+
+UPLOAD_URL = '/static/uploads/'
+
+# Pillow formats accepted as another one: many phone cameras write MPO
+# (a JPEG with extra frames appended), whose first frame is a plain JPEG
+UPLOAD_FORMAT_ALIASES = {'MPO': 'JPEG'}
+
+# Larger images are refused unread; 50 MP covers every phone camera, and a
+# fully decoded RGBA image of that size is still only 200 MB
+DEFAULT_MAX_PIXELS = 50_000_000
+
+# EXIF Orientation value -> Image.Transpose member applied to put it upright
+ORIENTATION_TRANSPOSES = {
+    2: 'FLIP_LEFT_RIGHT',
+    3: 'ROTATE_180',
+    4: 'FLIP_TOP_BOTTOM',
+    5: 'TRANSPOSE',
+    6: 'ROTATE_270',
+    7: 'TRANSVERSE',
+    8: 'ROTATE_90',
+}
+EXIF_ORIENTATION = 0x0112
+
+_executor = None
+
+
+def available_formats():
+    """Rendition formats the installed Pillow can encode."""
+    from PIL import Image
+    Image.init()
+    return [name for name, (pil_format, _, _) in RENDITION_FORMATS.items()
+            if pil_format in Image.SAVE]
+
+
+def open_upload(stream, allowed_formats, max_pixels=DEFAULT_MAX_PIXELS):
+    """Check that an upload is an image without decoding its pixels.
+
+    ``Image.open`` only parses the header, so this is cheap even for large
+    files. Returns the Pillow format name, or None if the upload is not an
+    image of an allowed format or has more than ``max_pixels`` pixels. The
+    stream is rewound afterwards. MPO files are reported as JPEG.
+    """
+    from PIL import Image
+    try:
+        with Image.open(stream) as image:
+            image_format = UPLOAD_FORMAT_ALIASES.get(image.format, image.format)
+            width, height = image.size
+    except Exception:
+        return None  # includes Pillow's own DecompressionBombError
+    finally:
+        stream.seek(0)
+    if not image_format or image_format.lower() not in allowed_formats:
+        return None
+    if width * height > max_pixels:
+        print(f"Rejected {width}x{height} image: more than {max_pixels:,} pixels")
+        return None
+    return image_format
+
+
+def decode_photo(image, size):
+    """Decode an opened image to fit ``size`` x ``size``, upright and in RGB.
+
+    JPEGs are decoded straight at the smallest 1/2, 1/4 or 1/8 scale that
+    still covers ``size``; other formats are decoded once at full size and
+    reduced by whole factors before the final resample. Orientation is
+    applied last, to the small image.
+    """
+    from PIL import Image
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    image.draft('RGB', (size, size))
+    if image.mode in ('1', 'P'):
+        image = image.convert('RGB')  # palette images cannot be resampled smoothly
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if orientation in ORIENTATION_TRANSPOSES:
+        image = image.transpose(Image.Transpose[ORIENTATION_TRANSPOSES[orientation]])
+    return image
+
+
+DIGEST_PATTERN = re.compile(r'\.([0-9a-f]{16})\.[A-Za-z0-9]+$')
+
+
+def upload_basename(person_id):
+    """Stem shared by a photo's original and all of its renditions."""
+    return f"missing_person_{person_id}"
+
+
+def content_digest(data):
+    """Short digest of file contents used in content-addressed names."""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def filename_digest(filename):
+    """Digest embedded in a content-addressed filename, or None for legacy names."""
+    match = DIGEST_PATTERN.search(filename)
+    return match.group(1) if match else None
+
+
+def save_upload(stream, originals_dir, basename, extension, chunk_size=64 * 1024):
+    """Copy an upload to disk under a content-addressed name and return the name."""
+    digest = hashlib.blake2b(digest_size=8)
+    temp_path = os.path.join(originals_dir, f".{basename}.{os.getpid()}.tmp")
+    with open(temp_path, 'wb') as out:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    filename = f"{basename}_orig.{digest.hexdigest()}.{extension}"
+    os.replace(temp_path, os.path.join(originals_dir, filename))
+    return filename
+
+
+def is_original(filename):
+    """Whether ``filename`` names an upload as received (see ``save_upload``)."""
+    return '_orig.' in filename
+
+
+def photo_path(config, filename):
+    """Path of a stored photo: originals in ``ORIGINALS_FOLDER``, the rest in ``UPLOAD_FOLDER``."""
+    folder = config['ORIGINALS_FOLDER'] if is_original(filename) else config['UPLOAD_FOLDER']
+    return os.path.join(folder, filename)
+
+
+def source_basename(filename):
+    """Recover the stem from an original's name (content-addressed or legacy)."""
+    return filename.split('.', 1)[0].removesuffix('_orig')
+
+
+def render_photo(source_path, upload_dir, basename, max_pixels=DEFAULT_MAX_PIXELS):
+    """Decode a photo once and write every rendition in every format.
+
+    Runs in a worker process. Returns ``(renditions, photo_hash)`` where
+    renditions is a dict keyed by rendition name, e.g. ``{'card': {'width':
+    320, 'height': 240, 'jpeg': '..._card.<digest>.jpg', 'webp':
+    '..._card.<digest>.webp'}, ...}`` and photo_hash is the perceptual hash
+    of the photo.
+    """
+    from PIL import Image
+    from photo_hash import dhash
+    formats = available_formats()
+    renditions = {}
+
+    with Image.open(source_path) as original:
+        if original.width * original.height > max_pixels:
+            raise ValueError(f"{original.width}x{original.height} image has more than {max_pixels:,} pixels")
+        image = decode_photo(original, max(RENDITION_SIZES.values()))
+
+        # Largest first, so each smaller size is resampled from the previous
+        # rendition rather than from the full original
+        for name, size in sorted(RENDITION_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            rendition = {'width': image.width, 'height': image.height}
+            for format_name in formats:
+                pil_format, extension, options = RENDITION_FORMATS[format_name]
+                buffer = io.BytesIO()
+                image.save(buffer, pil_format, **options)
+                data = buffer.getvalue()
+                filename = f"{basename}_{name}.{content_digest(data)}.{extension}"
+                with open(os.path.join(upload_dir, filename), 'wb') as out:
+                    out.write(data)
+                rendition[format_name] = filename
+            renditions[name] = rendition
+
+        # The card rendition is more than enough detail for the 9x8 hash
+        photo_hash = dhash(image)
+
+    return renditions, photo_hash
+
+
+def import_photo(source_path, upload_dir, originals_dir, person_id, allowed_formats,
+                 max_pixels=DEFAULT_MAX_PIXELS):
+    """Store and render a photo file from disk for a bulk import.
+
+    Runs in a worker process and does what the report form does for an
+    upload: header check, content-addressed copy, then every rendition.
+    Returns ``(filename, renditions, photo_hash)``, or None if the file is
+    not an image of an allowed format.
+    """
+    basename = upload_basename(person_id)
+    with open(source_path, 'rb') as stream:
+        if not open_upload(stream, allowed_formats, max_pixels):
+            return None
+        extension = source_path.rsplit('.', 1)[-1].lower()
+        filename = save_upload(stream, originals_dir, basename, extension)
+    renditions, photo_hash = render_photo(os.path.join(originals_dir, filename), upload_dir, basename, max_pixels)
+    return filename, renditions, photo_hash
+
+
+def rendition_url(renditions, name='card', format_name='jpeg'):
+    """URL of one rendition, or None if it has not been produced."""
+    filename = (renditions or {}).get(name, {}).get(format_name)
+    return UPLOAD_URL + filename if filename else None
+
+
+def srcset(renditions, format_name='jpeg'):
+    """``srcset`` attribute value listing every rendition in one format."""
+    entries = sorted(
+        (rendition['width'], rendition[format_name])
+        for rendition in (renditions or {}).values()
+        if format_name in rendition
+    )
+    return ', '.join(f"{UPLOAD_URL}{filename} {width}w" for width, filename in entries)
+
+
+def rendition_urls(renditions):
+    """Renditions as ``{name: {format: url}}`` for the JSON API."""
+    return {
+        name: {key: UPLOAD_URL + value for key, value in rendition.items()
+               if key in RENDITION_FORMATS}
+        for name, rendition in (renditions or {}).items()
+    }
+
+
+def get_executor(workers):
+    """Process pool shared by all requests in this worker (created lazily)."""
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def submit_job(workers, fn, *args):
+    """Submit ``fn(*args)`` to the process pool, replacing the pool if it is broken.
+
+    A child that dies (OOM-killed on a huge photo, say) breaks the whole
+    pool, and every later ``submit`` would fail until the process restarts.
+    Jobs that were in flight on the dead pool fail with ``BrokenProcessPool``.
+    """
+    global _executor
+    from concurrent.futures.process import BrokenProcessPool
+    try:
+        return get_executor(workers).submit(fn, *args)
+    except BrokenProcessPool:
+        print("⚠️  Image worker pool broken; starting a new one")
+        _executor.shutdown(wait=False)
+        _executor = None
+        return get_executor(workers).submit(fn, *args)
+
+
+def schedule_renditions(app, person_id, source_filename):
+    """Render a saved upload in the background and record the result.
+
+    With ``IMAGE_WORKERS`` set to 0 the work is done inline, which is what
+    tests and single-process deployments want.
+    """
+    upload_dir = app.config['UPLOAD_FOLDER']
+    source_path = photo_path(app.config, source_filename)
+    basename = source_basename(source_filename)
+    workers = app.config.get('IMAGE_WORKERS', 0)
+    max_pixels = app.config.get('MAX_UPLOAD_PIXELS', DEFAULT_MAX_PIXELS)
+    started = time.perf_counter()
+
+    if not workers:
+        try:
+            renditions, photo_hash = render_photo(source_path, upload_dir, basename, max_pixels)
+        except Exception as e:
+            print(f"Error processing image {source_filename}: {e}")
+            renditions, photo_hash = None, None
+        IMAGE_SECONDS.observe(time.perf_counter() - started, 'render')
+        record_renditions(app, person_id, renditions, photo_hash)
+        return
+
+    future = submit_job(workers, render_photo, source_path, upload_dir, basename, max_pixels)
+
+    def done(future):
+        try:
+            renditions, photo_hash = future.result()
+        except Exception as e:
+            print(f"Error processing image {source_filename}: {e}")
+            renditions, photo_hash = None, None
+        # Includes time queued behind other photos
+        IMAGE_SECONDS.observe(time.perf_counter() - started, 'render')
+        record_renditions(app, person_id, renditions, photo_hash)
+
+    future.add_done_callback(done)
+
+
+def record_renditions(app, person_id, renditions, photo_hash=None):
+    """Store finished renditions and the photo hash on the case.
+
+    Drops the photo if processing failed.
+    """
+    from photo_hash import photo_index, to_signed
+    with app.app_context():
+        person = db.session.get(MissingPerson, person_id)
+        if person is None:
+            return
+        if renditions:
+            person.photo_renditions = renditions
+            person.photo_filename = renditions['detail']['jpeg']
+            person.photo_hash = to_signed(photo_hash)
+        else:
+            person.photo_filename = None
+        db.session.commit()
+
+    if renditions and photo_hash is not None:
+        photo_index.add(person_id, photo_hash)
@@ -0,0 +1,222 @@
+"""
+Per-request performance instrumentation.
+
+For every request this records the route latency, how many SQL statements
+ran and how long they took (SQLAlchemy cursor events), time spent rendering
+templates (Flask's template signals) and time spent on uploaded images
+(``timed('image')`` around that code). The numbers are sent back in a
+``Server-Timing`` header, which browser dev tools show per request, and fed
+into Prometheus histograms served as text on ``/metrics``, which is off
+unless ``METRICS_TOKEN`` is set and then answers only requests bearing
+that token, or logged-in admins.
+
+Each worker process keeps its own histograms; Prometheus scrapes every
+worker and sums them. Recording is a handful of ``perf_counter`` calls and
+dict updates per request and per statement; SQL text is only kept when the
+slow-request log is on (``SLOW_REQUEST_MS``), in which case requests slower
+than the threshold are printed together with their slowest statements.
+
+Streamed responses (``stream_with_context``) are timed up to the point the
+response starts; queries made while the body streams are not counted.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Slowest statements shown for a slow request
+SLOW_STATEMENTS_SHOWN = 5
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets and a few labels."""
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-1]}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('loket_request_duration_seconds', 'Time to produce a response.',
+                            LATENCY_BUCKETS, ('route', 'method', 'status'))
+REQUEST_DB_SECONDS = Histogram('loket_request_db_seconds', 'Time spent in SQL statements per request.',
+                               LATENCY_BUCKETS, ('route',))
+REQUEST_QUERIES = Histogram('loket_request_queries', 'SQL statements executed per request.',
+                            QUERY_COUNT_BUCKETS, ('route',))
+REQUEST_TEMPLATE_SECONDS = Histogram('loket_request_template_seconds', 'Time spent rendering templates per request.',
+                                     LATENCY_BUCKETS, ('route',))
+IMAGE_SECONDS = Histogram('loket_image_processing_seconds',
+                          'Image work: "upload" in the request, "render" in the background workers.',
+                          LATENCY_BUCKETS, ('stage',))
+
+METRICS = [REQUEST_SECONDS, REQUEST_DB_SECONDS, REQUEST_QUERIES, REQUEST_TEMPLATE_SECONDS, IMAGE_SECONDS]
+
+
+class RequestTimings:
+    """Counters for the request being handled, kept on ``flask.g``."""
+    __slots__ = ('started', 'db', 'queries', 'template', 'image', 'statements', '_template_started')
+
+    def __init__(self, keep_statements):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+        self.image = 0.0
+        self.statements = [] if keep_statements else None
+        self._template_started = []
+
+
+def current_timings():
+    return g.get('_timings') if has_request_context() else None
+
+
+@contextmanager
+def timed(kind):
+    """Add the time spent in the block to the request's ``kind`` total.
+
+    Only ``'image'`` is reported separately at the moment.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = current_timings()
+        if timings is not None:
+            setattr(timings, kind, getattr(timings, kind) + elapsed)
+        if kind == 'image':
+            IMAGE_SECONDS.observe(elapsed, 'upload')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['_query_started'].pop()
+    timings = current_timings()
+    if timings is None:
+        return
+    elapsed = time.perf_counter() - started
+    timings.db += elapsed
+    timings.queries += 1
+    if timings.statements is not None:
+        timings.statements.append((elapsed, statement))
+
+
+def _handle_error(exception_context):
+    # The statement failed, so after_cursor_execute will not pop its start time
+    started = exception_context.connection.info.get('_query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def _before_render_template(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None:
+        timings._template_started.append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None and timings._template_started:
+        timings.template += time.perf_counter() - timings._template_started.pop()
+
+
+def server_timing(timings, total):
+    parts = [
+        f'app;dur={total * 1000:.1f}',
+        f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+        f'tpl;dur={timings.template * 1000:.1f}',
+    ]
+    if timings.image:
+        parts.append(f'img;dur={timings.image * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def log_slow_request(timings, total, response):
+    print(f"🐢 Slow request {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+          f"in {total * 1000:.0f} ms (db {timings.db * 1000:.0f} ms in {timings.queries} queries, "
+          f"templates {timings.template * 1000:.0f} ms, images {timings.image * 1000:.0f} ms)")
+    for elapsed, statement in sorted(timings.statements, key=lambda item: -item[0])[:SLOW_STATEMENTS_SHOWN]:
+        print(f"   {elapsed * 1000:8.1f} ms  {' '.join(statement.split())[:300]}")
+
+
+def metrics_response():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    """Time every request of ``app``."""
+    if not app.config.get('INSTRUMENTATION', True):
+        return
+    slow_ms = app.config.get('SLOW_REQUEST_MS') or 0
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.before_request
+    def start_timing():
+        g._timings = RequestTimings(keep_statements=bool(slow_ms))
+
+    @app.after_request
+    def record_timing(response):
+        timings = g.pop('_timings', None)
+        if timings is None:
+            return response
+        total = time.perf_counter() - timings.started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        response.headers['Server-Timing'] = server_timing(timings, total)
+        REQUEST_SECONDS.observe(total, route, request.method, str(response.status_code))
+        REQUEST_DB_SECONDS.observe(timings.db, route)
+        REQUEST_QUERIES.observe(timings.queries, route)
+        REQUEST_TEMPLATE_SECONDS.observe(timings.template, route)
+        if slow_ms and total * 1000 >= slow_ms:
+            log_slow_request(timings, total, response)
+        return response
@@ -0,0 +1,283 @@
+"""
+Outbox and pooled SMTP delivery.
+
+Requests never talk to the mail relay. They render the message once and
+insert it into the ``outbox_email`` table, which takes milliseconds. A
+delivery worker (a background thread in each web worker, or the
+``flask mail-worker`` command) claims due messages in batches, sends them
+over one authenticated SMTP connection kept alive between batches, and
+records the outcome. Failed sends are retried with exponential backoff.
+
+Serverless functions are frozen once the response is sent, so a thread
+would not get to deliver anything. There (``MAIL_WORKER=inline``) the
+request queues the message already claimed and sends it itself with
+``deliver_now``; if that fails, the message is retried by the next
+``flask mail-worker`` run once its claim lapses.
+
+For local testing point the ``SMTP_*`` environment variables at a stand-in
+server, e.g. ``python -m aiosmtpd -n -l localhost:8025`` with
+``SMTP_SERVER=localhost SMTP_PORT=8025 SMTP_USE_TLS=0 SENDER_PASSWORD=``.
+
+``smtplib`` and ``email.mime`` are imported on first delivery: most
+processes (and every serverless cold start) only ever queue mail.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import render_template
+
+from models import db, OutboxEmail
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 30
+# A claimed message whose worker died becomes deliverable again after this
+CLAIM_LEASE = timedelta(minutes=10)
+# Probe the connection with NOOP before reuse once it has been idle this long
+IDLE_CHECK_SECONDS = 30
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def render_email(template, **context):
+    """Render the text and HTML bodies of ``templates/email/<template>``.
+
+    Jinja compiles each template once per process and caches it.
+    """
+    text = render_template(f'email/{template}.txt', **context)
+    html = render_template(f'email/{template}.html', **context)
+    return text, html
+
+
+def duration_text(seconds):
+    """``3600`` -> ``'1 hour'``, ``5400`` -> ``'90 minutes'``: the largest unit that divides evenly."""
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return f"{seconds} second{'s' if seconds != 1 else ''}"
+
+
+def enqueue_email(recipient, subject, text_body, html_body=None, commit=True, claimed=False):
+    """Queue a message for the delivery worker and wake it up.
+
+    A ``claimed`` message is left to the caller to send (``deliver_now``);
+    workers only pick it up if it is still unsent after ``CLAIM_LEASE``.
+    """
+    now = datetime.utcnow()
+    email = OutboxEmail(recipient=recipient, subject=subject,
+                        text_body=text_body, html_body=html_body,
+                        status='sending' if claimed else 'queued',
+                        next_attempt_at=now + CLAIM_LEASE if claimed else now)
+    db.session.add(email)
+    if commit:
+        db.session.commit()
+    if _worker is not None:
+        _worker.wake()
+    return email
+
+
+def build_message(email, config):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    message = MIMEMultipart('alternative')
+    message['From'] = f"{config['SENDER_NAME']} <{config['SENDER_EMAIL']}>"
+    message['To'] = email.recipient
+    message['Subject'] = email.subject
+    message.attach(MIMEText(email.text_body, 'plain'))
+    if email.html_body:
+        message.attach(MIMEText(email.html_body, 'html'))
+    return message
+
+
+def send_now(connection, config, recipient, subject, text_body, html_body=None):
+    """Send one message straight over ``connection``, bypassing the outbox.
+
+    Returns False if the relay refused it.
+    """
+    import smtplib
+    email = OutboxEmail(recipient=recipient, subject=subject, text_body=text_body, html_body=html_body)
+    try:
+        connection.send(build_message(email, config))
+    except smtplib.SMTPException as e:
+        print(f"❌ Error sending email to {recipient}: {e}")
+        return False
+    return True
+
+
+class SMTPConnection:
+    """One authenticated SMTP session, reopened only when it stops working."""
+
+    def __init__(self, config):
+        self.config = config
+        self._smtp = None
+        self._last_used = 0.0
+
+    def connect(self):
+        import smtplib
+        config = self.config
+        smtp = smtplib.SMTP(config['SMTP_SERVER'], config['SMTP_PORT'],
+                            timeout=config.get('SMTP_TIMEOUT', 30))
+        if config.get('SMTP_USE_TLS', True):
+            smtp.starttls()
+        if config.get('SENDER_PASSWORD'):
+            smtp.login(config['SENDER_EMAIL'], config['SENDER_PASSWORD'])
+        self._smtp = smtp
+
+    def _alive(self):
+        import smtplib
+        if self._smtp is None:
+            return False
+        if time.monotonic() - self._last_used < IDLE_CHECK_SECONDS:
+            return True
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, message):
+        import smtplib
+        if not self._alive():
+            self.close()
+            self.connect()
+        try:
+            self._smtp.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The relay dropped an idle connection; reconnect once
+            self.close()
+            self.connect()
+            self._smtp.send_message(message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        import smtplib
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """Atomically claim up to ``limit`` due messages for this worker."""
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    due = db.session.query(OutboxEmail.id) \
+        .filter(OutboxEmail.status.in_(['queued', 'sending']),
+                OutboxEmail.next_attempt_at <= now) \
+        .order_by(OutboxEmail.next_attempt_at) \
+        .limit(limit) \
+        .scalar_subquery()
+    db.session.query(OutboxEmail) \
+        .filter(OutboxEmail.id.in_(due),
+                OutboxEmail.status.in_(['queued', 'sending']),
+                OutboxEmail.next_attempt_at <= now) \
+        .update({'status': 'sending', 'claim_token': token,
+                 'next_attempt_at': now + CLAIM_LEASE}, synchronize_session=False)
+    db.session.commit()
+    return OutboxEmail.query.filter_by(claim_token=token, status='sending') \
+        .order_by(OutboxEmail.id).all()
+
+
+def deliver(connection, email, config):
+    """Send one claimed message and record the outcome. Returns True if sent."""
+    try:
+        connection.send(build_message(email, config))
+    except Exception as e:
+        connection.close()
+        email.attempts = (email.attempts or 0) + 1
+        email.last_error = str(e)
+        if email.attempts >= MAX_ATTEMPTS:
+            email.status = 'failed'
+            print(f"❌ Giving up on email to {email.recipient}: {e}")
+        else:
+            email.status = 'queued'
+            delay = RETRY_BASE_SECONDS * 2 ** (email.attempts - 1)
+            email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            print(f"⚠️  Email to {email.recipient} failed, retrying in {delay}s: {e}")
+        db.session.commit()
+        return False
+    email.status = 'sent'
+    email.sent_at = datetime.utcnow()
+    email.attempts = (email.attempts or 0) + 1
+    email.last_error = None
+    db.session.commit()
+    return True
+
+
+def deliver_batch(connection, config, limit=BATCH_SIZE):
+    """Send one batch of due messages. Returns (sent, failed) counts."""
+    sent = failed = 0
+    for email in claim_batch(limit):
+        if deliver(connection, email, config):
+            sent += 1
+        else:
+            failed += 1
+    return sent, failed
+
+
+def deliver_now(email, config):
+    """Send a message queued with ``claimed=True`` from this request."""
+    connection = SMTPConnection(config)
+    try:
+        return deliver(connection, email, config)
+    finally:
+        connection.close()
+
+
+def drain(app, config, connection=None):
+    """Deliver everything that is currently due, then return."""
+    own_connection = connection is None
+    connection = connection or SMTPConnection(config)
+    totals = [0, 0]
+    try:
+        with app.app_context():
+            while True:
+                sent, failed = deliver_batch(connection, config)
+                totals[0] += sent
+                totals[1] += failed
+                if sent + failed < BATCH_SIZE:
+                    break
+    finally:
+        if own_connection:
+            connection.close()
+    return tuple(totals)
+
+
+class MailWorker(threading.Thread):
+    """Background thread that delivers queued mail for this process."""
+
+    def __init__(self, app, config, poll_interval=15):
+        super().__init__(name='mail-worker', daemon=True)
+        self.app = app
+        self.config = config
+        self.poll_interval = poll_interval
+        self.connection = SMTPConnection(config)
+        self._wake = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        while True:
+            try:
+                drain(self.app, self.config, self.connection)
+            except Exception as e:
+                print(f"❌ Mail worker error: {e}")
+                self.connection.close()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+def start_mail_worker(app, config, poll_interval=15):
+    """Start this process's delivery thread once; safe to call repeatedly."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = MailWorker(app, config, poll_interval)
+            _worker.start()
+    return _worker
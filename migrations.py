@@ -0,0 +1,129 @@
+"""
+Non-destructive schema migrations.
+
+``db.create_all()`` only creates missing tables; it never adds a column or
+an index to a table that already exists. Migrations fill that gap for live
+databases without deleting ``instance/loket.db``. Each migration runs once,
+in order, and is recorded in the ``schema_migrations`` table. Every step is
+written to be idempotent, so a database freshly built by ``create_all``
+(which already has the new columns and indexes) simply gets them marked as
+applied.
+
+To change the schema: update models.py, then append a migration here.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db
+
+MIGRATIONS = []
+
+
+def migration(name):
+    """Register a migration; names sort in the order they must run."""
+    def register(func):
+        MIGRATIONS.append((name, func))
+        return func
+    return register
+
+
+def add_column(conn, table, column, column_type):
+    """``ALTER TABLE ... ADD COLUMN`` unless the column already exists."""
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+        print(f"  added column {table}.{column}")
+
+
+def create_indexes(conn, *names):
+    """Create the indexes declared in models.py with these names, if missing."""
+    wanted = set(names)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in wanted:
+                index.create(conn, checkfirst=True)
+                wanted.discard(index.name)
+                print(f"  ensured index {index.name}")
+    if wanted:
+        raise ValueError(f"Indexes not declared in models.py: {', '.join(sorted(wanted))}")
+
+
+@migration('0001_missing_person_photo_renditions')
+def add_photo_renditions(conn):
+    add_column(conn, 'missing_person', 'photo_renditions', 'JSON')
+
+
+@migration('0002_photo_hashes')
+def add_photo_hashes(conn):
+    add_column(conn, 'missing_person', 'photo_hash', 'BIGINT')
+    add_column(conn, 'found_person', 'photo_hash', 'BIGINT')
+
+
+@migration('0003_query_indexes')
+def add_query_indexes(conn):
+    create_indexes(
+        conn,
+        'ix_missing_person_active_recent',
+        'ix_missing_person_active_region_recent',
+        'ix_missing_person_region',
+        'ix_missing_person_reporter_recent',
+        'ix_found_person_date_added',
+        'ix_sighting_report_case_status_recent',
+        'ix_sighting_report_status_recent',
+        'ix_password_reset_token_user_id',
+        'ix_outbox_email_due',
+    )
+
+
+@migration('0004_coordinates')
+def add_coordinates(conn):
+    add_column(conn, 'missing_person', 'last_seen_lat', 'FLOAT')
+    add_column(conn, 'missing_person', 'last_seen_lon', 'FLOAT')
+    add_column(conn, 'sighting_report', 'latitude', 'FLOAT')
+    add_column(conn, 'sighting_report', 'longitude', 'FLOAT')
+
+
+@migration('0005_sighting_intake')
+def add_sighting_intake(conn):
+    add_column(conn, 'sighting_report', 'duplicates', 'INTEGER DEFAULT 0')
+    create_indexes(conn, 'ix_sighting_report_dedup')
+
+
+@migration('0006_case_updated_at')
+def add_case_updated_at(conn):
+    add_column(conn, 'missing_person', 'updated_at', 'DATETIME')
+    conn.execute(text('UPDATE missing_person SET updated_at = date_reported WHERE updated_at IS NULL'))
+    create_indexes(conn, 'ix_missing_person_updated')
+
+
+def applied_migrations(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'name VARCHAR(100) PRIMARY KEY, applied_at DATETIME NOT NULL)'
+    ))
+    return {row[0] for row in conn.execute(text('SELECT name FROM schema_migrations'))}
+
+
+def pending_migrations():
+    with db.engine.begin() as conn:
+        applied = applied_migrations(conn)
+    return [name for name, _ in sorted(MIGRATIONS) if name not in applied]
+
+
+def run_migrations():
+    """Apply every pending migration, each in its own transaction."""
+    with db.engine.begin() as conn:
+        applied = applied_migrations(conn)
+
+    ran = []
+    for name, func in sorted(MIGRATIONS):
+        if name in applied:
+            continue
+        print(f"Applying migration {name}")
+        with db.engine.begin() as conn:
+            func(conn)
+            conn.execute(text('INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :at)'),
+                         {'name': name, 'at': datetime.utcnow()})
+        ran.append(name)
+    return ran
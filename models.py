@@ -1,11 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
 import secrets
 
-db = SQLAlchemy()
+from database import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -32,6 +35,8 @@ class MissingPerson(db.Model):
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.String(20), nullable=False)
     last_seen = db.Column(db.String(200), nullable=False)
+    last_seen_lat = db.Column(db.Float, nullable=True)  # from the gazetteer, see geo.py
+    last_seen_lon = db.Column(db.Float, nullable=True)
     last_seen_date = db.Column(db.Date, nullable=False)
     region = db.Column(db.String(50), nullable=False)
     description = db.Column(db.Text, nullable=False)
@@ -39,17 +44,44 @@ class MissingPerson(db.Model):
     contact_phone = db.Column(db.String(20), nullable=False)
     contact_email = db.Column(db.String(100), nullable=False)
     photo_filename = db.Column(db.String(200), nullable=True)
+    photo_renditions = db.Column(db.JSON(none_as_null=True), nullable=True)  # {size: {width, height, jpeg, webp}}
+    photo_hash = db.Column(db.BigInteger, nullable=True)  # 64-bit dHash, stored signed
     date_reported = db.Column(db.DateTime, default=datetime.utcnow)
+    # Last write to the row; also set by a trigger for bulk updates (see export.py)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_found = db.Column(db.Boolean, default=False)
     
     # Foreign key
     reported_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
-    @property
+    __table_args__ = (
+        # Active-case listings: index, browse and api_search, newest first
+        db.Index('ix_missing_person_active_recent', 'is_found', 'date_reported', 'id'),
+        db.Index('ix_missing_person_active_region_recent', 'is_found', 'region', 'date_reported', 'id'),
+        # Region filter dropdown (SELECT DISTINCT region)
+        db.Index('ix_missing_person_region', 'region'),
+        # Profile page: a user's own reports
+        db.Index('ix_missing_person_reporter_recent', 'reported_by', 'date_reported'),
+        # Export deltas: cases changed since a timestamp
+        db.Index('ix_missing_person_updated', 'updated_at', 'id'),
+    )
+    
+    @hybrid_property
     def photo_url(self):
-        if self.photo_filename:
+        # An original ("..._orig.<digest>.<ext>") is private and only named
+        # here until its renditions are ready (see images.py)
+        if self.photo_filename and '_orig.' not in self.photo_filename:
             return f'/static/uploads/{self.photo_filename}'
         return '/static/images/default-avatar.png'
+    
+    @photo_url.expression
+    def photo_url(cls):
+        # Same URL computed in SQL, so listings can select it as a plain column
+        return db.case(
+            (cls.photo_filename.contains('_orig.', autoescape=True), '/static/images/default-avatar.png'),
+            (cls.photo_filename.isnot(None), '/static/uploads/' + cls.photo_filename),
+            else_='/static/images/default-avatar.png'
+        )
 
 class FoundPerson(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,12 +90,19 @@ class FoundPerson(db.Model):
     found_date = db.Column(db.Date, nullable=False)
     reunited_with = db.Column(db.String(100), nullable=False)
     photo_url = db.Column(db.String(200), default='/static/images/default-avatar.png')
+    photo_hash = db.Column(db.BigInteger, nullable=True)  # 64-bit dHash, stored signed
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_found_person_date_added', 'date_added'),
+    )
 
 class SightingReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     missing_person_id = db.Column(db.Integer, db.ForeignKey('missing_person.id'), nullable=False)
     location = db.Column(db.String(200), nullable=False)
+    latitude = db.Column(db.Float, nullable=True)  # from the gazetteer, see geo.py
+    longitude = db.Column(db.Float, nullable=True)
     sighting_date = db.Column(db.DateTime, nullable=False)
     details = db.Column(db.Text)
     reporter_name = db.Column(db.String(100), nullable=False)
@@ -71,9 +110,18 @@ class SightingReport(db.Model):
     date_reported = db.Column(db.DateTime, default=datetime.utcnow)
     reported_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     status = db.Column(db.String(20), default='pending')  # pending, reviewed, contacted, invalid
+    duplicates = db.Column(db.Integer, default=0)  # near-identical tips collapsed into this one
     
     # Relationships - FIXED: removed duplicate backref
     missing_person = db.relationship('MissingPerson', backref='sightings', lazy=True)
+    
+    __table_args__ = (
+        # A case's sightings by workflow status, newest first (review queue)
+        db.Index('ix_sighting_report_case_status_recent', 'missing_person_id', 'status', 'date_reported'),
+        db.Index('ix_sighting_report_status_recent', 'status', 'date_reported'),
+        # Near-duplicate check on submission: same case, same contact, nearby time
+        db.Index('ix_sighting_report_dedup', 'missing_person_id', 'reporter_contact', 'sighting_date'),
+    )
 
 class PasswordResetToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -83,11 +131,15 @@ class PasswordResetToken(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)
     used = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        db.Index('ix_password_reset_token_user_id', 'user_id'),
+    )
+    
     def is_valid(self):
         return (not self.used) and (datetime.utcnow() < self.expires_at)
     
     @staticmethod
-    def generate_token(user_id):
+    def generate_token(user_id, max_age=3600):
         # Delete any existing tokens for this user
         PasswordResetToken.query.filter_by(user_id=user_id).delete()
         
@@ -95,8 +147,75 @@ class PasswordResetToken(db.Model):
         token = PasswordResetToken(
             user_id=user_id,
             token=secrets.token_urlsafe(32),
-            expires_at=datetime.utcnow() + timedelta(hours=1)
+            expires_at=datetime.utcnow() + timedelta(seconds=max_age)
         )
         db.session.add(token)
         db.session.commit()
-        return token
\ No newline at end of file
+        return token
+
+class OutboxEmail(db.Model):
+    """Email waiting for (or done with) delivery by the mail worker"""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    text_body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # Delivery worker: due messages in order
+        db.Index('ix_outbox_email_due', 'status', 'next_attempt_at'),
+    )
+
+class ImportJob(db.Model):
+    """Progress of a bulk import, so an interrupted run can resume"""
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(500), nullable=False)
+    fingerprint = db.Column(db.String(100), nullable=False)  # size and mtime of the source file
+    rows_done = db.Column(db.Integer, default=0)  # input rows committed, valid or not
+    inserted = db.Column(db.Integer, default=0)
+    rejected = db.Column(db.Integer, default=0)
+    photos_done = db.Column(db.Integer, default=0)
+    pending_photos = db.Column(db.JSON, default=list)  # [[person_id, path], ...] not yet recorded
+    status = db.Column(db.String(20), default='running')  # running, done
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class ChangeEvent(db.Model):
+    """A change pushed to /api/stream; written by triggers, see events.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # case, found, reopened, sighting
+    case_id = db.Column(db.Integer, nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)  # the case or sighting id
+    region = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_change_event_created_at', 'created_at'),
+    )
+
+class CaseStat(db.Model):
+    """Cases per status, region, gender and age band; kept by triggers, see facets.py"""
+    is_found = db.Column(db.Boolean, primary_key=True)
+    region = db.Column(db.String(50), primary_key=True)
+    gender = db.Column(db.String(20), primary_key=True)
+    age_band = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class CaseDailyStat(db.Model):
+    """Cases per report day, status and region; kept by triggers, see facets.py"""
+    day = db.Column(db.String(10), primary_key=True)  # YYYY-MM-DD, UTC
+    is_found = db.Column(db.Boolean, primary_key=True)
+    region = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class DataVersion(db.Model):
+    """Counters bumped by triggers on every write to cached tables, see page_cache.py"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,308 @@
+"""
+Fuzzy name matching between missing and found persons.
+
+Every name is reduced to two keys per token (case, accents and punctuation
+dropped): the set of its character trigrams, hashed into a 256-bit
+signature, and its Soundex code. Trigrams catch typos and transliteration
+variants ("Wanjiru"/"Wanjirou"), Soundex catches names spelled the way
+they sound ("Otieno"/"Otiyeno"), and since both are per token, word order
+and a missing middle name do not matter.
+
+A candidate's score combines:
+
+* name -- Jaccard similarity of the trigram signatures;
+* phonetic -- share of the shorter name's tokens whose Soundex codes match;
+* age -- how close the found person's age is to the missing person's age
+  plus the time that passed since they were last seen;
+* date -- how soon after going missing the person was found (someone found
+  well before they went missing is never a match).
+
+Each worker keeps one ``NameIndex`` per table holding the keys in NumPy
+arrays, so a query scores every open case in a handful of vectorized
+passes, a few milliseconds at 100k cases, instead of comparing names pair
+by pair in Python. NumPy is imported on the first search, not at startup.
+Rows added since the last look are appended incrementally (``id > max
+id``, at most once per ``ttl`` and right after this worker commits one),
+and the arrays are rebuilt from scratch every ``FULL_RELOAD_SECONDS`` or
+when this worker edits a name, age or date. Cases marked found drop out of
+the results straight away (they are checked against the database) and out
+of the arrays on the next rebuild.
+"""
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlalchemy import inspect
+
+from database import after_commit
+from models import db, FoundPerson, MissingPerson
+
+SIGNATURE_BITS = 256
+# Tokens per name that take part in phonetic matching
+MAX_TOKENS = 4
+
+WEIGHTS = {'name': 0.5, 'phonetic': 0.2, 'age': 0.15, 'date': 0.15}
+# Expected and actual age this many years apart score 0 for age
+AGE_WINDOW = 10
+# Found this many days after going missing halves the date score
+DATE_HALF_LIFE = 365
+# Found up to this many days *before* last seen still counts (mistyped dates)
+DATE_SLACK = 7
+# Below both of these the names have nothing in common, whatever the rest says
+MIN_NAME_SIMILARITY = 0.2
+MIN_PHONETIC = 0.5
+
+DEFAULT_MIN_SCORE = 0.5
+FULL_RELOAD_SECONDS = 3600
+
+_SOUNDEX = {letter: digit for letters, digit in
+            (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6'))
+            for letter in letters}
+
+
+def name_tokens(name):
+    """Lower-case ASCII words of a name: 'Mary-Anne  Wanjirũ' -> ['mary', 'anne', 'wanjiru']."""
+    folded = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii')
+    return re.findall('[a-z]+', folded.lower())
+
+
+def soundex(token):
+    """Soundex code of a lower-case ASCII word, e.g. 'robert' -> 'r163'."""
+    digits, previous = [], _SOUNDEX.get(token[0])
+    for letter in token[1:]:
+        digit = _SOUNDEX.get(letter)
+        if digit and digit != previous:
+            digits.append(digit)
+        if letter not in 'hw':  # h and w do not separate equal codes
+            previous = digit
+    return (token[0] + ''.join(digits) + '000')[:4]
+
+
+@lru_cache(maxsize=100_000)
+def token_keys(token):
+    """(trigram bit positions, Soundex code as an int) for one word; names repeat, so cached."""
+    padded = f'  {token} '
+    bits = frozenset(zlib.crc32(padded[i:i + 3].encode()) % SIGNATURE_BITS for i in range(len(padded) - 2))
+    code = soundex(token)
+    return bits, (ord(code[0]) - 96) * 1000 + int(code[1:])
+
+
+def name_keys(name):
+    """A name's trigram signature (set bit positions) and up to ``MAX_TOKENS`` Soundex codes."""
+    bits, codes = set(), []
+    for token in name_tokens(name):
+        token_bits, code = token_keys(token)
+        bits |= token_bits
+        if code not in codes and len(codes) < MAX_TOKENS:
+            codes.append(code)
+    return list(bits), codes
+
+
+# ``codes`` is (MAX_TOKENS, rows), 0-padded; (pair_rows[i], pair_bits[i]) says row
+# pair_rows[i] has signature bit pair_bits[i], and ``postings`` lists those rows
+# grouped by bit (bit b: postings[offsets[b]:offsets[b + 1]])
+_Arrays = namedtuple('_Arrays', 'ids codes tokens ages days pair_rows pair_bits postings offsets row_bits')
+
+
+def _index_arrays(ids, codes, ages, days, pair_rows, pair_bits):
+    import numpy as np
+    order = np.argsort(pair_bits, kind='stable')
+    return _Arrays(ids, codes, (codes != 0).sum(axis=0), ages, days, pair_rows, pair_bits,
+                   pair_rows[order], np.searchsorted(pair_bits[order], np.arange(SIGNATURE_BITS + 1)),
+                   np.bincount(pair_rows, minlength=len(ids)))
+
+
+class NameIndex:
+    """Name keys, ages and dates of one table's rows, as NumPy arrays.
+
+    Trigram similarity goes through an inverted index (the rows having each
+    signature bit), so a query touches only rows sharing a trigram with it;
+    Soundex codes are compared column by column. Age and date are scored for
+    the rows whose name is close enough. ``found_side`` says whether the rows
+    are found persons (queried with a missing person) or open cases (queried
+    with a found person).
+    """
+
+    def __init__(self, model, date_column, where=None, found_side=False, ttl=60):
+        self.model = model
+        self.date_column = date_column
+        self.where = where
+        self.found_side = found_side
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._max_id = 0
+        self._loaded_at = None
+        self._checked_at = 0.0
+
+    def _query(self, after_id=0):
+        query = db.session.query(self.model.id, self.model.name, self.model.age, self.date_column) \
+            .filter(self.model.id > after_id)
+        if self.where is not None:
+            query = query.filter(self.where)
+        return query.order_by(self.model.id).all()
+
+    @staticmethod
+    def _to_arrays(rows, first_row=0):
+        import numpy as np
+        codes = np.zeros((MAX_TOKENS, len(rows)), dtype=np.int32)
+        pair_rows, pair_bits = [], []
+        for row_number, row in enumerate(rows):
+            bits, row_codes = name_keys(row[1])
+            codes[:len(row_codes), row_number] = row_codes
+            pair_rows.extend([first_row + row_number] * len(bits))
+            pair_bits.extend(bits)
+        return _index_arrays(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                             codes,
+                             np.fromiter((row[2] for row in rows), dtype=np.float32, count=len(rows)),
+                             np.fromiter((row[3].toordinal() for row in rows), dtype=np.int32, count=len(rows)),
+                             np.array(pair_rows, dtype=np.int32), np.array(pair_bits, dtype=np.int16))
+
+    def refresh(self):
+        """Rebuild when due, otherwise append rows added since the last look."""
+        import numpy as np
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at > FULL_RELOAD_SECONDS:
+            rows = self._query()
+            arrays = self._to_arrays(rows)
+            with self._lock:
+                self._arrays = arrays
+                self._max_id = rows[-1][0] if rows else 0
+                self._loaded_at = self._checked_at = now
+        elif now - self._checked_at > self.ttl:
+            rows = self._query(self._max_id)
+            with self._lock:
+                if rows and rows[0][0] > self._max_id:
+                    old, new = self._arrays, self._to_arrays(rows, len(self._arrays.ids))
+                    self._arrays = _index_arrays(*(np.concatenate([getattr(old, field), getattr(new, field)],
+                                                                  axis=-1)
+                                                   for field in ('ids', 'codes', 'ages', 'days',
+                                                                 'pair_rows', 'pair_bits')))
+                    self._max_id = rows[-1][0]
+                self._checked_at = now
+        return self._arrays
+
+    def expire(self):
+        """Look for new rows on next use (this worker just added some)."""
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """Rebuild on next use (a name, age or date changed)."""
+        self._loaded_at = None
+
+    def search(self, name, age, day, limit=20, min_score=DEFAULT_MIN_SCORE, exclude=None):
+        """Best matches for a person of the other side as ``[(id, score, parts), ...]``.
+
+        ``day`` is the date they were last seen (or found) as an ordinal.
+        """
+        import numpy as np
+        arrays = self.refresh()
+        rows = len(arrays.ids)
+        bits, query_codes = name_keys(name)
+        if not rows or not bits:
+            return []
+
+        shared = np.bincount(np.concatenate([arrays.postings[arrays.offsets[bit]:arrays.offsets[bit + 1]]
+                                             for bit in bits]), minlength=rows)
+        union = arrays.row_bits + len(bits) - shared
+        name_score = shared / np.maximum(union, 1)
+
+        matched = np.zeros(rows, dtype=np.int8)
+        for code in query_codes:
+            for slot in arrays.codes:
+                matched += slot == code
+        phonetic = matched / np.maximum(np.minimum(arrays.tokens, len(query_codes)), 1)
+
+        candidates = np.flatnonzero((name_score >= MIN_NAME_SIMILARITY) | (phonetic >= MIN_PHONETIC))
+        if exclude is not None:
+            candidates = candidates[arrays.ids[candidates] != exclude]
+        name_score, phonetic = name_score[candidates], phonetic[candidates]
+        if self.found_side:
+            elapsed, found_age, missing_age = arrays.days[candidates] - day, arrays.ages[candidates], age
+        else:
+            elapsed, found_age, missing_age = day - arrays.days[candidates], age, arrays.ages[candidates]
+        expected_age = missing_age + np.maximum(elapsed, 0) / 365.25
+        age_score = np.clip(1 - np.abs(found_age - expected_age) / AGE_WINDOW, 0, 1)
+        date_score = 1 / (1 + np.maximum(elapsed, 0) / DATE_HALF_LIFE)
+
+        score = (WEIGHTS['name'] * name_score + WEIGHTS['phonetic'] * phonetic
+                 + WEIGHTS['age'] * age_score + WEIGHTS['date'] * date_score)
+        keep = np.flatnonzero((elapsed >= -DATE_SLACK) & (score >= min_score))
+        if len(keep) > limit:
+            keep = keep[np.argpartition(-score[keep], limit)[:limit]]
+        ids = arrays.ids[candidates]
+        keep = keep[np.lexsort((ids[keep], -score[keep]))]
+        return [(int(ids[i]), round(float(score[i]), 3), {
+            'name': round(float(name_score[i]), 3),
+            'phonetic': round(float(phonetic[i]), 3),
+            'age': round(float(age_score[i]), 3),
+            'date': round(float(date_score[i]), 3),
+        }) for i in keep]
+
+    def __len__(self):
+        return len(self.refresh().ids)
+
+
+case_names = NameIndex(MissingPerson, MissingPerson.last_seen_date, MissingPerson.is_found == False)
+found_names = NameIndex(FoundPerson, FoundPerson.found_date, found_side=True)
+
+
+def matches_for_found(found_person, limit=20, min_score=DEFAULT_MIN_SCORE):
+    """Open cases that may be ``found_person``, best first: ``[(MissingPerson, score, parts), ...]``."""
+    # Cases found since the index was built are dropped below, so ask for a few extra
+    matches = case_names.search(found_person.name, found_person.age, found_person.found_date.toordinal(),
+                                limit + 10, min_score)
+    if not matches:
+        return []
+    people = {person.id: person for person in
+              MissingPerson.query.filter(MissingPerson.id.in_([i for i, _, _ in matches]))}
+    return [(people[i], score, parts) for i, score, parts in matches
+            if i in people and not people[i].is_found][:limit]
+
+
+def matches_for_case(person, limit=20, min_score=DEFAULT_MIN_SCORE):
+    """Found persons who may be this missing person, best first: ``[(FoundPerson, score, parts), ...]``."""
+    matches = found_names.search(person.name, person.age, person.last_seen_date.toordinal(), limit, min_score)
+    if not matches:
+        return []
+    found = {found_person.id: found_person for found_person in
+             FoundPerson.query.filter(FoundPerson.id.in_([i for i, _, _ in matches]))}
+    return [(found[i], score, parts) for i, score, parts in matches if i in found]
+
+
+_INDEXES = {MissingPerson: (case_names, ('name', 'age', 'last_seen_date')),
+            FoundPerson: (found_names, ('name', 'age', 'found_date'))}
+
+
+def _collect_name_writes(session, written):
+    written = written or {}
+    for obj in session.new:
+        if type(obj) in _INDEXES:
+            written.setdefault(type(obj), 'added')
+    for obj in list(session.dirty) + list(session.deleted):
+        if type(obj) in _INDEXES:
+            state = inspect(obj)
+            if obj in session.deleted or any(state.attrs[key].history.has_changes()
+                                             for key in _INDEXES[type(obj)][1]):
+                written[type(obj)] = 'changed'
+    return written
+
+
+def _apply_name_writes(written):
+    for model, change in written.items():
+        index = _INDEXES[model][0]
+        if change == 'changed':
+            index.invalidate()
+        else:
+            index.expire()
+
+
+def init_name_matching(app, session_class):
+    """Set the refresh interval from ``app.config`` and follow this worker's commits."""
+    for index, _ in _INDEXES.values():
+        index.ttl = app.config.get('NAME_MATCH_TTL', 60)
+    after_commit(session_class, _collect_name_writes, _apply_name_writes)
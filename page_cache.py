@@ -0,0 +1,212 @@
+"""
+Rendered-page and fragment cache for the case listings.
+
+The home page and /browse only change when a case or a found person is
+written, yet every hit used to re-run their queries and re-render every
+card. Triggers on ``missing_person`` and ``found_person`` bump a counter in
+the ``data_version`` table on every insert, update or delete, and every
+cache key includes that counter, so a write makes all older entries
+unreachable (they age out of the LRU) and nothing is ever served stale
+across workers for longer than the version check interval.
+
+Two layers share one LRU:
+
+* fragments -- the recent-cases/reunited sections of the home page, the
+  region list and each page of /browse cards, cached for every visitor
+  (keys include whether the visitor is logged in where the markup differs);
+* whole pages -- complete responses for anonymous GETs of ``@cached_page``
+  views, with a strong ETag so repeat visitors get a 304.
+
+Each worker reads the counter at most once per ``PAGE_CACHE_VERSION_SECONDS``
+and re-reads it right after committing such a write itself.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_login import current_user
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from database import after_commit
+from models import db, DataVersion, FoundPerson, MissingPerson
+
+VERSION_NAME = 'cases'
+
+VERSION_SCHEMA = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS data_version_{table}_{verb.lower()} AFTER {verb} ON {table} BEGIN
+        UPDATE data_version SET version = version + 1 WHERE name = '{VERSION_NAME}';
+    END
+    """
+    for table in ('missing_person', 'found_person')
+    for verb in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Response headers kept with a cached page
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+
+class PageCache:
+    """LRU of rendered output with a TTL per entry and hit/miss counters."""
+
+    def __init__(self, maxsize=500, ttl=300, version_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.enabled = True
+        self._entries = OrderedDict()  # key -> (value, expires)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+        self._triggers_ready = {}
+        self.stats = {kind: {'hits': 0, 'misses': 0} for kind in ('page', 'fragment')}
+        self.evictions = 0
+
+    def get(self, key, kind):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats[kind]['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.stats[kind]['misses'] += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ensure_triggers(self):
+        """Create the version row and the triggers that bump it. Returns True when usable."""
+        engine = db.engine
+        if engine.url in self._triggers_ready:
+            return self._triggers_ready[engine.url]
+        ready = engine.dialect.name == 'sqlite'
+        if ready:
+            try:
+                DataVersion.__table__.create(engine, checkfirst=True)
+                with engine.begin() as conn:
+                    conn.execute(text('INSERT OR IGNORE INTO data_version (name, version) VALUES (:name, 0)'),
+                                 {'name': VERSION_NAME})
+                    for statement in VERSION_SCHEMA:
+                        conn.execute(text(statement))
+            except OperationalError as e:
+                print(f"Page cache disabled, cannot track data version: {e}")
+                ready = False
+        self._triggers_ready[engine.url] = ready
+        return ready
+
+    def version(self):
+        """Current data version, or None when it cannot be tracked (cache off)."""
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked < self.version_interval:
+            return self._version
+        if not self.ensure_triggers():
+            return None
+        version = db.session.query(DataVersion.version).filter(DataVersion.name == VERSION_NAME).scalar()
+        self._version, self._version_checked = version, now
+        return version
+
+    def expire_version(self):
+        """Re-read the version on next use (this worker just wrote)."""
+        self._version_checked = 0.0
+
+    def render(self):
+        """Prometheus counter lines for /metrics."""
+        lines = ['# HELP loket_page_cache_requests_total Page cache lookups.',
+                 '# TYPE loket_page_cache_requests_total counter']
+        for kind, counts in sorted(self.stats.items()):
+            for result, count in sorted(counts.items()):
+                lines.append(f'loket_page_cache_requests_total{{kind="{kind}",result="{result}"}} {count}')
+        lines += ['# HELP loket_page_cache_evictions_total Entries pushed out of the LRU.',
+                  '# TYPE loket_page_cache_evictions_total counter',
+                  f'loket_page_cache_evictions_total {self.evictions}',
+                  '# HELP loket_page_cache_entries Entries held by this worker.',
+                  '# TYPE loket_page_cache_entries gauge',
+                  f'loket_page_cache_entries {len(self)}']
+        return lines
+
+
+page_cache = PageCache()
+
+
+def fragment(key, build):
+    """``build()``, cached under ``key`` for the current data version."""
+    version = page_cache.version() if page_cache.enabled else None
+    if version is None:
+        return build()
+    key = ('fragment', version) + tuple(key)
+    value = page_cache.get(key, 'fragment')
+    if value is None:
+        value = build()
+        page_cache.put(key, value)
+    return value
+
+
+def cacheable_request():
+    """Anonymous GET with nothing flashed: the page is the same for everyone."""
+    return (request.method == 'GET' and not current_user.is_authenticated
+            and not session.get('_flashes'))
+
+
+def cached_page(view):
+    """Serve anonymous GETs of ``view`` from the page cache, with ETag/304."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = page_cache.version() if page_cache.enabled and cacheable_request() else None
+        if version is None:
+            return view(*args, **kwargs)
+
+        key = ('page', version, request.endpoint, tuple(sorted(request.args.items(multi=True))))
+        cached = page_cache.get(key, 'page')
+        if cached is None:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+            cached = (body, headers, hashlib.sha1(body).hexdigest())
+            page_cache.put(key, cached)
+
+        body, headers, etag = cached
+        response = current_app.response_class(body, headers=headers)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # always revalidate; 304 when unchanged
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+    return wrapper
+
+
+def _collect_writes(session, written):
+    return written or any(isinstance(obj, (MissingPerson, FoundPerson))
+                          for obj in list(session.new) + list(session.dirty) + list(session.deleted))
+
+
+def _expire_after_commit(written):
+    page_cache.expire_version()
+
+
+def init_page_cache(app, session_class):
+    """Configure the cache from ``app.config`` and watch this worker's commits."""
+    page_cache.enabled = app.config.get('PAGE_CACHE', True)
+    page_cache.maxsize = app.config.get('PAGE_CACHE_SIZE', 500)
+    page_cache.ttl = app.config.get('PAGE_CACHE_TTL', 300)
+    page_cache.version_interval = app.config.get('PAGE_CACHE_VERSION_SECONDS', 1.0)
+    after_commit(session_class, _collect_writes, _expire_after_commit)
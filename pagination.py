@@ -0,0 +1,69 @@
+"""
+Keyset (cursor) pagination for case listings.
+
+Instead of OFFSET, each page continues strictly after the sort key of the
+last row already sent, so page N costs the same as page 1 and rows inserted
+meanwhile never shift or duplicate results. Queries paginated here must
+order by ``(sort_value, id)`` in a single direction.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value, row_id):
+    """Pack the sort key of the last row sent into an opaque URL-safe token."""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, is_datetime=False):
+    """Unpack a token from ``encode_cursor``; raises ValueError if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if is_datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Clamp a user supplied ``limit`` parameter to a sane page size."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def after_cursor(query, sort_column, id_column, cursor, descending):
+    """Restrict ``query`` to rows that sort after ``cursor``."""
+    if not cursor:
+        return query
+    sort_value, row_id = cursor
+    key = tuple_(sort_column, id_column)
+    if descending:
+        return query.filter(key < tuple_(sort_value, row_id))
+    return query.filter(key > tuple_(sort_value, row_id))
+
+
+def fetch_page(query, size, key):
+    """Fetch one page plus a look-ahead row.
+
+    ``key`` maps a row to its ``(sort_value, id)`` pair. Returns the rows of
+    the page and the cursor for the next one (None on the last page).
+    """
+    rows = query.limit(size + 1).all()
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(*key(rows[-1]))
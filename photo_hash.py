@@ -0,0 +1,162 @@
+"""
+Perceptual-hash photo index.
+
+Every case photo gets a 64-bit difference hash (dHash) when it is
+processed. Visually similar photos (re-encoded, resized, lightly cropped or
+recoloured copies) have hashes a small Hamming distance apart, so finding
+possible duplicates is a nearest-neighbour search over 64-bit integers.
+
+The index keeps all open-case hashes of a worker in one NumPy ``uint64``
+array and answers a query with a single vectorized XOR + popcount pass,
+which takes a few milliseconds even for hundreds of thousands of photos.
+"""
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from models import db, MissingPerson
+
+HASH_SIZE = 8
+
+# Distances up to this are reported as possible matches by default
+DEFAULT_MAX_DISTANCE = 10
+
+# Masks for the SWAR popcount used on NumPy versions without bitwise_count
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def dhash(image):
+    """64-bit difference hash of a Pillow image.
+
+    The image is shrunk to 9x8 greyscale and each bit records whether a
+    pixel is brighter than its right-hand neighbour.
+    """
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_file(path):
+    """dHash of an image file, or None if it cannot be read."""
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (64, 64))  # JPEGs can decode straight to a tiny size
+            return dhash(ImageOps.exif_transpose(image))
+    except Exception as e:
+        print(f"Error hashing image {path}: {e}")
+        return None
+
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed SQL INTEGER column."""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+def popcount(values):
+    """Number of set bits in each element of a ``uint64`` array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    values = values - ((values >> np.uint64(1)) & _M1)
+    values = (values & _M2) + ((values >> np.uint64(2)) & _M2)
+    values = (values + (values >> np.uint64(4))) & _M4
+    return (values * _H01) >> np.uint64(56)
+
+
+class PhotoHashIndex:
+    """In-memory Hamming-distance index over open cases' photo hashes.
+
+    Loaded lazily from the database and reloaded after ``ttl`` seconds so
+    hashes recorded by other workers show up; hashes recorded by this worker
+    are added immediately.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._pending = {}
+        self._loaded_at = None
+
+    def load(self):
+        rows = db.session.query(MissingPerson.id, MissingPerson.photo_hash) \
+            .filter(MissingPerson.photo_hash.isnot(None), MissingPerson.is_found == False) \
+            .all()
+        with self._lock:
+            self._ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            self._hashes = np.fromiter((row[1] for row in rows), dtype=np.int64,
+                                       count=len(rows)).view(np.uint64)
+            self._pending = {}
+            self._loaded_at = time.monotonic()
+
+    def add(self, person_id, photo_hash):
+        with self._lock:
+            self._pending[person_id] = to_unsigned(photo_hash)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _arrays(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.load()
+        with self._lock:
+            if self._pending:
+                known = set(self._ids.tolist())
+                new = [(i, h) for i, h in self._pending.items() if i not in known]
+                if new:
+                    self._ids = np.concatenate([self._ids, np.array([i for i, _ in new], dtype=np.int64)])
+                    self._hashes = np.concatenate([self._hashes, np.array([h for _, h in new], dtype=np.uint64)])
+                self._pending = {}
+            return self._ids, self._hashes
+
+    def search(self, photo_hash, max_distance=DEFAULT_MAX_DISTANCE, limit=20, exclude=None):
+        """Closest photos to ``photo_hash`` as ``[(person_id, distance), ...]``."""
+        ids, hashes = self._arrays()
+        if not len(ids):
+            return []
+        distances = popcount(hashes ^ np.uint64(to_unsigned(photo_hash)))
+        candidates = np.flatnonzero(distances <= max_distance)
+        if exclude is not None:
+            candidates = candidates[ids[candidates] != exclude]
+        if len(candidates) > limit:
+            nearest = np.argpartition(distances[candidates], limit)[:limit]
+            candidates = candidates[nearest]
+        order = np.lexsort((ids[candidates], distances[candidates]))
+        return [(int(ids[i]), int(distances[i])) for i in candidates[order]]
+
+    def __len__(self):
+        return len(self._arrays()[0])
+
+
+photo_index = PhotoHashIndex()
+
+
+def find_similar(photo_hash, max_distance=DEFAULT_MAX_DISTANCE, limit=20, exclude=None):
+    """Open cases whose photo looks like ``photo_hash``, closest first.
+
+    Returns ``[(MissingPerson, distance), ...]``.
+    """
+    if photo_hash is None:
+        return []
+    matches = photo_index.search(photo_hash, max_distance, limit, exclude)
+    if not matches:
+        return []
+    people = {person.id: person for person in
+              MissingPerson.query.filter(MissingPerson.id.in_([i for i, _ in matches]))}
+    return [(people[i], distance) for i, distance in matches
+            if i in people and not people[i].is_found]
@@ -0,0 +1,126 @@
+"""
+Password-reset tokens.
+
+Two kinds of token are accepted by ``/reset-password/<token>``:
+
+* ``signed`` (the default ``RESET_TOKEN_MODE``) -- the user id and a
+  fingerprint of the user's current password hash, signed with the app's
+  secret key and timestamped. Issuing one writes nothing to the database
+  and checking one is a single primary-key lookup. Setting a new password
+  changes the hash, so a used token (and any other outstanding one) stops
+  matching: one-time use without storing anything.
+* ``table`` -- a random token stored in ``password_reset_token``, the
+  original scheme, kept for deployments that want revocable rows.
+
+Links already sent keep working when the mode changes, since the two
+formats cannot be confused (signed tokens contain dots, random ones do not).
+
+Expired and used rows of ``password_reset_token`` are deleted by a purge
+thread in each web worker every ``RESET_TOKEN_PURGE_SECONDS``, or by
+``flask purge-reset-tokens`` from cron.
+"""
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import delete, select
+
+from models import db, User, PasswordResetToken
+
+TOKEN_SALT = 'password-reset'
+DEFAULT_MAX_AGE = 3600
+PURGE_BATCH = 1000
+
+_purge_worker = None
+_purge_lock = threading.Lock()
+
+
+def serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def password_fingerprint(user):
+    """Short keyed digest of the password hash; changes whenever the password does."""
+    key = current_app.config['SECRET_KEY'].encode()
+    return hashlib.blake2b(user.password_hash.encode(), key=key[:64], digest_size=12).hexdigest()
+
+
+def issue_reset_token(user, mode='signed', max_age=DEFAULT_MAX_AGE):
+    """A token for ``user``'s reset link."""
+    if mode == 'table':
+        return PasswordResetToken.generate_token(user.id, max_age).token
+    return serializer().dumps([user.id, password_fingerprint(user)])
+
+
+def resolve_reset_token(token, max_age=DEFAULT_MAX_AGE):
+    """``(user, row)`` for a valid token, ``row`` being the stored token if any.
+
+    Returns ``(None, None)`` for tokens that are unknown, expired, tampered
+    with or already used.
+    """
+    if '.' not in token:
+        row = PasswordResetToken.query.filter_by(token=token).first()
+        if row is None or not row.is_valid():
+            return None, None
+        return row.user, row
+
+    try:
+        user_id, fingerprint = serializer().loads(token, max_age=max_age)
+    except (BadSignature, TypeError, ValueError):
+        return None, None  # SignatureExpired is a BadSignature
+    user = db.session.get(User, user_id)
+    if user is None or not hmac.compare_digest(str(fingerprint), password_fingerprint(user)):
+        return None, None
+    return user, None
+
+
+def purge_reset_tokens(batch_size=PURGE_BATCH):
+    """Delete expired and used stored tokens, one short transaction per batch. Returns how many."""
+    now = datetime.utcnow()
+    purged = 0
+    while True:
+        stale = select(PasswordResetToken.id) \
+            .where((PasswordResetToken.used == True) | (PasswordResetToken.expires_at < now)) \
+            .limit(batch_size)
+        result = db.session.execute(
+            delete(PasswordResetToken).where(PasswordResetToken.id.in_(stale.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            return purged
+
+
+class PurgeWorker(threading.Thread):
+    """Background thread that purges stale reset tokens for this process."""
+
+    def __init__(self, app, interval):
+        super().__init__(name='reset-token-purge', daemon=True)
+        self.app = app
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    purged = purge_reset_tokens()
+                if purged:
+                    print(f"🧹 Purged {purged} expired or used reset token(s)")
+            except Exception as e:
+                print(f"❌ Reset token purge error: {e}")
+            time.sleep(self.interval)
+
+
+def start_purge_worker(app, interval):
+    """Start this process's purge thread once; safe to call repeatedly."""
+    global _purge_worker
+    with _purge_lock:
+        if _purge_worker is None:
+            _purge_worker = PurgeWorker(app, interval)
+            _purge_worker.start()
+    return _purge_worker
@@ -0,0 +1,217 @@
+"""
+Full-text search for missing person cases.
+
+Cases are indexed in an SQLite FTS5 shadow table (``missing_person_fts``)
+over name, description and last_seen. Triggers on ``missing_person`` keep
+the index up to date whenever a case is inserted, edited or deleted, so
+``report_missing`` and any later edits need no extra code. When FTS5 is not
+available (other database backends, SQLite built without it) the original
+ILIKE filter is used instead.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import func, literal, literal_column, column, table, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, User, MissingPerson
+from pagination import after_cursor, decode_cursor
+
+FTS_TABLE = 'missing_person_fts'
+
+# Sentinels wrapped around matched terms by highlight()/snippet(). They are
+# swapped for <mark> tags only after the surrounding text has been escaped.
+MARK_OPEN = '\x02'
+MARK_CLOSE = '\x03'
+
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, last_seen,
+        content='missing_person', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS missing_person_fts_ai AFTER INSERT ON missing_person BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, last_seen)
+        VALUES (new.id, new.name, new.description, new.last_seen);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS missing_person_fts_ad AFTER DELETE ON missing_person BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, last_seen)
+        VALUES ('delete', old.id, old.name, old.description, old.last_seen);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS missing_person_fts_au
+    AFTER UPDATE OF name, description, last_seen ON missing_person BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, last_seen)
+        VALUES ('delete', old.id, old.name, old.description, old.last_seen);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, last_seen)
+        VALUES (new.id, new.name, new.description, new.last_seen);
+    END
+    """,
+]
+
+# Column weights for bm25(): a hit in the name counts far more than one in
+# the free-text description or location.
+RANK_WEIGHTS = (10.0, 1.0, 2.0)
+
+_fts_ready = {}
+
+fts = table(FTS_TABLE, column('rowid'))
+fts_match = literal_column(FTS_TABLE)
+
+
+def ensure_search_index(rebuild=False):
+    """Create the FTS5 table and its triggers; backfill it if it is new.
+
+    Returns True when the index is usable.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _fts_ready[engine.url] = False
+        return False
+
+    try:
+        with engine.begin() as conn:
+            existed = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first() is not None
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if rebuild or not existed:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError as e:
+        print(f"Full-text search unavailable, using ILIKE fallback: {e}")
+        _fts_ready[engine.url] = False
+        return False
+
+    _fts_ready[engine.url] = True
+    return True
+
+
+def fts_available():
+    """Whether searches can use the FTS5 index (checked once per engine)."""
+    ready = _fts_ready.get(db.engine.url)
+    if ready is None:
+        ready = ensure_search_index()
+    return ready
+
+
+def match_expression(query):
+    """Turn free user input into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so ``sar john`` matches
+    "Sarah Johnson" and FTS5 operators typed by users are never interpreted.
+    Returns None when the input holds no searchable words.
+    """
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight_markup(value):
+    """Escape an FTS5 snippet/highlight and turn its sentinels into <mark> tags."""
+    if not value:
+        return None
+    escaped = str(escape(value))
+    return Markup(escaped.replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
+
+
+def case_columns():
+    """Columns the case listings and the search API actually render.
+
+    Selecting these (plus the reporter's name through a join) instead of
+    full ``MissingPerson`` entities keeps listings to one query with no
+    per-row reporter lookups and no ORM identity-map overhead.
+    """
+    return (
+        MissingPerson.id,
+        MissingPerson.name,
+        MissingPerson.age,
+        MissingPerson.gender,
+        MissingPerson.last_seen,
+        MissingPerson.last_seen_date,
+        MissingPerson.region,
+        MissingPerson.description,
+        MissingPerson.contact_name,
+        MissingPerson.contact_phone,
+        MissingPerson.photo_url.label('photo_url'),
+        MissingPerson.photo_renditions,
+        User.name.label('reporter_name'),
+    )
+
+
+def search_cases(query='', region='', cursor=None):
+    """Build the active-case query used by /browse and /api/search.
+
+    Rows carry the ``case_columns`` plus ``snippet`` and ``sort_value`` and
+    are ordered by ``(sort_value, id)`` so they can be keyset paginated;
+    ``cursor`` is a token from ``pagination.fetch_page`` and raises
+    ValueError if malformed.
+
+    With a search term and a working index, cases are ranked by relevance
+    (``sort_value`` is the bm25 score) and ``snippet`` holds the best matching
+    fragment (pass it through ``highlight_markup``). Otherwise cases are
+    ordered newest first, ``sort_value`` is ``date_reported`` and ``snippet``
+    is None.
+    """
+    expression = match_expression(query) if query else None
+
+    if expression and fts_available():
+        snippet = func.snippet(fts_match, -1, MARK_OPEN, MARK_CLOSE, '…', 16)
+        rank = func.bm25(fts_match, *RANK_WEIGHTS)
+        results = db.session.query(*case_columns(), snippet.label('snippet'), rank.label('sort_value')) \
+            .join(User, User.id == MissingPerson.reported_by) \
+            .join(fts, fts.c.rowid == MissingPerson.id) \
+            .filter(fts_match.match(expression)) \
+            .filter(MissingPerson.is_found == False)
+        results = after_cursor(results, rank, MissingPerson.id,
+                               decode_cursor(cursor) if cursor else None, descending=False)
+        results = results.order_by(rank, MissingPerson.id)
+    else:
+        results = db.session.query(*case_columns(), literal(None).label('snippet'),
+                                   MissingPerson.date_reported.label('sort_value')) \
+            .join(User, User.id == MissingPerson.reported_by) \
+            .filter(MissingPerson.is_found == False)
+        if query:
+            results = results.filter(
+                (MissingPerson.name.ilike(f'%{query}%')) |
+                (MissingPerson.description.ilike(f'%{query}%'))
+            )
+        results = after_cursor(results, MissingPerson.date_reported, MissingPerson.id,
+                               decode_cursor(cursor, is_datetime=True) if cursor else None,
+                               descending=True)
+        results = results.order_by(MissingPerson.date_reported.desc(), MissingPerson.id.desc())
+
+    if region:
+        results = results.filter(MissingPerson.region == region)
+
+    return results
+
+
+def filter_matching(results, query):
+    """Restrict a ``MissingPerson`` query to the cases ``search_cases`` would find.
+
+    Same index and ILIKE fallback, without ranking or snippets, for counts.
+    """
+    expression = match_expression(query) if query else None
+    if expression and fts_available():
+        return results.join(fts, fts.c.rowid == MissingPerson.id).filter(fts_match.match(expression))
+    if query:
+        return results.filter(
+            (MissingPerson.name.ilike(f'%{query}%')) |
+            (MissingPerson.description.ilike(f'%{query}%'))
+        )
+    return results
+
+
+def row_key(row):
+    """Keyset pagination key of a ``search_cases`` row."""
+    return row.sort_value, row.id
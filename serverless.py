@@ -0,0 +1,84 @@
+"""
+Cold-start profile for serverless deployments (see vercel.json).
+
+A serverless function imports app.py on every cold start and may serve a
+single request before it is frozen, so startup work counts against that
+request. With ``SERVERLESS`` on (the default when the ``VERCEL`` variable
+is set):
+
+* heavy modules (Pillow, NumPy, smtplib, the process pool) are imported by
+  the routes that need them, not by app.py -- see images.py and mailer.py;
+* photos are rendered inline (``IMAGE_WORKERS=0``) and assets are not
+  rebuilt at startup, since there are no background processes and only
+  ``/tmp`` is writable;
+* compiled templates are kept in ``TEMPLATE_CACHE_DIR``, so only the first
+  process on an instance compiles them -- or none, when the directory is
+  filled at build time with ``flask compile-templates``;
+* the schema and seed data are checked once per process, on the first
+  request, with two cheap queries; only a database that is missing tables,
+  migrations or its admin user goes through the full ``init_db``.
+
+    python benchmark.py --mode startup
+"""
+import os
+import threading
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import OperationalError
+
+from migrations import pending_migrations
+from models import User
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Jinja bytecode cache that keeps working on a read-only directory."""
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass  # shipped read-only: serve what is there, compile the rest in memory
+
+
+def init_template_cache(app, directory):
+    """Load compiled templates from (and save them to) ``directory``."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        pass
+    app.jinja_env.bytecode_cache = TemplateBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Compile every template into the bytecode cache. Returns how many."""
+    names = app.jinja_env.list_templates(extensions=('html', 'txt'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def schema_ready():
+    """Whether the database has every table, migration and the seed data."""
+    try:
+        return not pending_migrations() and User.query.first() is not None
+    except OperationalError:
+        return False  # no schema_migrations or user table yet
+
+
+def prepare_once(app, prepare):
+    """Make sure the database is usable before the first request of this process.
+
+    ``prepare`` (``init_db``) only runs when ``schema_ready`` says it must.
+    """
+    lock = threading.Lock()
+    state = {'ready': False}
+
+    @app.before_request
+    def ensure_prepared():
+        if state['ready']:
+            return
+        with lock:
+            if not state['ready']:
+                if not schema_ready():
+                    prepare()
+                state['ready'] = True
@@ -0,0 +1,223 @@
+"""
+Sighting intake and the review queue.
+
+After a media appeal one case can get thousands of tips an hour, many of
+them the same caller phoning or posting again. ``submit_sightings`` takes a
+batch of tips, validates each one, collapses near-duplicates and writes the
+rest with one executemany-style INSERT. A tip is a near-duplicate when the
+same reporter contact already reported a sighting of the same case within
+``window`` of its sighting time; instead of a new row, the earlier
+report's ``duplicates`` counter goes up, so reviewers see one row with
+"+N repeats". Two workers accepting the same tip at the same instant may
+both insert it; the window check is a filter, not a constraint.
+
+The review queue reads ``(missing_person_id, status, date_reported)`` (or
+``(status, date_reported)`` across all cases) straight from its index and
+is keyset paginated like the case listings.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, func, insert, update
+
+from models import db, MissingPerson, SightingReport
+from pagination import after_cursor, decode_cursor
+
+SIGHTING_STATUSES = ('pending', 'reviewed', 'contacted', 'invalid')
+
+REQUIRED_FIELDS = ['missing_person_id', 'location', 'sighting_date', 'reporter_name', 'reporter_contact']
+
+MAX_LENGTHS = {column.name: column.type.length for column in SightingReport.__table__.columns
+               if getattr(column.type, 'length', None)}
+
+# Tips accepted in one request
+MAX_BATCH = 1000
+
+DEFAULT_DEDUP_WINDOW = timedelta(minutes=30)
+
+
+def normalize_contact(contact):
+    """Compare phone numbers by digits and email addresses case-insensitively."""
+    contact = contact.strip()
+    if '@' in contact:
+        return contact.lower()
+    digits = re.sub(r'[\s\-().]', '', contact)
+    return digits if re.fullmatch(r'\+?\d+', digits) else contact
+
+
+def validate_sighting(record):
+    """Check one submitted tip.
+
+    Returns ``(values, error)``; values is a dict of ``SightingReport``
+    columns ready to insert, error a message or None.
+    """
+    if not isinstance(record, dict):
+        return None, "expected a JSON object"
+
+    values = {}
+    for field in REQUIRED_FIELDS + ['details']:
+        value = record.get(field)
+        values[field] = str(value).strip() if value is not None else ''
+
+    missing = [field for field in REQUIRED_FIELDS if not values[field]]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+
+    for field, length in MAX_LENGTHS.items():
+        if len(values.get(field, '')) > length:
+            return None, f"{field} longer than {length} characters"
+
+    try:
+        values['missing_person_id'] = int(values['missing_person_id'])
+    except ValueError:
+        return None, f"missing_person_id {values['missing_person_id']!r} is not a number"
+
+    try:
+        values['sighting_date'] = datetime.fromisoformat(values['sighting_date'])
+    except ValueError:
+        return None, f"sighting_date {values['sighting_date']!r} is not an ISO date/time"
+    if values['sighting_date'].tzinfo is not None:
+        # Stored naive in UTC, like every other timestamp
+        values['sighting_date'] = values['sighting_date'].astimezone(timezone.utc).replace(tzinfo=None)
+
+    latitude, longitude = record.get('latitude'), record.get('longitude')
+    if latitude is not None or longitude is not None:
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return None, "latitude and longitude must both be numbers"
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None, "latitude or longitude out of range"
+        values['latitude'], values['longitude'] = latitude, longitude
+
+    values['details'] = values['details'] or None
+    values['reporter_contact'] = normalize_contact(values['reporter_contact'])
+    return values, None
+
+
+def dedup_key(values):
+    return values['missing_person_id'], values['reporter_contact']
+
+
+def find_duplicate(earlier, sighting_date, window):
+    """The first of ``earlier`` (``(id, sighting_date)`` pairs) within ``window``."""
+    for row_id, seen in earlier:
+        if abs(seen - sighting_date) <= window:
+            return row_id
+    return None
+
+
+def submit_sightings(records, reporter_id=None, window=DEFAULT_DEDUP_WINDOW, places=None):
+    """Validate, de-duplicate and store a batch of tips.
+
+    ``places`` is an optional ``geo.Gazetteer`` for tips without
+    coordinates. Returns ``{'accepted', 'duplicates', 'errors'}``, where
+    errors lists ``{'index', 'error'}`` for rejected tips.
+    """
+    errors = []
+    valid = []
+    for index, record in enumerate(records):
+        values, error = validate_sighting(record)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            valid.append((index, values))
+
+    # Tips must be about an open case
+    case_ids = {values['missing_person_id'] for _, values in valid}
+    open_cases = {row[0] for row in db.session.query(MissingPerson.id)
+                  .filter(MissingPerson.id.in_(list(case_ids)), MissingPerson.is_found == False)} if case_ids else set()
+    accepted = []
+    for index, values in valid:
+        if values['missing_person_id'] in open_cases:
+            accepted.append(values)
+        else:
+            errors.append({'index': index, 'error': f"no open case {values['missing_person_id']}"})
+
+    # Earlier reports from the same contacts about the same cases, in one query
+    earlier = {}
+    if accepted:
+        dates = [values['sighting_date'] for values in accepted]
+        rows = db.session.query(SightingReport.id, SightingReport.missing_person_id,
+                                SightingReport.reporter_contact, SightingReport.sighting_date) \
+            .filter(SightingReport.missing_person_id.in_(list(open_cases)),
+                    SightingReport.reporter_contact.in_(list({values['reporter_contact'] for values in accepted})),
+                    SightingReport.sighting_date.between(min(dates) - window, max(dates) + window)) \
+            .all()
+        for row in rows:
+            earlier.setdefault((row.missing_person_id, row.reporter_contact), []) \
+                .append((row.id, row.sighting_date))
+
+    new_rows = []
+    repeats = {}  # existing row id -> extra repeats
+    pending = {}  # dedup key -> [(position in new_rows, sighting_date)]
+    for values in accepted:
+        key = dedup_key(values)
+        duplicate_of = find_duplicate(earlier.get(key, ()), values['sighting_date'], window)
+        if duplicate_of is not None:
+            repeats[duplicate_of] = repeats.get(duplicate_of, 0) + 1
+            continue
+        position = find_duplicate(pending.get(key, ()), values['sighting_date'], window)
+        if position is not None:
+            new_rows[position]['duplicates'] += 1
+            continue
+        if 'latitude' not in values and places is not None:
+            point = places.lookup(values['location'])
+            if point:
+                values['latitude'], values['longitude'] = point
+        values.update(reported_by=reporter_id, status='pending', duplicates=0,
+                      date_reported=datetime.utcnow())
+        values.setdefault('latitude', None)
+        values.setdefault('longitude', None)
+        pending.setdefault(key, []).append((len(new_rows), values['sighting_date']))
+        new_rows.append(values)
+
+    if new_rows:
+        db.session.execute(insert(SightingReport), new_rows)
+    if repeats:
+        # Incremented in SQL, so concurrent repeats of the same tip all count
+        sighting = SightingReport.__table__
+        db.session.execute(
+            update(sighting).where(sighting.c.id == bindparam('row_id'))
+            .values(duplicates=func.coalesce(sighting.c.duplicates, 0) + bindparam('repeats')),
+            [{'row_id': row_id, 'repeats': count} for row_id, count in repeats.items()]
+        )
+    db.session.commit()
+
+    errors.sort(key=lambda error: error['index'])
+    return {
+        'accepted': len(new_rows),
+        'duplicates': len(accepted) - len(new_rows),
+        'errors': errors,
+    }
+
+
+def review_queue(status='pending', case_id=None, cursor=None):
+    """Sightings awaiting review, newest report first.
+
+    ``cursor`` is a token from ``pagination.fetch_page`` and raises
+    ValueError if malformed.
+    """
+    query = SightingReport.query.filter(SightingReport.status == status)
+    if case_id is not None:
+        query = query.filter(SightingReport.missing_person_id == case_id)
+    query = after_cursor(query, SightingReport.date_reported, SightingReport.id,
+                         decode_cursor(cursor, is_datetime=True) if cursor else None, descending=True)
+    return query.order_by(SightingReport.date_reported.desc(), SightingReport.id.desc())
+
+
+def queue_key(sighting):
+    """Keyset pagination key of a ``review_queue`` row."""
+    return sighting.date_reported, sighting.id
+
+
+def set_status(ids, status):
+    """Move the given sightings to ``status`` in one UPDATE; returns the row count."""
+    if status not in SIGHTING_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(SIGHTING_STATUSES)}")
+    result = db.session.execute(
+        update(SightingReport).where(SightingReport.id.in_(ids)).values(status=status),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,188 @@
+"""
+Concurrency stress test for the SQLite engine profiles.
+
+Runs reader processes (browsing and searching through the Flask test
+client) alongside writer processes (filing reports the way
+``report_missing`` does) and one long transaction that holds the write
+lock for --hold-ms at a time (as a bulk import or a large commit does),
+first with SQLite's stock settings and then with the ``wal`` profile from
+database.py, and compares how long readers waited:
+
+    python stress_sqlite.py [--seconds 10] [--readers 4] [--writers 2] [--hold-ms 500]
+
+Under the stock rollback journal a committing writer locks readers out,
+so some reads take as long as the lock is held (or fail with "database is
+locked"). Under WAL readers never wait for writers. The run fails if,
+with the wal profile, any read errors or takes as long as the lock hold.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+PROFILES = ['default', 'wal']
+READ_URLS = ['/api/search', '/api/search?region=Coast', '/browse', '/api/search?q=jacket']
+REGIONS = ['Nairobi', 'Coast', 'Rift Valley', 'Central', 'Western']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        'count': len(latencies),
+        'per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(max(latencies, default=0) * 1000, 1),
+        'errors': errors,
+    }
+
+
+def reader(app, deadline, results):
+    client = app.test_client()
+    latencies, errors = [], 0
+    i = 0
+    while time.monotonic() < deadline:
+        url = READ_URLS[i % len(READ_URLS)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            status = client.get(url).status_code
+        except Exception:
+            status = 500
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            errors += 1
+    results.put(('read', latencies, errors))
+
+
+def writer(app, deadline, results):
+    from models import db, MissingPerson
+
+    latencies, errors = [], 0
+    i = 0
+    with app.app_context():
+        while time.monotonic() < deadline:
+            i += 1
+            started = time.perf_counter()
+            try:
+                db.session.add(MissingPerson(
+                    name=f'Stress Case {os.getpid()}-{i}', age=30, gender='Female',
+                    last_seen='Bus station', last_seen_date=date.today(),
+                    region=REGIONS[i % len(REGIONS)],
+                    description='Wearing a green jacket and carrying a backpack.',
+                    contact_name='Family', contact_phone='(555) 000-0000',
+                    contact_email='family@example.com', reported_by=1))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    results.put(('write', latencies, errors))
+
+
+def lock_holder(app, deadline, hold, results):
+    """Repeatedly take the exclusive write lock and sit on it."""
+    from models import db
+
+    with app.app_context():
+        while time.monotonic() < deadline - hold:
+            connection = db.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute('BEGIN EXCLUSIVE')
+                cursor.execute('UPDATE missing_person SET description = description WHERE id = 1')
+                time.sleep(hold)
+                connection.commit()
+            finally:
+                connection.close()
+            time.sleep(hold)
+    results.put(('hold', [], 0))
+
+
+def run_profile(args):
+    """Child process: one profile, with DATABASE_URL etc. already set."""
+    from app import app, init_db
+
+    init_db()
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    deadline = time.monotonic() + 1 + args.seconds
+    workers = [ctx.Process(target=reader, args=(app, deadline, results)) for _ in range(args.readers)]
+    workers += [ctx.Process(target=writer, args=(app, deadline, results)) for _ in range(args.writers)]
+    workers.append(ctx.Process(target=lock_holder, args=(app, deadline, args.hold_ms / 1000, results)))
+    for process in workers:
+        process.start()
+
+    collected = {'read': [[], 0], 'write': [[], 0], 'hold': [[], 0]}
+    for _ in workers:
+        kind, latencies, errors = results.get()
+        collected[kind][0].extend(latencies)
+        collected[kind][1] += errors
+    for process in workers:
+        process.join()
+
+    seconds = args.seconds + 1
+    print(json.dumps({
+        'reads': summarize(*collected['read'], seconds),
+        'writes': summarize(*collected['write'], seconds),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--hold-ms', type=int, default=500)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args)
+        return 0
+
+    results = {}
+    for profile in PROFILES:
+        db_dir = tempfile.mkdtemp(prefix=f'loket-stress-{profile}-')
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(db_dir, 'loket.db')}",
+                   SQLITE_PROFILE=profile,
+                   DB_READ_ROUTING='1' if profile == 'wal' else '0',
+                   IMAGE_WORKERS='0', MAIL_WORKER='external')
+        print(f"Running {profile} profile: {args.readers} readers, {args.writers} writers, "
+              f"write lock held {args.hold_ms} ms at a time, {args.seconds}s")
+        output = subprocess.run(
+            [sys.executable, __file__, '--profile', profile, '--seconds', str(args.seconds),
+             '--readers', str(args.readers), '--writers', str(args.writers), '--hold-ms', str(args.hold_ms)],
+            env=env, check=True, capture_output=True, text=True).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"\n{'profile':<9} {'kind':<6} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for profile, result in results.items():
+        for kind in ('reads', 'writes'):
+            r = result[kind]
+            print(f"{profile:<9} {kind:<6} {r['per_second']:>8} {r['p50_ms']:>8} "
+                  f"{r['p99_ms']:>8} {r['max_ms']:>8} {r['errors']:>7}")
+
+    wal_reads = results['wal']['reads']
+    if wal_reads['errors'] or wal_reads['max_ms'] >= args.hold_ms:
+        print(f"\n❌ Readers were blocked under WAL (errors: {wal_reads['errors']}, "
+              f"slowest read: {wal_reads['max_ms']} ms)")
+        return 1
+    print("\n✅ No reader was blocked by a writer under WAL")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
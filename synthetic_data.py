@@ -0,0 +1,209 @@
+"""
+Synthetic dataset generator for benchmarks and load tests.
+
+    flask seed-synthetic 100k
+
+Fills ``user``, ``missing_person``, ``sighting_report`` and
+``found_person`` with rows shaped like production data: cases are spread
+unevenly over the regions (Nairobi and Rift Valley dominate), descriptions
+range from a few words to several paragraphs, about two thirds of cases
+have a photo, most cases have no sightings while a few have dozens, and a
+small share are marked found. Generation is seeded, so the same size
+always produces the same data.
+
+Rows go in with bulk INSERTs a chunk at a time (100k cases take well
+under a minute). Photos are a handful of sample images rendered once
+through the normal pipeline and shared between cases, so pages serve real
+renditions without generating a file per row.
+"""
+import os
+import random
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from images import render_photo
+from models import db, User, MissingPerson, FoundPerson, SightingReport
+from photo_hash import to_signed
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+SYNTHETIC_DOMAIN = 'synthetic.loket.org'
+SYNTHETIC_PASSWORD = 'password123'
+
+# (region, weight) -- roughly proportional to reports per region
+REGIONS = [
+    ('Nairobi', 30), ('Rift Valley', 22), ('Central', 12), ('Coast', 10),
+    ('Nyanza', 9), ('Western', 8), ('Eastern', 6), ('NorthEastern', 3),
+]
+GENDERS = [('Male', 52), ('Female', 46), ('Other', 2)]
+SIGHTING_STATUSES = [('pending', 50), ('reviewed', 30), ('contacted', 10), ('invalid', 10)]
+
+FIRST_NAMES = ['Achieng', 'Amina', 'Baraka', 'Brian', 'Chebet', 'David', 'Esther', 'Faith', 'Grace',
+               'Hassan', 'Imani', 'James', 'Joseph', 'Kamau', 'Kevin', 'Lucy', 'Mary', 'Mercy',
+               'Mohamed', 'Njeri', 'Otieno', 'Peter', 'Wanjiru', 'Wafula', 'Zawadi', 'Sarah',
+               'Daniel', 'Ruth', 'Samuel', 'Halima']
+LAST_NAMES = ['Ochieng', 'Mwangi', 'Kariuki', 'Wambui', 'Odhiambo', 'Kiptoo', 'Mutua', 'Njoroge',
+              'Omondi', 'Abdi', 'Kimani', 'Chepkoech', 'Wekesa', 'Barasa', 'Kamau', 'Were',
+              'Onyango', 'Johnson', 'Hussein', 'Maina']
+PLACES = ['bus stage', 'market', 'matatu terminus', 'school gate', 'hospital', 'church',
+          'shopping centre', 'railway station', 'beach', 'village centre', 'estate', 'stadium']
+DESCRIPTION_PHRASES = [
+    'last seen wearing a blue jacket', 'has a small scar above the left eyebrow',
+    'was carrying a black backpack', 'speaks Swahili and English', 'wears glasses',
+    'short black hair', 'medium build', 'about 170 cm tall', 'walks with a slight limp',
+    'was wearing a school uniform', 'red sweater and grey trousers', 'has braided hair',
+    'white sneakers', 'may be confused and need help', 'was on the way to visit relatives',
+    'has a birthmark on the right arm', 'green dress with a floral pattern',
+    'carrying a mobile phone that is now switched off', 'left home early in the morning',
+    'known to visit the local market often',
+]
+
+SAMPLE_PHOTOS = 8
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def description(rng):
+    """A few words to several paragraphs, skewed short like real reports."""
+    phrases = max(1, min(60, int(rng.lognormvariate(1.3, 0.8))))
+    return '. '.join(rng.choice(DESCRIPTION_PHRASES).capitalize() for _ in range(phrases)) + '.'
+
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def age(rng):
+    # Children and the elderly are over-represented among missing persons
+    bucket = rng.random()
+    if bucket < 0.35:
+        return rng.randint(3, 17)
+    if bucket < 0.85:
+        return rng.randint(18, 59)
+    return rng.randint(60, 95)
+
+
+def sighting_count(rng):
+    """Most cases get none, a few get many."""
+    if rng.random() < 0.6:
+        return 0
+    return min(40, int(rng.expovariate(0.4)) + 1)
+
+
+def sample_photos(upload_dir, originals_dir, rng):
+    """Render a few sample photos through the normal pipeline, once."""
+    renditions = []
+    for i in range(SAMPLE_PHOTOS):
+        basename = f"synthetic_{i}"
+        source = os.path.join(originals_dir, f"{basename}_orig.jpg")
+        if not os.path.exists(source):
+            image = Image.new('RGB', (1200, 1500), tuple(rng.randrange(60, 200) for _ in range(3)))
+            draw = ImageDraw.Draw(image)
+            draw.ellipse((350, 250, 850, 850), fill=tuple(rng.randrange(0, 255) for _ in range(3)))
+            draw.rectangle((250, 900, 950, 1500), fill=tuple(rng.randrange(0, 255) for _ in range(3)))
+            image.save(source, 'JPEG', quality=90)
+        renditions.append(render_photo(source, upload_dir, basename)[0])
+    return renditions
+
+
+def bulk_insert(model, rows):
+    if rows:
+        db.session.execute(insert(model), rows)
+
+
+def generate(size, upload_dir, originals_dir, seed=42, chunk_size=5000):
+    """Add ``size`` synthetic cases plus users, sightings and found persons.
+
+    Must run inside an app context. Returns a dict of row counts.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    counts = {'users': max(10, size // 50), 'cases': size, 'sightings': 0, 'found': max(5, size // 10)}
+
+    # Hashing is deliberately slow; every synthetic user shares one hash
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+    start = User.query.filter(User.email.like(f'%@{SYNTHETIC_DOMAIN}')).count()
+    bulk_insert(User, [{
+        'name': person_name(rng),
+        'email': f"user{start + i}@{SYNTHETIC_DOMAIN}",
+        'password_hash': password_hash,
+        'phone': f"07{rng.randrange(10**8):08d}",
+        'role': 'user',
+        'date_joined': now - timedelta(days=rng.randrange(730)),
+    } for i in range(counts['users'])])
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    print(f"  {counts['users']:,} users")
+
+    photos = sample_photos(upload_dir, originals_dir, rng)
+    first_case = (db.session.query(db.func.max(MissingPerson.id)).scalar() or 0) + 1
+    for offset in range(0, size, chunk_size):
+        rows = []
+        for _ in range(min(chunk_size, size - offset)):
+            reported = now - timedelta(seconds=rng.randrange(2 * 365 * 24 * 3600))
+            renditions = rng.choice(photos) if rng.random() < 0.65 else None
+            rows.append({
+                'name': person_name(rng),
+                'age': age(rng),
+                'gender': weighted(rng, GENDERS),
+                'last_seen': f"{rng.choice(PLACES).title()}, {weighted(rng, REGIONS)}",
+                'last_seen_date': (reported - timedelta(days=rng.randrange(30))).date(),
+                'region': weighted(rng, REGIONS),
+                'description': description(rng),
+                'contact_name': person_name(rng),
+                'contact_phone': f"07{rng.randrange(10**8):08d}",
+                'contact_email': f"family{rng.randrange(10**6)}@example.com",
+                'photo_filename': renditions['detail']['jpeg'] if renditions else None,
+                'photo_renditions': renditions,
+                'photo_hash': to_signed(rng.getrandbits(64)) if renditions else None,
+                'date_reported': reported,
+                'is_found': rng.random() < 0.08,
+                'reported_by': rng.choice(user_ids),
+            })
+        bulk_insert(MissingPerson, rows)
+        db.session.commit()
+        print(f"  {offset + len(rows):,} cases")
+
+    # Sightings for the new cases, after their report date
+    cases = db.session.query(MissingPerson.id, MissingPerson.date_reported) \
+        .filter(MissingPerson.id >= first_case).order_by(MissingPerson.id).yield_per(chunk_size)
+    rows = []
+    for case_id, reported in cases:
+        for _ in range(sighting_count(rng)):
+            seen = reported + timedelta(hours=rng.randrange(1, 24 * 90))
+            rows.append({
+                'missing_person_id': case_id,
+                'location': f"{rng.choice(PLACES).title()}, {weighted(rng, REGIONS)}",
+                'sighting_date': seen,
+                'details': rng.choice(DESCRIPTION_PHRASES).capitalize() if rng.random() < 0.7 else None,
+                'reporter_name': person_name(rng),
+                'reporter_contact': f"07{rng.randrange(10**8):08d}",
+                'date_reported': seen + timedelta(hours=rng.randrange(48)),
+                'reported_by': rng.choice(user_ids) if rng.random() < 0.5 else None,
+                'status': weighted(rng, SIGHTING_STATUSES),
+            })
+        if len(rows) >= chunk_size:
+            counts['sightings'] += len(rows)
+            bulk_insert(SightingReport, rows)
+            rows = []
+    counts['sightings'] += len(rows)
+    bulk_insert(SightingReport, rows)
+    db.session.commit()
+    print(f"  {counts['sightings']:,} sightings")
+
+    bulk_insert(FoundPerson, [{
+        'name': person_name(rng),
+        'age': age(rng),
+        'found_date': (now - timedelta(days=rng.randrange(730))).date(),
+        'reunited_with': f"Family in {weighted(rng, REGIONS)}",
+        'date_added': now - timedelta(seconds=rng.randrange(2 * 365 * 24 * 3600)),
+    } for _ in range(counts['found'])])
+    db.session.commit()
+    print(f"  {counts['found']:,} found persons")
+    return counts
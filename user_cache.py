@@ -0,0 +1,124 @@
+"""
+Per-worker cache of the logged-in user.
+
+Flask-Login calls ``load_user`` on every request of a logged-in session,
+which used to mean one ``SELECT ... FROM user`` per page view. Pages only
+show the user's name and check their role, so each worker keeps a small
+LRU of ``(name, role)`` per user id and hands Flask-Login a ``UserSnapshot``
+built from it. Anything else (``current_user.email`` on the profile page,
+``phone`` on the report form) loads the full ``User`` row on first access,
+once per request.
+
+Commits that change or delete a user drop that user's entry in this
+worker; other workers pick up the change when the entry's TTL runs out.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+from database import after_commit
+from models import db, User
+
+
+class UserSnapshot(UserMixin):
+    """The fields every page needs, with the ORM ``User`` behind it on demand."""
+
+    def __init__(self, id, name, role):
+        self.id = id
+        self.name = name
+        self.role = role
+        self._user = None
+
+    @property
+    def user(self):
+        """The full ``User`` row, loaded on first use."""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.id} {self.name!r}>'
+
+
+class UserCache:
+    """Bounded LRU of ``user id -> (name, role)`` with a TTL per entry."""
+
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # id -> (name, role, expires)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, name, role):
+        with self._lock:
+            self._entries[user_id] = (name, role, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache()
+
+
+def load_user_snapshot(user_id):
+    """``user_loader`` for Flask-Login: a snapshot, from the cache when possible."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    cached = user_cache.get(user_id)
+    if cached is None:
+        row = db.session.query(User.name, User.role).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        cached = (row.name, row.role)
+        user_cache.put(user_id, *cached)
+    return UserSnapshot(user_id, *cached)
+
+
+def _collect_changed_users(session, changed):
+    changed = changed or set()
+    changed.update(user.id for user in list(session.dirty) + list(session.deleted) if isinstance(user, User))
+    return changed
+
+
+def _invalidate_changed_users(changed):
+    for user_id in changed:
+        user_cache.invalidate(user_id)
+
+
+def init_user_cache(app, session_class):
+    """Size the cache from ``app.config`` and drop entries when users change."""
+    user_cache.maxsize = app.config.get('USER_CACHE_SIZE', 1000)
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', 60)
+    after_commit(session_class, _collect_changed_users, _invalidate_changed_users)